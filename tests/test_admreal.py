@@ -0,0 +1,132 @@
+#! /usr/bin/env python3
+
+"""Testing of monitoring of communities (vkts.admreal) by mocked requests"""
+
+import hashlib
+import json
+import os
+from vkts import admreal
+from vkts.vklib import MembershipLog
+
+
+def mock_responses(responses):
+    """Responses of the next requests (in the current directory)"""
+
+    with open('.mock_request_responses.json', 'w') as fp:
+        json.dump(responses, fp)
+
+
+def mocks_left():
+    with open('.mock_request_responses.json') as fp:
+        return len(json.load(fp))
+
+
+def fingerprint(ids):
+    return hashlib.sha1(json.dumps(ids).encode()).hexdigest()
+
+
+def test_01_check_groups(tmp_path, monkeypatch):
+
+    ###   unchanged group is skipped, closed one is skipped, changed is loaded
+    monkeypatch.chdir(tmp_path)
+    tg_dir = os.path.join('data', 'adm_groups') + os.sep
+    os.makedirs(tg_dir + 'same')
+    with open(tg_dir + 'same' + os.sep + 'probe.json', 'w') as f:
+        json.dump([3, fingerprint([1, 2, 3])], f)
+    os.makedirs(tg_dir + 'changed')
+    MembershipLog(tg_dir + 'changed' + os.sep + 'members.log').record([7])
+    mock_responses([
+        {'response': [[{'id': 1, 'members_count': 3},
+                       {'id': 2, 'members_count': 2},
+                       {'id': 3, 'members_count': 5},
+                       {'id': 4, 'is_closed': 1}]]},
+        {'response': [{'count': 3, 'items': [1, 2, 3]},
+                      {'count': 2, 'items': [7, 8]},
+                      False],
+         'execute_errors': [{'method': 'groups.getMembers',
+                             'error_code': 203,
+                             'error_msg': 'Access to group denied'}]},
+        {'response': [[{'id': 2, 'name': 'Changed', 'members_count': 2}]]},
+        {'response': [{'count': 2, 'items': [7, 8]}]}])
+    gr_list = [[1, 'same'], [2, 'changed'], [3, 'closed'], [4, 'banned']]
+    changes, calls, failed = admreal._check_groups(gr_list, tg_dir)
+    assert mocks_left() == 0
+    assert [(c[0], c[2], c[3]) for c in changes] == [([2, 'changed'], [], [8])]
+    assert failed == []
+    with open(tg_dir + 'changed' + os.sep + 'probe.json') as f:
+        assert json.load(f) == [2, fingerprint([7, 8])]
+    assert not os.path.isdir(tg_dir + 'closed')
+
+
+def test_02_failed_group(tmp_path, monkeypatch):
+
+    ###   group which isn't loaded is failed alone
+    monkeypatch.chdir(tmp_path)
+    tg_dir = os.path.join('data', 'adm_groups') + os.sep
+    mock_responses([
+        {'response': [[{'id': 1, 'members_count': 2},
+                       {'id': 2, 'members_count': 300}]]},
+        {'response': [{'count': 2, 'items': [1, 2]},
+                      {'count': 300, 'items': [5, 6]}]},
+        {'response': [[{'id': 1, 'name': 'A', 'members_count': 2},
+                       {'id': 2, 'name': 'B', 'members_count': 300}]]},
+        {'response': [{'count': 2, 'items': [1, 2]}, False],
+         'execute_errors': [{'method': 'groups.getMembers',
+                             'error_code': 18,
+                             'error_msg': 'User was deleted or banned'}]}])
+    changes, calls, failed = admreal._check_groups([[1, 'a'], [2, 'b']],
+                                                   tg_dir)
+    assert mocks_left() == 0
+    assert changes == [] and failed == [[2, 'b']]
+    assert os.path.isfile(tg_dir + 'a' + os.sep + 'members.log')
+    assert not os.path.isfile(tg_dir + 'b' + os.sep + 'members.log')
+
+    ###   groups are admitted by estimated cost of their checks
+    os.makedirs(tg_dir + 'big')
+    with open(tg_dir + 'big' + os.sep + 'probe.json', 'w') as f:
+        json.dump([250000, None], f)
+    due = [[1, 'a'], [3, 'big'], [4, 'new']]
+    assert admreal._admit_groups(due, tg_dir, 100, 1000) == \
+        ([[1, 'a']], 3, 254 - 100)
+    assert admreal._admit_groups(due[1:], tg_dir, 100, 100) == \
+        ([[3, 'big']], 252, 0)
+    assert admreal._admit_groups(due[2:], tg_dir, 1.5, 100) == \
+        ([], 1, 0.5)
+
+
+def test_03_daemon_waits_for_budget(tmp_path, monkeypatch):
+
+    ###   overdue group which isn't admitted waits for refill of budget
+    monkeypatch.chdir(tmp_path)
+    tg_dir = os.path.join('data', 'adm_groups') + os.sep
+    for domain, count in (('small', 2000), ('big', 3599000)):
+        os.makedirs(tg_dir + domain)
+        with open(tg_dir + domain + os.sep + 'probe.json', 'w') as f:
+            json.dump([count, None], f)
+
+    class Groups:
+        def get(self, *keys):
+            return [{'id': 1, 'domain': 'small'}, {'id': 2, 'domain': 'big'}]
+
+    checked = []
+
+    def check_groups(allowed, tg_dir):
+        checked.append([x[1] for x in allowed])
+        return [], 1000, []
+
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        if len(sleeps) == 2:
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr(admreal, 'UsrData', Groups)
+    monkeypatch.setattr(admreal, '_check_groups', check_groups)
+    monkeypatch.setattr(admreal.time, 'sleep', sleep)
+    admreal.monitor_daemon(False, budget=3600, tick=10 ** 6)
+    assert checked == [['small']]
+    # the first pass has spent 1000 calls, the big group waits for them
+    # (1 call per second), but the small one is checked earlier
+    assert sleeps[0] == 1.
+    assert 890 < sleeps[1] <= 900
@@ -99,11 +99,15 @@ def test_03_universities():
                     {"response": [{"type": "group", "object_id": 932}, {"type": "group", "object_id": 26356004}]},
                     {"response": [[{"id": 79996626, "name": "Клуб Фанатов ЛЛ", "screen_name": "fanclub_letchikleha"}], [{"id": 22685503, "name": "Сообщество фанатов Николы Теслы", "screen_name": "teslaforever"}], {"type": "group", "object_id": 22604105}, {"type": "group", "object_id": 23944985}, {"type": "group", "object_id": 162774745}]},
                     {"response": {"type": "user", "object_id": 23681294}},
+                    {"response":
+                        [[
+                            {"id": 932, "name": "МФТИ — Физтех", "screen_name": "miptru", "is_closed": 0, "description": "Официальная страница бла-бла", "members_count": 13},
+                            {"id": 26356004, "name": "Поток", "screen_name": "miptstream", "description": "Поток» — студенческое СМИ Физтеха", "members_count": 17}
+                        ]]
+                    },
                     {"response":
                         [
-                            [{"id": 932, "name": "МФТИ — Физтех", "screen_name": "miptru", "is_closed": 0, "description": "Официальная страница бла-бла"}],
                             {"count": 13, "items": [1390, 1422, 3016, 4316, 4320, 4639, 4640, 5178, 5489, 5505, 5518, 5531, 5690]},
-                            [{"id": 26356004, "name": "Поток", "screen_name": "miptstream", "description": "Поток» — студенческое СМИ Физтеха"}],
                             {"count": 17, "items": [69810, 71142, 73115, 75566, 77630, 77663, 78393, 79210, 79431, 84364, 86580, 92084, 94718, 99055, 101554, 103946, 142579796]}
                         ]
                     },
@@ -114,8 +118,10 @@ def test_03_universities():
                             {"id": 1422, "first_name": "Маша", "last_name": "Егорова", "university": 1, "university_name": "СПбГУ"},
                             {"id": 4639, "first_name": "Александр", "last_name": "Оганезов", "university": 297, "university_name": "МФТИ (Физтех)"},
                             {'id': 142579796, 'first_name': 'Никита', 'last_name': 'Рыков', 'occupation': {'type': 'university', 'id': 55111, 'name': 'МФТИ (ГУ) (см. в Москве)'}},
-                            {"university": 297}, {"university": 297}, {"university": 297}, {"university": 297}, {"university": 297}, {"university": 297}, {"university": 297}, {"university": 297}, {"university": 297}, {"university": 297},
-                            {"university": 55111}, {"university": 55111}, {"university": 55111}, {"university": 55111}, {"university": 55111}, {"university": 55111}, {"university": 55111}, {"university": 55111}, {"university": 55111}
+                            {"id": 1390, "university": 297}, {"id": 3016, "university": 297}, {"id": 4316, "university": 297}, {"id": 4320, "university": 297}, {"id": 4640, "university": 297},
+                            {"id": 5178, "university": 297}, {"id": 5489, "university": 297}, {"id": 5518, "university": 297}, {"id": 5531, "university": 297}, {"id": 5690, "university": 297},
+                            {"id": 69810, "university": 55111}, {"id": 71142, "university": 55111}, {"id": 73115, "university": 55111}, {"id": 75566, "university": 55111}, {"id": 77630, "university": 55111},
+                            {"id": 77663, "university": 55111}, {"id": 78393, "university": 55111}, {"id": 79210, "university": 55111}, {"id": 79431, "university": 55111}
                         ]]
                     }
                 ]
@@ -142,17 +148,25 @@ def test_03_universities():
                 [
                     {"response": [{"count": 3, "items": [{"id": 1, "title": "СПбГУ"}, {"id": 38, "title": "НГУ им. Лесгафта (бывш. СПбГУФК)"}, {"id": 989, "title": "СПбГУ ГА"}]}]},
                     {"response": [{"type": "group", "object_id": 52298374}, {"type": "group", "object_id": 58219172}]},
+                    {"response":
+                        [[
+                            {"id": 52298374, "name": "СПбГУ", "screen_name": "spb1724", "members_count": 16},
+                            {"id": 58219172, "name": "Подслушано СПбГУ", "screen_name": "overhearspbsu", "members_count": 14}
+                        ]]
+                    },
                     {"response":
                         [
-                            [{"id": 52298374, "name": "СПбГУ", "screen_name": "spb1724"}],
                             {"count": 16, "items": [102, 131, 407, 490, 753, 799, 834, 882, 888, 892, 907, 913, 969, 976, 1092, 1159]},
-                            [{"id": 58219172, "name": "Подслушано СПбГУ", "screen_name": "overhearspbsu"}],
                             {"count": 14, "items": [134, 431, 696, 907, 3064, 3768, 4326, 4548, 7224, 7451, 7589, 7859, 8426, 8571]}
                         ]
                     },
                     {"response": 
                         [
-                            [{"university": 1}]*15
+                            [
+                                {"id": 102, "university": 1}, {"id": 131, "university": 1}, {"id": 407, "university": 1}, {"id": 490, "university": 1}, {"id": 753, "university": 1},
+                                {"id": 799, "university": 1}, {"id": 834, "university": 1}, {"id": 882, "university": 1}, {"id": 888, "university": 1}, {"id": 892, "university": 1},
+                                {"id": 913, "university": 1}, {"id": 969, "university": 1}, {"id": 976, "university": 1}, {"id": 1092, "university": 1}, {"id": 1159, "university": 1}
+                            ]
                         ]
                     }
                 ]
@@ -0,0 +1,826 @@
+#! /usr/bin/env python3
+
+"""Testing of vkts.vklib internals which do not need network"""
+
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import types
+import pytest
+from vkts.vklib.ratelimit import TokenBucket, RateLimiter
+from vkts.vklib.sizing import SizeMemory
+from vkts.vklib.cache import ResponseCache
+from vkts.vklib.vkobjs import Group, load_groups, _bin_pack
+from vkts.vklib.memberids import MemberIds
+from vkts.vklib.deltalog import MembershipLog
+from vkts.vklib import vkreq
+from vkts.vklib.vkreq import Executor, ExecuteFailure
+from vkts.vklib.vkscript import (Paginate, Select, field_eq, field_in,
+                                 any_field_in)
+from vkts.vklib.packs import add_group_to_pack
+from vkts.vklib.asyncreq import AsyncExecutor
+from vkts.vklib.tokenpool import TokenPool, PoolToken
+from vkts.vklib import idindex
+from vkts.vklib.idindex import IdIndex
+from vkts.vklib.hotreqs import resolve_ids
+from vkts.vklib import profiles
+from vkts.vklib.profiles import ProfileStore, hydrate_profiles
+from vkts.main import main
+
+
+def mock_responses(responses):
+    """Responses of the next requests (in the current directory)"""
+
+    with open('.mock_request_responses.json', 'w') as fp:
+        json.dump(responses, fp)
+
+
+def mocks_left():
+    with open('.mock_request_responses.json') as fp:
+        return len(json.load(fp))
+
+
+def answer_users_get(monkeypatch, codes=None):
+    """Answer `execute` packs of `users.get` by their code (in any order of
+    requests) after random pause"""
+
+    mock_responses([])  # requests are made without tokens
+
+    def request(url_of_req, method, params):
+        time.sleep(random.random() * 0.05)
+        if codes is not None:
+            codes.append(params['code'])
+        ids = re.findall(r'"user_ids": (\d+)', params['code'])
+        return {'response': [[{'id': int(x)}] for x in ids]}
+
+    monkeypatch.setattr(vkreq, '_vk_api_request', request)
+
+
+def record_codes(monkeypatch):
+    """List which gets code of every `execute` request"""
+
+    codes = []
+    request = vkreq._vk_api_request
+
+    def recording(url_of_req, method, params):
+        codes.append(params.get('code'))
+        return request(url_of_req, method, params)
+
+    monkeypatch.setattr(vkreq, '_vk_api_request', recording)
+    return codes
+
+
+def test_01_token_bucket():
+
+    ###   burst of 3 requests is free, then 3 requests per second
+    b = TokenBucket(3.)
+    now = b.stamp
+    assert [b.reserve(now) for _ in range(3)] == [0., 0., 0.]
+    assert abs(b.reserve(now) - 1/3) < 1e-9
+    assert abs(b.reserve(now) - 2/3) < 1e-9
+
+    ###   after error 6 the rate decreases and then slowly restores
+    b.slow_down()
+    assert abs(b.rate - 2.1) < 1e-9
+    for _ in range(100):
+        b.speed_up()
+    assert b.rate == 3.
+
+    ###   tokens of different access tokens do not interfere
+    limiter = RateLimiter(rate=1.)
+    assert limiter.reserve('A', 'users.get') == 0.
+    assert limiter.reserve('B', 'users.get') == 0.
+    assert limiter.reserve('A', 'groups.get') > 0.
+    limiter.penalize('A', 'users.get')
+    assert limiter.get_rate('A', 'users.get') < limiter.get_rate('B')
+
+
+def test_02_size_memory():
+
+    ###   chunks grow up to API maximum
+    sizes = SizeMemory(chunk=100)
+    assert sizes.chunk('users.get') == 100
+    for _ in range(30):
+        sizes.chunk_succeeded('users.get', sizes.chunk('users.get'))
+    assert sizes.chunk('users.get') == 1000
+
+    ###   failed size is halved and never reached again
+    sizes.chunk_failed('users.get', 800)
+    assert sizes.chunk('users.get') == 400
+    for _ in range(30):
+        sizes.chunk_succeeded('users.get', sizes.chunk('users.get'))
+    assert sizes.chunk('users.get') == 799
+
+    ###   the same for packs of execute
+    assert sizes.pack('users.get') == 25
+    sizes.pack_failed('users.get', 25)
+    assert sizes.pack('users.get') == 12
+    sizes.pack_succeeded('users.get', 3)
+    assert sizes.pack('users.get') == 12
+    for _ in range(30):
+        sizes.pack_succeeded('users.get', sizes.pack('users.get'))
+    assert sizes.pack('users.get') == 24
+    assert sizes.pack('groups.getById') == 25
+
+
+def test_03_response_cache(tmp_path):
+
+    ###   only read-only methods are cached, token doesn't matter
+    path = str(tmp_path / 'cache.sqlite')
+    cache = ResponseCache(path, ttls={'users.get': 10, 'database.': 10})
+    assert cache.is_cacheable('database.getCities')
+    assert not cache.is_cacheable('wall.post')
+    cache.put('users.get', {'user_ids': 1, 'access_token': 'A'}, [{'id': 1}])
+    assert cache.get('users.get', {'user_ids': 1, 'access_token': 'B'}) \
+        == ([{'id': 1}], True)
+    assert cache.get('users.get', {'user_ids': 2}) is None
+
+    ###   responses are read from disk after restart; old ones are stale
+    cache.db.execute('UPDATE responses SET stamp = stamp - 15')
+    cache.db.commit()
+    cache.close()
+    cache = ResponseCache(path, ttls={'users.get': 10})
+    assert cache.get('users.get', {'user_ids': 1}) == ([{'id': 1}], False)
+    cache.stale_factor = 1
+    assert cache.get('users.get', {'user_ids': 1}) is None
+    assert cache.stats() == {'hits': 0, 'stale_hits': 1, 'misses': 1}
+
+
+def test_04_bin_pack():
+
+    ###   loops of pages of many communities fill packs of 25 calls
+    loops = [(25, 'a1'), (3, 'a2'), (1, 'b'), (22, 'c'), (1, 'd'), (2, 'e')]
+    assert _bin_pack(loops, 25) == [['a1'], ['c', 'a2'], ['e', 'b', 'd']]
+    assert _bin_pack([], 25) == []
+
+
+def test_05_member_ids():
+
+    ###   ids are kept sorted and unique, list-like reading works
+    a = MemberIds([7, 3, 5])
+    a += [3, 1]
+    assert a == [1, 3, 5, 7] and len(a) == 4
+    assert 5 in a and 4 not in a and '7' in a
+    assert a[0] == 1 and a[-1] == 7 and a[1:3] == [3, 5]
+    assert [2] + a == [1, 2, 3, 5, 7] == a + [2]
+
+    ###   set operations
+    b = MemberIds([5, 7, 9])
+    assert a.union(b) == [1, 3, 5, 7, 9]
+    assert a - b == [1, 3] and a & b == [5, 7]
+    assert MemberIds() == [] and not MemberIds()
+
+    ###   merges of long arrays
+    c = MemberIds(range(0, 3000, 3))
+    d = MemberIds(range(0, 3000, 2))
+    assert c.union(d) == sorted(set(c).union(d))
+    assert c - d == sorted(set(c) - set(d))
+    assert c & d == list(range(0, 3000, 6)) == d & c
+    assert d.union(c) == c.union(d) and d - c == sorted(set(d) - set(c))
+    assert c - [] == c and MemberIds() & c == []
+
+
+def test_06_group_binary_storage(tmp_path, monkeypatch):
+
+    ###   ids are saved in binary file and mapped back
+    monkeypatch.chdir(tmp_path)
+    g = Group(17)
+    g.members += [30, 10, 20]
+    g.update_cumulative()
+    g.name = 'Test'
+    g.dump()
+    ids_files = [x for x in os.listdir(os.path.join('data', 'obj', 'Group'))
+                 if x.startswith('17.ids.')]
+    assert len(ids_files) == 1
+    h = Group(17)
+    h.open()
+    assert h.name == 'Test' and h.members == [10, 20, 30]
+    assert 20 in h.cumul_members and 25 not in h.cumul_members
+
+    ###   mapped ids can be changed and dumped again
+    h.members += [40]
+    h.update_cumulative()
+    h.dump()
+    g = Group(17)
+    g.open()
+    assert g.members == [10, 20, 30, 40] and g.cumul_members == g.members
+    assert not os.path.exists(os.path.join('data', 'obj', 'Group',
+                                           ids_files[0]))
+
+    ###   crash before the header is replaced keeps the old version
+    replace = os.replace
+
+    def crash(src, dst):
+        if not src.endswith('.ids.tmp'):
+            raise OSError('crash')
+        replace(src, dst)
+
+    g.members += [50]
+    monkeypatch.setattr(os, 'replace', crash)
+    with pytest.raises(OSError):
+        g.dump()
+    monkeypatch.setattr(os, 'replace', replace)
+    h = Group(17)
+    h.open()
+    assert h.members == [10, 20, 30, 40]
+
+    ###   arrays of old versions are read from <key>.ids
+    path = os.path.join('data', 'obj', 'Group', '18')
+    with open(path + '.ids', 'wb') as f:
+        f.write(MemberIds([1, 2]).tobytes())
+    with open(path, 'w') as f:
+        json.dump({'name': 'Old', 'ids_layout': {'members': [0, 8]}}, f)
+    g = Group(18)
+    g.open()
+    assert g.name == 'Old' and g.members == [1, 2]
+
+
+def test_07_membership_log(tmp_path):
+
+    ###   deltas of every check are recorded
+    path = str(tmp_path / 'members.log')
+    log = MembershipLog(path)
+    assert log.record([1, 2, 3, 4], 10) == ([], [])
+    assert log.record([2, 3, 4, 5, 6], 20) == ([5, 6], [1])
+    assert log.record([2, 3, 4, 5, 6], 25) == ([], [])
+    assert log.record([1, 2, 6], 30) == ([1], [3, 4, 5])
+
+    ###   point-in-time queries after reopening
+    log = MembershipLog(path)
+    assert log.members_at(5) == [] and log.members_at(15) == [1, 2, 3, 4]
+    assert log.members_at(22) == [2, 3, 4, 5, 6]
+    assert log.current() == [1, 2, 6]
+    assert log.changes(15, 30) == ([6], [3, 4])
+    assert log.churn(0, 24 * 3600)['left'] == 4
+
+    ###   compaction drops old history only
+    log.compact(22)
+    assert log.members_at(15) == [] and log.members_at(22) == [2, 3, 4, 5, 6]
+    assert log.changes(0, 40) == ([1], [3, 4, 5])
+
+
+def test_08_frozen_snapshots(tmp_path, monkeypatch):
+
+    ###   identical states are kept once
+    monkeypatch.chdir(tmp_path)
+    dates = iter(['2019-05-01-120000', '2019-05-02-120000',
+                  '2019-05-03-120000'])
+    monkeypatch.setattr('time.strftime', lambda fmt: next(dates))
+    g = Group(17)
+    g.members += [1, 2]
+    g.dump_to_frozen()
+    g.dump_to_frozen()
+    blobs = os.path.join('data', 'frozen_obj', 'Group', 'blobs')
+    assert len(os.listdir(blobs)) == 1
+
+    ###   the last snapshot and snapshot as of date
+    g.members += [3]
+    g.dump_to_frozen()
+    assert len(os.listdir(blobs)) == 2
+    with open(os.path.join('data', 'frozen_obj', 'Group', 'index', '17')) as f:
+        assert len(f.readlines()) == 2
+    h = Group(17)
+    h.open_last_frozen()
+    assert h.members == [1, 2, 3] and h.dump_date == '2019-05-03-120000'
+    h.open_frozen('2019-05-02-235959')
+    assert h.members == [1, 2] and h.dump_date == '2019-05-01-120000'
+    h = Group(17)
+    h.open_frozen('2000-01-01-000000')
+    assert h.members == []
+
+
+def test_09_async_executor_retry(tmp_path, monkeypatch):
+
+    ###   failed request of pack is retried by asynchronous request
+    monkeypatch.chdir(tmp_path)
+    mock_responses([
+        {'response': [[{'id': 1}], False],
+         'execute_errors': [{'method': 'users.get', 'error_code': 6,
+                             'error_msg': 'Too many requests per second'}]},
+        {'response': [[{'id': 2}]]}])
+    e = AsyncExecutor()
+    e.add_request('users.get', user_ids=1)
+    e.add_request('users.get', user_ids=2)
+    asyncio.run(e.emit_requests())
+    assert e.responses == [[{'id': 1}], [{'id': 2}]]
+    assert [x['error_code'] for x in e.errors] == [6]
+    assert mocks_left() == 0
+
+
+def test_10_request_handles(tmp_path, monkeypatch):
+
+    ###   dependent requests are compiled into one execute
+    monkeypatch.chdir(tmp_path)
+    codes = record_codes(monkeypatch)
+    mock_responses([{'response': [
+        {'type': 'group', 'object_id': 17},
+        [{'id': 17, 'name': 'Test'}],
+        {'count': 2, 'items': [1, 2]}]}])
+    e = Executor()
+    r = e.add_request('utils.resolveScreenName', screen_name='test')
+    g = e.add_request('groups.getById', group_id=r['object_id'])
+    m = e.add_request('groups.getMembers', group_id=g[0]['id'])
+    e.emit_requests()
+    assert len(codes) == 1
+    assert '"group_id": r0.object_id' in codes[0]
+    assert '"group_id": r1[0].id' in codes[0]
+    assert m.result() == {'count': 2, 'items': [1, 2]}
+    assert g[0]['name'].result() == 'Test'
+
+    ###   response of the previous pack is substituted as value
+    mock_responses([{'response': [{'count': 2, 'items': [1, 2]}]}])
+    e.add_request('groups.getMembers', group_id=g[0]['id'])
+    e.emit_requests()
+    assert '"group_id": 17' in codes[1]
+
+
+def test_11_paginate_code():
+
+    ###   `$` in values of parameters isn't replaced by name of variable
+    script = Paginate('wall.get', 0, 300)
+    code = script.code('r5', 'wall.get', '{"domain": "a$b"}', json.dumps)
+    assert '"domain": "a$b"' in code
+    assert 'var r5_offset = 0;' in code and 'var r5 = false;' in code
+    assert '$' not in code.replace('a$b', '')
+
+
+def test_12_split_paginated(tmp_path, monkeypatch):
+
+    ###   paginated request failed by runtime error is split by pages
+    monkeypatch.chdir(tmp_path)
+    codes = record_codes(monkeypatch)
+    mock_responses([
+        {'error': {'error_code': 13, 'error_msg': 'Runtime error'}},
+        {'response': [{'count': 1500, 'items': [1, 2]}]},
+        {'response': [{'count': 1500, 'items': [3]}]}])
+    e = Executor()
+    e.add_paginated('groups.getMembers', offset=0, end=2000, group_id=1)
+    e.emit_requests()
+    assert e.responses == [{'count': 1500, 'items': [1, 2, 3]}]
+    assert 'var r0a_offset = 0;' in codes[1]
+    assert 'var r0b_offset = 1000;' in codes[2]
+    assert mocks_left() == 0
+
+
+def test_13_execute_errors(tmp_path, monkeypatch):
+
+    ###   failed calls get errors in order; only retryable ones are retried
+    monkeypatch.chdir(tmp_path)
+    too_many = {'method': 'users.get', 'error_code': 6,
+                'error_msg': 'Too many requests per second'}
+    denied = {'method': 'users.get', 'error_code': 15,
+              'error_msg': 'Access denied'}
+    mock_responses([
+        {'response': [[{'id': 1}], False, False],
+         'execute_errors': [too_many, denied]},
+        {'response': [[{'id': 2}]]}])
+    e = Executor()
+    for i in range(1, 4):
+        e.add_request('users.get', user_ids=i)
+    e.emit_requests()
+    assert e.responses[:2] == [[{'id': 1}], [{'id': 2}]]
+    failure = e.responses[2]
+    assert isinstance(failure, ExecuteFailure) and not failure
+    assert failure.params == {'user_ids': 3} and failure.errors == [denied]
+    assert mocks_left() == 0
+
+    ###   request is retried up to `max_retries` times
+    mock_responses([{'response': [False], 'execute_errors': [too_many]}] * 2)
+    e = Executor(max_retries=1)
+    e.add_request('users.get', user_ids=4)
+    e.emit_requests()
+    assert isinstance(e.responses[0], ExecuteFailure)
+    assert e.responses[0].errors == [too_many]
+    assert len(e.errors) == 2 and mocks_left() == 0
+
+
+def test_14_coalescing(tmp_path, monkeypatch):
+
+    ###   identical reads are emitted once, writes are emitted every time
+    monkeypatch.chdir(tmp_path)
+    codes = record_codes(monkeypatch)
+    mock_responses([{'response': [[{'id': 1}], 101, 102]}])
+    e = Executor()
+    for _ in range(2):
+        e.add_request('users.get', user_ids=1)
+    for _ in range(2):
+        e.add_request('messages.send', user_id=1, message='Hi')
+    e.emit_requests()
+    assert e.responses == [[{'id': 1}], [{'id': 1}], 101, 102]
+    assert e.responses[0] is not e.responses[1]
+    assert codes[0].count('API.users.get') == 1
+    assert codes[0].count('API.messages.send') == 2
+
+    ###   the same for requests in flight in different threads
+    calls = []
+
+    def slow_apply(method, handle_api_errors=True, **params):
+        calls.append(method)
+        time.sleep(0.2)
+        return {'response': 1}
+
+    monkeypatch.setattr(vkreq, '_apply_vk_method', slow_apply)
+    threads = [threading.Thread(target=vkreq.apply_vk_method, args=(m,),
+                                kwargs={'user_ids': 1})
+               for m in ['users.get'] * 2 + ['messages.send'] * 2]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(calls) == ['messages.send'] * 2 + ['users.get']
+
+
+def test_15_load_groups_plan(tmp_path, monkeypatch):
+
+    ###   closed community (without members_count) gets no pages
+    monkeypatch.chdir(tmp_path)
+    mock_responses([
+        {'response': [[{'id': 1, 'name': 'Open', 'members_count': 3},
+                       {'id': 2, 'name': 'Closed', 'is_closed': 1}]]},
+        {'response': [{'count': 3, 'items': [5, 6, 7]}]}])
+    groups = [Group(1), Group(2)]
+    load_groups(groups)
+    assert groups[0].members == [5, 6, 7] and groups[0].count == 3
+    assert groups[1].members == [] and groups[1].count == 0
+    assert mocks_left() == 0
+
+
+def test_16_group_sync(tmp_path, monkeypatch):
+
+    ###   newest members are loaded until a known one is met
+    monkeypatch.chdir(tmp_path)
+    codes = record_codes(monkeypatch)
+    mock_responses([
+        {'response': [{'count': 1002, 'items': [2001, 2000]}]},
+        {'response': [{'count': 1002, 'items': [1000, 999]}]}])
+    g = Group(1)
+    g.members += range(1, 1001)
+    assert g.sync() == [2001, 2000]
+    assert len(g.members) == 1002 and 2001 in g.members
+    assert 'var r1_offset = 1000;' in codes[1]
+    assert mocks_left() == 0
+
+    ###   empty page stops loading; somebody has left, so all is reloaded
+    mock_responses([
+        {'response': [{'count': 1500, 'items': []}]},
+        {'response': [[{'id': 1, 'name': 'Test'}],
+                      {'count': 3, 'items': [1, 2, 4]},
+                      {'count': 0, 'items': []}]}])
+    g = Group(1)
+    g.members += [1, 2, 3]
+    assert g.sync() is None
+    assert g.members == [1, 2, 4] and g.name == 'Test'
+    assert mocks_left() == 0
+
+
+def test_17_load_resumable(tmp_path, monkeypatch):
+
+    ###   range which begins after the end of previous one is extended
+    monkeypatch.chdir(tmp_path)
+    codes = record_codes(monkeypatch)
+    failed = {'response': [False], 'execute_errors': [
+        {'method': 'groups.getMembers', 'error_code': 15,
+         'error_msg': 'Access denied'}]}
+    mock_responses([
+        {'response': {'count': 30000, 'items': [10]}},
+        {'response': [{'count': 30000, 'items': [10, 20, 30]}]},
+        {'response': [{'count': 30000, 'items': [500, 600]}]},
+        failed])
+    g = Group(1)
+    assert g.load_resumable(workers=1) is False
+    assert 'var r1_offset = 23900;' in codes[2]
+    assert 'var r0_offset = 23700;' in codes[3]
+    assert mocks_left() == 0
+
+    ###   the next call only extends the range
+    mock_responses([
+        {'response': {'count': 30000, 'items': [10]}},
+        {'response': [{'count': 30000, 'items': [25, 30, 40]}]}])
+    assert g.load_resumable(workers=1) is True
+    assert g.members == [10, 20, 25, 30, 40, 500, 600]
+    assert not os.listdir(os.path.join('data', 'spill', 'Group'))
+    assert mocks_left() == 0
+
+
+def test_18_membership_log_retention(tmp_path):
+
+    ###   history older than retention is dropped at checkpoints
+    path = str(tmp_path / 'members.log')
+    log = MembershipLog(path, retention=1000)
+    sizes = []
+    for i in range(2000):
+        log.record(range(i, i + 500), 10 * i)
+        sizes.append(os.path.getsize(path))
+    assert max(sizes[1000:]) < 2 * max(sizes[:300])
+    assert log.members_at(10 * 1950) == list(range(1950, 2450))
+    assert log.members_at(10 * 1500) == []
+    log = MembershipLog(path, retention=1000)
+    assert log.current() == list(range(1999, 2499))
+
+
+def test_19_token_pool(tmp_path, monkeypatch):
+
+    ###   captcha and quota errors take token out of rotation
+    monkeypatch.chdir(tmp_path)
+    pool = TokenPool(RateLimiter(rate=100.))
+    pool.tokens = [PoolToken('a', 'A'), PoolToken('b', 'B'),
+                   PoolToken('c', 'C')]
+    pool.is_loaded = True
+    monkeypatch.setattr(vkreq, 'token_pool', pool)
+    monkeypatch.setattr(vkreq, 'limiter', RateLimiter(rate=100.))
+    errors = {'A': 29, 'B': 14}
+    used = []
+
+    def request(url_of_req, method, params):
+        token = params['access_token']
+        used.append(token)
+        if token in errors:
+            return {'error': {'error_code': errors[token],
+                              'error_msg': 'Error {}'.format(errors[token])}}
+        return {'response': token}
+
+    monkeypatch.setattr(vkreq, '_vk_api_request', request)
+    assert vkreq.apply_vk_method('users.get', user_ids=1) == \
+        {'response': 'C'}
+    assert sorted(used) == ['A', 'B', 'C']
+    assert [x.in_rotation for x in pool.tokens] == [False, False, True]
+    assert pool.tokens[0].reason == 'Error 29'
+
+    ###   error 5: token of the account is refreshed
+    errors = {'C': 5}
+
+    def login(entry):
+        entry.token = 'C2'
+
+    monkeypatch.setattr(pool, '_login', login)
+    assert vkreq.apply_vk_method('users.get', user_ids=2) == \
+        {'response': 'C2'}
+    assert pool.tokens[2].token == 'C2' and pool.tokens[2].in_rotation
+
+    ###   failed login disables the token, the rest of the pool is used
+    for x in pool.tokens[:2]:
+        x.in_rotation = True
+    errors = {'A': 5}
+
+    def failed_login(entry):
+        raise RuntimeError('Failed to get token')
+
+    monkeypatch.setattr(pool, '_login', failed_login)
+    used.clear()
+    assert vkreq.apply_vk_method('users.get', user_ids=3) == {'response': 'B'}
+    assert used == ['A', 'B']
+    assert [x.in_rotation for x in pool.tokens] == [False, True, True]
+    assert 'failed to get new token' in pool.tokens[0].reason
+    pool.disable('B', 'Error 14')
+    pool.disable('C2', 'Error 29')
+    try:
+        pool.get()
+    except RuntimeError as e:
+        assert 'out of rotation' in str(e)
+    else:
+        assert False
+
+
+def test_20_executor_workers(tmp_path, monkeypatch):
+
+    ###   packs in flight simultaneously, responses in order of adding
+    monkeypatch.chdir(tmp_path)
+    codes = []
+    answer_users_get(monkeypatch, codes)
+    e = Executor(workers=4)
+    processed = []
+    for i in range(1, 101):
+        e.add_request('users.get', processed.append, user_ids=i)
+    e.emit_requests()
+    assert len(codes) >= 4
+    assert e.responses == [[{'id': i}] for i in range(1, 101)]
+    assert processed == e.responses
+
+
+def test_21_executor_streaming(tmp_path, monkeypatch):
+
+    ###   full packs are emitted while requests are added
+    monkeypatch.chdir(tmp_path)
+    codes = []
+    answer_users_get(monkeypatch, codes)
+    limit = vkreq.sizes.pack('users.get')
+    processed = []
+    e = Executor(autoflush=True, keep_responses=False)
+    for i in range(1, 61):
+        e.add_request('users.get', processed.append, user_ids=i)
+        assert len(e.requests) < limit
+    assert len(codes) == 60 // limit and len(processed) == len(codes) * limit
+    e.emit_requests()
+    assert processed == [[{'id': i}] for i in range(1, 61)]
+    assert e.responses == []
+    assert all(x.count('API.users.get') <= limit for x in codes)
+
+    ###   packs are limited by size of code too
+    codes.clear()
+    e = Executor(autoflush=True, keep_responses=False, max_pack_bytes=200)
+    for i in range(1, 11):
+        e.add_request('users.get', user_ids=i)
+    e.emit_requests()
+    assert len(codes) > 1
+    assert all(len(x) < 400 for x in codes)
+
+    ###   responses are generated without saving
+    e = Executor()
+    for i in range(1, 31):
+        e.add_request('users.get', user_ids=i)
+    assert list(e.iter_responses()) == [[{'id': i}] for i in range(1, 31)]
+    assert e.responses == []
+
+
+def test_22_add_group_to_pack(tmp_path, monkeypatch, capsys):
+
+    ###   screen name is resolved and group is added by one execute
+    monkeypatch.chdir(tmp_path)
+    os.mkdir('data')
+    mock_responses([{'response': [
+        {'type': 'group', 'object_id': 17},
+        [{'id': 17, 'screen_name': 'test', 'name': 'Test'}]]}])
+    add_group_to_pack('pack', 'test')
+    with open(os.path.join('data', 'groups_packs', 'pack')) as f:
+        assert f.read() == '17 # test # Test\n'
+
+    ###   unknown screen name or name of user isn't added
+    mock_responses([
+        {'response': [[], False], 'execute_errors': [
+            {'method': 'groups.getById', 'error_code': 100,
+             'error_msg': 'One of the parameters specified was missing'}]},
+        {'response': [{'type': 'user', 'object_id': 1},
+                      [{'id': 1, 'screen_name': 'club1', 'name': 'One'}]]}])
+    for name in ('nobody', 'durov'):
+        with pytest.raises(SystemExit):
+            add_group_to_pack('pack', name)
+        assert capsys.readouterr().out == \
+            'Group ' + name + ' is not found\n'
+    with open(os.path.join('data', 'groups_packs', 'pack')) as f:
+        assert f.read() == '17 # test # Test\n'
+
+
+def test_23_select_code():
+
+    ###   projection of field of filtered items of {count, items}
+    select = Select('id', field_in('city.id', (1, 2)), items=True)
+    assert select.code('r1', 'friends.get', '{}', json.dumps) == '\n'.join((
+        'var r1_0 = API.friends.get({});',
+        'var r1 = false;',
+        'if (r1_0) {',
+        'var r1_1 = r1_0.items;',
+        'var r1_2 = [];',
+        'var r1_3 = 0;',
+        'var r1_4;',
+        'var r1_5 = true;',
+        'while (r1_3 < r1_1.length) {',
+        'r1_4 = r1_1[r1_3];',
+        'r1_5 = (r1_4.city.id == 1 || r1_4.city.id == 2);',
+        'if (r1_5) {',
+        '    r1_2 = r1_2 + [r1_4.id];',
+        '}',
+        'r1_3 = r1_3 + 1;',
+        '}',
+        'r1 = {"count": r1_0.count, "items": r1_2};',
+        '}'))
+
+    ###   nested conditions get their own variables
+    where = (field_eq('occupation.type', 'university')
+             & (field_in('occupation.id', (297,))
+                | any_field_in('universities', 'id', (297, 55111))))
+    code = Select(('id', 'occupation'), where).code(
+        'r0', 'users.get', '{"user_ids": "1,2"}', json.dumps)
+    lines = code.split('\n')
+    assert lines[0] == 'var r0_0 = API.users.get({"user_ids": "1,2"});'
+    assert 'r0_6 = (r0_4.occupation.type == "university");' in lines
+    assert 'r0_8 = (r0_4.occupation.id == 297);' in lines
+    assert ('    if (r0_11[r0_10].id == 297 || r0_11[r0_10].id == 55111) {'
+            in lines)
+    assert lines.index('r0_7 = r0_8 || r0_9;') \
+        < lines.index('r0_5 = r0_6 && r0_7;') < lines.index('if (r0_5) {')
+    assert ('    r0_2 = r0_2 + [{"id": r0_4.id, '
+            '"occupation": r0_4.occupation}];') in lines
+    assert lines[-2:] == ['r0 = r0_2;', '}']
+    assert code.count('{') == code.count('}')
+
+
+def test_24_id_index(tmp_path):
+    index = IdIndex(str(tmp_path / 'index' / 'ids.sqlite'))
+    index.add_many('group', [(1, 'apiclub'), ('17', 'test')])
+    index.add('user', 1, 'durov')
+    assert index.lookup('group', 'test') == (17, 'test')
+    assert index.lookup('group', '1') == (1, 'apiclub')
+    assert index.lookup('user', 1) == (1, 'durov')
+    assert index.lookup('user', 'apiclub') is None
+    assert index.lookup('group', 2) is None
+
+    ###   new screen name replaces the old one
+    index.add('group', 17, 'renamed')
+    assert index.get_screen_name('group', 17) == 'renamed'
+    assert index.get_id('group', 'renamed') == 17
+    assert IdIndex(str(tmp_path / 'index' / 'ids.sqlite')).lookup(
+        'group', 17) == (17, 'renamed')
+
+
+def test_25_resolve_ids(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(idindex, '_index', None)
+
+    ###   screen names of objects of the other kind aren't resolved
+    mock_responses([{'response': [
+        [{'id': 17, 'screen_name': 'club17'}],
+        {'type': 'page', 'object_id': 5},
+        {'type': 'user', 'object_id': 1},
+        []]}])
+    assert resolve_ids(['17', 'test', 'durov', 'nobody'], 'group') == \
+        [(17, 'club17'), (5, 'test'), None, None]
+    mock_responses([{'response': [{'type': 'user', 'object_id': 1}]}])
+    assert resolve_ids(['durov'], 'user') == [(1, 'durov')]
+    assert mocks_left() == 0
+
+    ###   resolved ids are taken from the index
+    mock_responses([])
+    assert resolve_ids([17, 'test'], 'group') == [(17, 'club17'), (5, 'test')]
+    assert resolve_ids(['1'], 'user') == [(1, 'durov')]
+
+    ###   command line: file with ids, one per line
+    with open('ids.txt', 'w') as f:
+        f.write('test\ndurov\n\n17\n')
+    mock_responses([{'response': [{'type': 'user', 'object_id': 1}]}])
+    monkeypatch.setattr(sys, 'argv', ['vkts', 'resolve_group_ids',
+                                      '--file', 'ids.txt'])
+    main()
+    assert capsys.readouterr().out == \
+        '5\ttest\ndurov\t<- unresolved\n17\tclub17\n'
+    assert mocks_left() == 0
+
+
+def test_26_profile_store(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(profiles, '_HYDRATE_CHUNK', 2)
+    store = ProfileStore(str(tmp_path / 'profiles.sqlite'))
+    student = {'type': 'university', 'id': 297}
+    where = field_eq('occupation.type', 'university')
+
+    ###   ids are loaded chunk by chunk while profiles are consumed
+    mock_responses([{'response': [[{'id': 1, 'occupation': student}]]},
+                    {'response': [[]]}])
+    res = store.hydrate([1, 2, 3], ('occupation',), where=where)
+    assert mocks_left() == 2
+    assert next(res) == {'id': 1, 'occupation': student}
+    assert mocks_left() == 1
+    assert list(res) == []
+    assert mocks_left() == 0
+
+    ###   users dropped by `where` aren't requested with it again
+    mock_responses([])
+    assert list(store.hydrate([3, 2, 1], ('occupation',), where=where)) == \
+        [{'id': 1, 'occupation': student}]
+
+    ###   but they are requested without it
+    mock_responses([{'response': [[{'id': 2, 'occupation': None},
+                                   {'id': 3, 'occupation': None}]]}])
+    assert list(store.hydrate([1, 2, 3], ('occupation',))) == [
+        {'id': 1, 'occupation': student},
+        {'id': 2, 'occupation': None},
+        {'id': 3, 'occupation': None}]
+    assert mocks_left() == 0
+
+
+def test_27_fused_group_load(tmp_path, monkeypatch):
+
+    ###   members are loaded with fields of their profiles
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(profiles, '_store', None)
+    codes = record_codes(monkeypatch)
+    student = {'type': 'university', 'id': 297}
+    worker = {'type': 'work', 'id': 1}
+    mock_responses([{'response': [
+        [{'id': 1, 'name': 'Test'}],
+        {'count': 3, 'items': [
+            {'id': 1, 'universities': [], 'occupation': student},
+            {'id': 2, 'universities': [{'id': 297}], 'occupation': None},
+            {'id': 4, 'occupation': worker}]},
+        {'count': 0, 'items': []}]}])
+    pages = []
+    g = Group(1)
+    g.load(fields=('universities', 'occupation'),
+           profiles_processor=pages.append)
+    assert g.members == [1, 2, 4] and g.count == 3
+    assert [[x['id'] for x in page] for page in pages] == [[1, 2, 4]]
+    assert codes[0].count('"fields": "occupation,universities"') == 2
+    assert mocks_left() == 0
+
+    ###   students are found by saved profiles without requests
+    mock_responses([])
+    g.load_students(types.SimpleNamespace(ids=[297], name='test'))
+    assert g.univers_data['test']['students'] == [1, 2]
+    assert sorted(x['id'] for x in hydrate_profiles(
+        [1, 2, 4], ('universities', 'occupation'))) == [1, 2, 4]
+    assert list(hydrate_profiles([4], ('occupation',))) == \
+        [{'id': 4, 'occupation': worker}]
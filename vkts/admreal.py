@@ -2,14 +2,20 @@
 
 """Module for administering and monitoring vk.com communities"""
 
+import functools
+import hashlib
+import json
+import logging
 import os
 import sys
 import time
 from .report import Report
 from . import vklib as vk
-from .vklib import apply_vk_method
+from .vklib.ratelimit import TokenBucket
 from .usrdata import UsrData
 
+logger = logging.getLogger()
+
 
 def add_group_for_monitoring(group_id):
     """Add group_id in registry of monitoring groups"""
@@ -89,94 +95,159 @@ def display_broadcasting_email():
         print('{}\n'.format('\n'.join(adm_data['bc_emails'])))
 
 
-def check_updates(broadcast):
-    """Check for changes in target groups, make report, send it to email"""
-
-    # TODO: _mkdir_rec
-    # TODO: Уменьшить число запросов
-    tg_dir = os.sep.join(['data', 'adm_groups']) + os.sep
-
-    # Read list of groups ids
-    gr_list = UsrData().get('adm', 'mon_groups')
-    if not gr_list:
-        print('No monitoring groups (try command monitor_add)')
-        sys.exit()
-    gr_list = [[x['id'], x['domain']] for x in gr_list]
-
-    # Make report
-    r = Report('adm_groups_updates', html_only=False)
-    new_files = []
+def _open_members_log(group_dir, retention=365 * 24 * 3600):
+    """Log of membership of monitored group (see `MembershipLog`) with
+    history of the last `retention` seconds. The newest text snapshot of old
+    versions becomes its base."""
+
+    log = vk.MembershipLog(os.path.join(group_dir, 'members.log'),
+                           retention=retention)
+    old_dir = os.path.join(group_dir, 'members')
+    if not len(log) and os.path.isdir(old_dir):
+        files = sorted(os.listdir(old_dir))
+        if files:
+            path = os.path.join(old_dir, files[-1])
+            with open(path) as f:
+                ids = [int(x) for x in f.read().split('\n') if x]
+            log.record(ids, os.path.getmtime(path))
+    return log
+
+
+# Errors of requests of members of closed or banned groups
+_NO_ACCESS_ERRORS = (15, 203)
+
+
+def _probe_groups(gr_list):
+    """Counts of members and fingerprints of the last pages of members
+    (sorted by id) of groups `gr_list` (pairs [id, domain]), loaded by
+    single pass of `execute` requests: {id: (count, fingerprint)}. Groups
+    without access to members are absent. Fingerprint is None if its request
+    failed by other error."""
+
+    probes = {}
+
+    def save_fingerprint(group_id, count, response):
+        if response:
+            probes[group_id] = (count, hashlib.sha1(
+                json.dumps(response['items']).encode()).hexdigest())
+        elif not any(x.get('error_code') in _NO_ACCESS_ERRORS
+                     for x in getattr(response, 'errors', ())):
+            probes[group_id] = (count, None)
+
+    def add_fingerprints(response):
+        # pages are requested as soon as counts are known
+        for info in response or ():
+            if 'members_count' not in info:
+                continue
+            count = info['members_count']
+            e.add_request('groups.getMembers',
+                          functools.partial(save_fingerprint,
+                                            str(info['id']), count),
+                          group_id=info['id'], offset=max(0, count - 100),
+                          count=100)
+
+    e = vk.Executor(keep_responses=False)
+    e.add_chunked('groups.getById', [str(x[0]) for x in gr_list],
+                  add_fingerprints, ids_param='group_ids',
+                  fields='members_count')
+    e.emit_requests()
+    return probes
+
+
+def _check_groups(gr_list, tg_dir, big_group=100000, margin=100):
+    """One monitoring pass over groups `gr_list` (pairs [id, domain]).
+
+    All groups are probed at once (see `_probe_groups`): a group whose count
+    and the last page of members are the same as at the last check is
+    skipped. Groups without access to members are skipped too. Other
+    groups are loaded by `load_groups`, groups with more than `big_group`
+    members - by resumable loading.
+    Loading of a group is failed if more than `margin` members are missing:
+    its log of membership isn't changed, so failed attempt doesn't spoil
+    the next one.
+    Returns list of changes (g_info, group, left ids, joined ids), estimated
+    number of API calls and list of groups (g_info) which are failed."""
+
+    # Choose groups to load
+    probes = _probe_groups(gr_list)
+    calls = len(gr_list) + 1
+    small, big = [], []
     for g_info in gr_list:
-
-        # Check accessibility of group data
-        res = apply_vk_method('groups.getMembers', group_id=g_info[0])
-        if 'error' in res and res['error']['error_code'] == 203:
+        probe = probes.get(str(g_info[0]))
+        if probe is None:
             continue
-
-        # Get data about group
+        state_path = tg_dir + g_info[1] + os.sep + 'probe.json'
+        if probe[1] and os.path.isfile(state_path):
+            with open(state_path) as f:
+                if json.load(f) == list(probe):
+                    continue
         g = vk.Group(g_info[0])
+        (big if probe[0] > big_group else small).append((g_info, g))
+        calls += -(-probe[0] // 1000) + 1
+
+    # Load groups
+    failed = []
+    vk.load_groups([x[1] for x in small], workers=4)
+    for g_info, g in small:
+        if len(g.members) + margin < g.count:
+            logger.debug("Members of %s are not loaded", g_info[1])
+            failed.append(g_info)
+    for g_info, g in big:
+        # loaded ranges of big groups are kept until the next attempt
         try:
-            g.load()
+            is_loaded = g.load_resumable()
         except Exception as e:
-            # In case of network problems we must delete collected data.
-            # Otherwise, this data will spoil the next attempt
-            # to generate a report
-            print('Could not load information about the group of ' + g_info[1]
-                  + ' (' + str(e) + ')')
-            for f in new_files:
-                os.remove(f)
-            sys.exit()
-        if g.is_empty():
+            logger.debug("Loading of %s is failed (%s)", g_info[1], e)
+            is_loaded = False
+        if not is_loaded or len(g.members) + margin < g.count:
+            failed.append(g_info)
+
+    # Save changes to logs of membership
+    changes = []
+    for g_info, g in small + big:
+        if g.is_empty() or g_info in failed:
             continue
+        group_dir = tg_dir + g_info[1]
+        if not os.path.isdir(group_dir):
+            os.makedirs(group_dir)
+        log = _open_members_log(group_dir)
+        just_in_new, just_in_old = log.record(g.members)
+        with open(os.path.join(group_dir, 'probe.json'), 'w') as f:
+            json.dump(probes[str(g_info[0])], f)
+        if just_in_old or just_in_new:
+            changes.append((g_info, g, just_in_old, just_in_new))
+    return changes, calls, failed
+
+
+def _report_changes(changes, broadcast):
+    """Make report about changes of `_check_groups`, send it to email"""
+
+    # Names of all users by packed requests
+    profiles = vk.hydrate_profiles(
+        [x for c in changes for x in c[2].union(c[3])],
+        ('first_name', 'last_name'))
+    names = {x['id']: '{} {}'.format(x['first_name'], x['last_name'])
+             for x in profiles if x['first_name'] is not None}
 
-        # Dump data
-        if not os.path.isdir(tg_dir + g_info[1] + '/'):
-            os.mkdir(tg_dir + g_info[1] + '/')
-        if not os.path.isdir(tg_dir + g_info[1] + '/members/'):
-            os.mkdir(tg_dir + g_info[1] + '/members/')
-        out_file_name = (tg_dir + g_info[1] + '/members/'
-                         + time.strftime("%F-%H%M%S") + '.txt')
-        with open(out_file_name, 'w') as f:
-            for user in g.members:
-                f.write(str(user) + '\n')
-
-        # Diff 2 last files
-        ls_res = os.listdir(tg_dir + g_info[1] + '/members/')
-        if len(ls_res) < 2:
-            continue
-        ls_res.sort()
-        old_file = tg_dir + g_info[1] + '/members/' + ls_res[-2]
-        new_file = tg_dir + g_info[1] + '/members/' + ls_res[-1]
-        with open(old_file, 'r') as f:
-            old_list = f.read().split('\n')[:-1]
-        with open(new_file, 'r') as f:
-            new_list = f.read().split('\n')[:-1]
-        just_in_old = list(set(old_list) - set(new_list))
-        just_in_new = list(set(new_list) - set(old_list))
-
-        # If last 2 filaes are the same, then delete last one
-        if len(just_in_old) == 0 and len(just_in_new) == 0:
-            os.remove(new_file)
-            continue
-        else:
-            new_files.append(out_file_name)
-            if just_in_old:
-                r.add_line('Покинули группу ' + g_info[1] + ':')
-                for user_id in just_in_old:
-                    r.add_str('[' + user_id + '] ')
-                    r.add_vk_link('id' + user_id,
-                                  vk.get_user_name(user_id))
-                r.add_line('')
-            if just_in_new:
-                r.add_line('Вошли в группу ' + g_info[1] + ':')
-                for user_id in just_in_new:
-                    r.add_str('[' + user_id + '] ')
-                    r.add_vk_link('id' + user_id,
-                                  vk.get_user_name(user_id))
-                r.add_line('')
-            if just_in_old or just_in_new:
-                r.add_line('В группе ' + str(g.count) + ' человек')
-                r.add_line('')
+    # Make report
+    r = Report('adm_groups_updates', html_only=False)
+    for g_info, g, just_in_old, just_in_new in changes:
+        if just_in_old:
+            r.add_line('Покинули группу ' + g_info[1] + ':')
+            for user_id in just_in_old:
+                r.add_str('[' + str(user_id) + '] ')
+                r.add_vk_link('id' + str(user_id),
+                              names.get(user_id, 'No name'))
+            r.add_line('')
+        if just_in_new:
+            r.add_line('Вошли в группу ' + g_info[1] + ':')
+            for user_id in just_in_new:
+                r.add_str('[' + str(user_id) + '] ')
+                r.add_vk_link('id' + str(user_id),
+                              names.get(user_id, 'No name'))
+            r.add_line('')
+        r.add_line('В группе ' + str(g.count) + ' человек')
+        r.add_line('')
 
     # Close report and broadcast it
     if not r.is_empty():
@@ -186,6 +257,149 @@ def check_updates(broadcast):
             r.broadcast()
 
 
+def check_updates(broadcast, big_group=100000, margin=100):
+    """Check for changes in target groups, make report, send it to email
+    (see `_check_groups`)"""
+
+    # TODO: _mkdir_rec
+    tg_dir = os.sep.join(['data', 'adm_groups']) + os.sep
+
+    # Read list of groups ids
+    gr_list = UsrData().get('adm', 'mon_groups')
+    if not gr_list:
+        print('No monitoring groups (try command monitor_add)')
+        sys.exit()
+    gr_list = [[x['id'], x['domain']] for x in gr_list]
+
+    try:
+        changes, _, failed = _check_groups(gr_list, tg_dir, big_group,
+                                           margin)
+    except Exception as e:
+        print('Could not load information about groups (' + str(e) + ')')
+        sys.exit()
+    for g_info in failed:
+        print('Could not load members of ' + g_info[1])
+    _report_changes(changes, broadcast)
+
+
+def _check_cost(g_info, tg_dir):
+    """Estimated number of API calls of checking of group (by count of its
+    members at the last check)"""
+
+    count = 0
+    state_path = tg_dir + g_info[1] + os.sep + 'probe.json'
+    if os.path.isfile(state_path):
+        with open(state_path) as f:
+            count = json.load(f)[0]
+    return -(-count // 1000) + 1
+
+
+def _admit_groups(due, tg_dir, available, budget):
+    """Groups of `due` (in order) which can be checked now by `available`
+    API calls (see `_check_cost`). Group bigger than the whole `budget` is
+    admitted alone with full budget. Returns admitted groups, their
+    estimated cost and number of calls which the next group waits for."""
+
+    allowed = []
+    cost = 1  # chunked groups.getById
+    for g_info in due:
+        g_cost = _check_cost(g_info, tg_dir)
+        if cost + g_cost > available and (allowed or available < budget):
+            return allowed, cost, min(cost + g_cost, budget) - available
+        allowed.append(g_info)
+        cost += g_cost
+    return allowed, cost, 0
+
+
+def monitor_daemon(broadcast, report_interval=6 * 3600, budget=20000,
+                   min_interval=600, max_interval=24 * 3600, tick=300):
+    """Long-lived version of `check_updates`. Every monitored group is
+    checked at its own interval: it's halved after a check with changes
+    and grows by 1.5 times after a check without them (within
+    [`min_interval`, `max_interval`] seconds), so fast-churn groups are
+    checked often and dormant ones rarely. Groups which are due are checked
+    by one pass, but API calls are limited by `budget` per hour (overdue
+    groups go first, cost of a group is estimated by its size). Group which
+    fails is checked again soon, others aren't affected. Changes are
+    collected and reported every `report_interval` seconds. List of groups
+    is re-read at least every `tick` seconds, schedule is kept in
+    data/adm_groups/schedule.json.
+    Stop it by Ctrl+C (collected changes are reported)."""
+
+    tg_dir = os.sep.join(['data', 'adm_groups']) + os.sep
+    if not os.path.isdir(tg_dir):
+        os.makedirs(tg_dir)
+    schedule_path = tg_dir + 'schedule.json'
+    schedule = {}  # id: [interval, time of the next check]
+    if os.path.isfile(schedule_path):
+        with open(schedule_path) as f:
+            schedule = json.load(f)
+
+    bucket = TokenBucket(budget / 3600., capacity=budget)
+    pending = []
+    next_report = time.time() + report_interval
+    try:
+        while True:
+            now = time.time()
+            gr_list = [[x['id'], x['domain']]
+                       for x in UsrData().get('adm', 'mon_groups') or ()]
+            keys = [str(x[0]) for x in gr_list]
+            schedule = {k: schedule.get(k, [min_interval, now])
+                        for k in keys}
+
+            # check due groups within budget
+            due = sorted((x for x in gr_list if schedule[str(x[0])][1] <= now),
+                         key=lambda x: schedule[str(x[0])][1])
+            allowed, cost, lack = _admit_groups(due, tg_dir,
+                                                bucket.available(), budget)
+            if allowed:
+                logger.debug("Check %s of %s due groups", len(allowed),
+                             len(due))
+                try:
+                    changes, calls, failed = _check_groups(allowed, tg_dir)
+                except Exception as e:
+                    print('Could not load information about groups ('
+                          + str(e) + ')')
+                    changes, calls, failed = [], cost, allowed
+                bucket.reserve(count=calls)
+                changed = {str(c[0][0]) for c in changes}
+                failed = {str(x[0]) for x in failed}
+                for g_info in allowed:
+                    entry = schedule[str(g_info[0])]
+                    if str(g_info[0]) in failed:
+                        # try again soon
+                        entry[1] = now + min_interval
+                        continue
+                    if str(g_info[0]) in changed:
+                        entry[0] = max(min_interval, entry[0] / 2)
+                    else:
+                        entry[0] = min(max_interval, entry[0] * 1.5)
+                    entry[1] = now + entry[0]
+                pending += changes
+                with open(schedule_path, 'w') as f:
+                    json.dump(schedule, f)
+
+            # report collected changes
+            if time.time() >= next_report:
+                if pending:
+                    _report_changes(pending, broadcast)
+                    pending = []
+                while next_report <= time.time():
+                    next_report += report_interval
+
+            # sleep until the next event: a group becomes due or budget
+            # is refilled for due groups which aren't admitted
+            now = time.time()
+            wake = min([x[1] for x in schedule.values() if x[1] > now]
+                       + [next_report])
+            if len(allowed) < len(due):
+                wake = min(wake, now + lack / bucket.rate + 1)
+            time.sleep(min(max(wake - now, 1.), tick))
+    except KeyboardInterrupt:
+        if pending:
+            _report_changes(pending, broadcast)
+
+
 # Make report about birthday of all members of groups
 def make_birthday_calendar(group_id):
 
@@ -196,18 +410,8 @@ def make_birthday_calendar(group_id):
     g = vk.Group(group_id)
     g.load()
     members = g.members
-    btd_list = []
-    step = 200  # instead of 1000 to avoid error 414 (URI Too Long)
-    last_index = int((len(members)-1)/step)
-    for i in range(0, last_index + 1):
-        if i == last_index:  # TODO: Why `count` is unused?
-            count = len(members) % step
-        else:
-            count = step
-        members_str = ','.join([str(user)
-                                for user in members[i*step:i*step+step]])
-        btd_list += apply_vk_method('users.get', user_ids=members_str,
-                                    fields='bdate,photo_max')['response']
+    btd_list = list(vk.hydrate_profiles(
+        members, ('first_name', 'last_name', 'bdate', 'photo_max')))
 
     # Empty list -> out
     if not btd_list:
@@ -215,7 +419,7 @@ def make_birthday_calendar(group_id):
         sys.exit()
 
     # Delete users without birthday date
-    tmp = [user for user in btd_list if 'bdate' in user]
+    tmp = [user for user in btd_list if user.get('bdate')]
     btd_list = tmp
 
     # Set default ava if it's absent
@@ -15,6 +15,7 @@ commands_with_descr = \
       ['ac_add', '   # enter interactive mode'],
       ['ac_rem', '[email/vk/telegram] <ac_name>'],
       ['ac_activate', '[email/vk/telegram] <ac_name>'],
+      ['ac_pool', '<ac_name> {--off}   # use vk account in pool of tokens'],
       ['ac_see', '']
     ],
     [
@@ -29,8 +30,8 @@ commands_with_descr = \
       'VK API commands',
 
       ['method', '<method_name> {param0=<v0> param1=...}'],
-      ['resolve_group_ids', '<screen_name>'],
-      ['resolve_user_ids', '<group_id>']
+      ['resolve_group_ids', '<screen_name> | --file <path>'],
+      ['resolve_user_ids', '<user_id> | --file <path>']
     ],
     [
       'Commands for working with packs',
@@ -70,6 +71,7 @@ commands_with_descr = \
       ['broadcast_rem', '<email>'],
       ['broadcast_see', ''],
       ['check_updates', '{--no-broadcast}'],
+      ['monitor_daemon', '{--no-broadcast}'],
       ['make_birthday_calendar', '<group_id>']
     ]
   ]
@@ -98,6 +100,8 @@ def main():
         real.delete_account(sys.argv[2], sys.argv[3])
     elif sys.argv[1] == 'ac_activate':
         real.activate_account(sys.argv[2], sys.argv[3])
+    elif sys.argv[1] == 'ac_pool':
+        real.pool_account(sys.argv[2], '--off' not in sys.argv)
     elif sys.argv[1] == 'ac_see':
         real.display_accounts()
 
@@ -114,9 +118,15 @@ def main():
         # Apply some method and output result
         print(real.vk_method(sys.argv[2], sys.argv[3:]))
     elif sys.argv[1] == 'resolve_group_ids':
-        print(vk.resolve_group_ids(sys.argv[2]))
+        if sys.argv[2] == '--file':
+            real.resolve_ids_file(sys.argv[3], 'group')
+        else:
+            print(vk.resolve_group_ids(sys.argv[2]))
     elif sys.argv[1] == 'resolve_user_ids':
-        print(vk.resolve_user_ids(sys.argv[2]))
+        if sys.argv[2] == '--file':
+            real.resolve_ids_file(sys.argv[3], 'user')
+        else:
+            print(vk.resolve_user_ids(sys.argv[2]))
 
     # TODO: Не должно быть отдельных опций для исключений
     # TODO: Имена опций неудачные
@@ -180,6 +190,9 @@ def main():
     elif sys.argv[1] == 'check_updates':
         # Find changes in monitoring groups
         adm.check_updates('--no-broadcast' not in sys.argv)
+    elif sys.argv[1] == 'monitor_daemon':
+        # Check monitoring groups at adaptive intervals until Ctrl+C
+        adm.monitor_daemon('--no-broadcast' not in sys.argv)
     elif sys.argv[1] == 'make_birthday_calendar':
         # Make report with sorted list of birthday of community
         adm.make_birthday_calendar(sys.argv[2])
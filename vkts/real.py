@@ -3,12 +3,11 @@
 """Implementation of the main functions of the application: editing user data,
 thematic search, other console commands"""
 
-import sys
 import re
 from collections import Counter
 from .report import Report
 from . import vklib as vk
-from .vklib import apply_vk_method
+from .vklib import apply_vk_method, vkscript
 from .usrdata import UsrData
 from .utils import exception_handler
 
@@ -80,6 +79,14 @@ def activate_account(ac_type, ac_name):
         u.set(True, 'acc', ac_type, ac_name, 'is_activated')
 
 
+def pool_account(ac_name, is_pooled=True):
+    """Mark vk account as usable (or not) for pool of tokens"""
+
+    u = UsrData()
+    if ac_name in (u.get('acc', 'vk') or {}):
+        u.set(is_pooled, 'acc', 'vk', ac_name, 'pool')
+
+
 def display_accounts():
     """Display all accounts and active marks"""
 
@@ -94,12 +101,16 @@ def display_accounts():
         print(ac_type)
         for ac_name in accs[ac_type]:
             acc_obj = accs[ac_type][ac_name]
+            marks = []
+            if acc_obj['is_activated']:
+                marks.append('activated')
+            if acc_obj.get('pool'):
+                marks.append('pooled')
             print('    {}: \t[{}|{}]{}'.format(ac_name,
                                                acc_obj['uname'],
                                                acc_obj['password'],
-                                               ('    \t<- activated'
-                                                if acc_obj['is_activated']
-                                                else '')))
+                                               ('    \t<- ' + ', '.join(marks)
+                                                if marks else '')))
         print('')
 
 
@@ -112,8 +123,9 @@ def display_accounts():
 def search_hot_university_ids(un_groups, un_ids):
 
     # load members of groups
+    # (with education fields of profiles, see `vk.Group.load()`)
     groups = [vk.Group(group_id['id']) for group_id in un_groups]
-    vk.load_groups(groups)
+    vk.load_groups(groups, fields=('university', 'occupation'))
 
     # unite groups members in a single users list
     users = []
@@ -121,31 +133,33 @@ def search_hot_university_ids(un_groups, un_ids):
         users += group.members
     users = list(set(users))
 
-    # load education info about users
-    step = 100
-    e = vk.Executor()
-    users_education = []
-    for i in range(0, len(users), step):
-        ids_str = ','.join(list(map(str, users[i:i+step])))
-        e.add_request('users.get', user_ids=ids_str,
-                      fields='occupation,education,universities',
-                      processor=users_education.extend)
-    e.emit_requests()
-
     # Count university appearances
     un_ids_cnt = {un_id: 0 for un_id in un_ids}
-    for item in users_education:
-        if 'university' in item:
-            un_id = str(item['university'])
-            if un_id in un_ids_cnt:
-                un_ids_cnt[un_id] += 1
-                continue
-        if ('occupation' in item
-                and item['occupation']['type'] == 'university'):
-            un_id = str(item['occupation']['id'])
-            if un_id in un_ids_cnt:
-                un_ids_cnt[un_id] += 1
-                continue
+
+    def count_univer_ids(users_education):
+        for item in users_education:
+            # projected profiles have null instead of absent fields
+            if item.get('university'):
+                un_id = str(item['university'])
+                if un_id in un_ids_cnt:
+                    un_ids_cnt[un_id] += 1
+                    continue
+            if (item.get('occupation')
+                    and item['occupation']['type'] == 'university'):
+                un_id = str(item['occupation']['id'])
+                if un_id in un_ids_cnt:
+                    un_ids_cnt[un_id] += 1
+                    continue
+
+    # education info about users (it's in store of profiles already,
+    # see `vk.hydrate_profiles`); if something is loaded, server returns
+    # only profiles with one of `un_ids`
+    ids = [int(x) for x in un_ids]
+    where = (vkscript.field_in('university', ids)
+             | (vkscript.field_eq('occupation.type', 'university')
+                & vkscript.field_in('occupation.id', ids)))
+    count_univer_ids(vk.hydrate_profiles(
+        users, ('university', 'occupation'), where=where))
 
     # Filter out unused ids
     hot_ids = list(un_ids_cnt.items())
@@ -359,6 +373,18 @@ def vk_method(method_name, args):
     return apply_vk_method(method_name, handle_api_errors=False, **args_dict)
 
 
+# Resolve all ids or screen names listed in file (one per line)
+def resolve_ids_file(file_name, kind):
+    with open(file_name) as f:
+        some_ids = [x.strip() for x in f if x.strip()]
+    res = vk.resolve_ids(some_ids, kind, workers=4)
+    for some_id, pair in zip(some_ids, res):
+        if pair is None:
+            print('{}\t<- unresolved'.format(some_id))
+        else:
+            print('{}\t{}'.format(*pair))
+
+
 ####################################################################
 ##                         Other commands                         ##
 ####################################################################
@@ -541,6 +567,11 @@ def make_thematic_report(ext_users_list, univer_ids):
     i = 0
     r.add_str('<table>\n')
 
+    # Load profiles of all users at once
+    for _ in vk.hydrate_profiles([x['id'] for x in ext_users_list],
+                                 vk.User.info_fields):
+        pass
+
     for ext_user in ext_users_list:
 
         # Read user info
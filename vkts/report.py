@@ -19,7 +19,7 @@ class Report():
         self.short_name = time.strftime("%F-%H%M%S")
         self.name = 'reports/' + self.type + '/' + self.short_name + '.html'
         self.text = 'Report is saved in ' + self.name + '\n\n'
-        self.html = '\n'.join(
+        self.html = '\n'.join((
             '<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.01 Transitional//EN">',
             '<Html>',
             '<Head>',
@@ -28,7 +28,7 @@ class Report():
             + ' charset=UTF-8">',
             '</Head>',
             '<Body topmargin="0" leftmargin="0" rightmargin="0"'
-            + ' bottommargin="0" marginheight="0" marginwidth="0">') + '\n'
+            + ' bottommargin="0" marginheight="0" marginwidth="0">')) + '\n'
         self.html_only = html_only
         self.empty = True
 
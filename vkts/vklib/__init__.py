@@ -2,7 +2,12 @@
 
 """TODO"""
 
-from .vkreq import apply_vk_method, Executor
+from .vkreq import (apply_vk_method, Executor, ExecuteFailure,
+                    configure_session, limiter, enable_cache, disable_cache)
+from .asyncreq import apply_vk_method_async, AsyncExecutor
+from .profiles import hydrate_profiles
+from .memberids import MemberIds
+from .deltalog import MembershipLog
 from .hotreqs import *
 from .vkobjs import *
 from .packs import *
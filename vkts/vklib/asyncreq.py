@@ -0,0 +1,258 @@
+#! /usr/bin/env python3
+
+"""Asynchronous version of requests to vk.com for programs built around
+asyncio. `apply_vk_method_async` and `AsyncExecutor` have the same
+semantics as `apply_vk_method` and `Executor`, but never block the event
+loop: pauses are made by `asyncio.sleep`, http requests are made by
+aiohttp (if it's installed, otherwise by pooled `requests` session in the
+default executor of the loop)."""
+
+import asyncio
+import functools
+import logging
+import os
+from collections import deque
+from .vkreq import (Executor, limiter, token_pool, mock_responses,
+                    session_options, get_session, get_timeout,
+                    _api_error_action, _vk_api_request, _vk_api_error_print,
+                    _make_params_string, _short_print, _from_cache, _to_cache)
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+logger = logging.getLogger()
+
+# aiohttp sessions (one per event loop)
+_aio_sessions = {}
+
+
+def _get_aio_session():
+    """Common aiohttp session of the running event loop"""
+
+    loop = asyncio.get_running_loop()
+    session = _aio_sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(limit=session_options['pool_size'])
+        timeout = aiohttp.ClientTimeout(
+            sock_connect=session_options['connect_timeout'],
+            sock_read=session_options['read_timeout'])
+        session = aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                        headers={'Accept-Encoding': 'gzip'})
+        _aio_sessions[loop] = session
+    return session
+
+
+async def close_async_session():
+    """Close aiohttp session of the running event loop (call it before
+    the loop is finished)"""
+
+    session = _aio_sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
+
+
+def _in_thread(func, *args):
+    """Run blocking function in default executor of the loop"""
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(None, functools.partial(func, *args))
+
+
+async def _vk_api_request_async(url_of_req, method, params):
+    """Request (can be mocked like `_vk_api_request`)"""
+
+    if os.path.isfile(mock_responses):
+        return _vk_api_request(url_of_req, method, params)
+
+    logger.debug("Try Async Request (method: %s)", method)
+    if aiohttp is None:
+        response = await _in_thread(
+            functools.partial(get_session().post, url_of_req, data=params,
+                              timeout=get_timeout()))
+        return response.json()
+
+    # aiohttp doesn't accept None values in form data
+    data = {k: str(v) for k, v in params.items() if v is not None}
+    async with _get_aio_session().post(url_of_req, data=data) as response:
+        return await response.json(content_type=None)
+
+
+async def apply_vk_method_async(method, handle_api_errors=True, **params):
+    """Make request to https://api.vk.com/method/. Return JSON-object.
+    Awaitable version of `apply_vk_method`."""
+
+    response = _from_cache(method, params)
+    if response is not None:
+        logger.debug("Cached response (method: %s)", method)
+        return {'response': response}
+    cache_params = dict(params)
+
+    # Token given by user or tokens of pool (none for mocked requests)
+    user_token = params.get('access_token')
+    is_mocked = os.path.isfile(mock_responses)
+    if not user_token and not is_mocked and not token_pool.is_loaded:
+        await _in_thread(token_pool.load)
+
+    # Set version (if user doesn't give specific this)
+    url_of_req = 'https://api.vk.com/method/' + method + '?'
+    if 'v' not in params:
+        params['v'] = '5.9'
+
+    # Do request with error processing
+    error_pause = 5
+    while True:
+
+        # Choose token
+        if user_token or is_mocked:
+            token = user_token
+        else:
+            token = token_pool.get(method).token
+        params['access_token'] = token
+
+        # Wait for free place in rate limits
+        delay = limiter.reserve(token, method)
+        if delay:
+            logger.debug("Rate limiter delay %.3f s (total %.1f s)",
+                         delay, limiter.waited)
+            await asyncio.sleep(delay)
+
+        try:
+            # Request
+            json_obj = await _vk_api_request_async(url_of_req, method, params)
+        except Exception as e:
+            # In case of network problems.
+            logger.debug("Request Error: " + str(e))
+            p_str = _make_params_string(params)
+            _short_print("Broken request: {}{}".format(url_of_req, p_str))
+            print(e)
+            if error_pause > 35:
+                raise
+            print('Wait ' + str(error_pause) + ' seconds')
+            await asyncio.sleep(error_pause)
+            error_pause += 5
+            continue
+
+        # Process response
+        if 'error' in json_obj:
+            logger.debug("API Error (%s: %s)", json_obj['error']['error_code'],
+                         json_obj['error']['error_msg'])
+            action, is_verbose = _api_error_action(
+                json_obj['error'], handle_api_errors,
+                is_pooled=not user_token and not is_mocked)
+            if action == 'rotate':
+                token_pool.disable(token, json_obj['error']['error_msg'])
+                if token_pool.has_usable():
+                    continue
+                action, is_verbose = 'return', True
+            if is_verbose:
+                _vk_api_error_print(json_obj['error'], url_of_req, params)
+
+            if action == 'refresh':
+                # bad user token is replaced by tokens of pool
+                if user_token:
+                    user_token = None
+                elif not is_mocked:
+                    await _in_thread(token_pool.refresh, token)
+                continue
+            elif action == 'throttle':
+                limiter.penalize(token, method)
+                continue
+            elif action == 'return':
+                return json_obj
+            elif action == 'empty':
+                return {}
+            else:
+                # In case of server problems.
+                if error_pause > 35:
+                    raise RuntimeError('vk API error {}: {}'.format(
+                        json_obj['error']['error_code'],
+                        json_obj['error']['error_msg']))
+                print('Wait ' + str(error_pause) + ' seconds')
+                await asyncio.sleep(error_pause)
+                error_pause += 5
+                continue
+
+        # No errors -> out loop
+        logger.debug("Successful Request")
+        limiter.reward(token, method)
+        break
+
+    _to_cache(method, cache_params, json_obj['response'])
+    return json_obj
+
+
+async def _run_steps_async(steps):
+    """Awaitable version of `vkreq._run_steps`: `execute` requests of
+    retries are made by `apply_vk_method_async`"""
+
+    try:
+        code = next(steps)
+        while True:
+            json_obj = await apply_vk_method_async('execute', code=code)
+            code = steps.send(json_obj)
+    except StopIteration as e:
+        return e.value
+
+
+async def _no_request():
+    return {'response': []}
+
+
+class AsyncExecutor(Executor):
+    """Awaitable version of `Executor`: requests are added by
+    `AsyncExecutor.add_request()` and packed into `execute` requests by
+    `await AsyncExecutor.emit_requests()`. Up to `workers` packs are in flight
+    simultaneously; processors are called in order of submission.
+
+    Example:
+    >>> async def main():
+    >>>     e = AsyncExecutor(workers=4)
+    >>>     for name in ['phys_kek', 'drec_mipt']:
+    >>>         e.add_request('utils.resolveScreenName', screen_name=name)
+    >>>     await e.emit_requests()
+    >>>     print([r['object_id'] for r in e.responses])
+    >>> asyncio.run(main())
+    [111557607, 17708]"""
+
+    def __init__(self, workers=4):
+        Executor.__init__(self, workers)
+
+    async def emit_requests(self):
+        """Pack requests into `execute` requests and emit them to server.
+        Responses will be saved in `AsyncExecutor.responses`."""
+
+        logger.debug("Emit requests asynchronously (%s pieces)",
+                     len(self.requests))
+        self.responses = []
+        self.errors = []
+
+        # keep up to `workers` packs in flight, process in order
+        in_flight = deque()
+
+        async def process_first():
+            task, items = in_flight.popleft()
+            # failed requests are emitted again without blocking the loop
+            pairs = await _run_steps_async(
+                self._unpack_steps(await task, items))
+            for item, response in pairs:
+                self._dispatch(item, response)
+
+        # processors of responses can add new requests
+        while self.requests or in_flight:
+            if not self.requests:
+                await process_first()
+                continue
+            # wait for responses which are parameters of next request
+            while self._is_head_blocked() and in_flight:
+                await process_first()
+            code, items = self._pop_pack()
+            if all(x.is_local() for x in items):
+                # only copies of requests of previous packs
+                task = asyncio.ensure_future(_no_request())
+            else:
+                task = asyncio.ensure_future(
+                    apply_vk_method_async('execute', code=code))
+            in_flight.append((task, items))
+            if len(in_flight) > max(self.workers, 1):
+                await process_first()
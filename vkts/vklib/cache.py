@@ -0,0 +1,147 @@
+#! /usr/bin/env python3
+
+"""Cache of responses of read-only vk methods (switched on by
+`vkreq.enable_cache`). Fresh entries live in memory (LRU) and in sqlite
+file, so they survive restarts. After TTL of method the entry is stale:
+it's still returned, but the request is repeated in background
+(stale-while-revalidate)."""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# TTL (seconds) of cached responses. Key is method or method family
+# ('database.' for all methods of family)
+TTLS = {'groups.getById': 24 * 3600,
+        'utils.resolveScreenName': 24 * 3600,
+        'users.get': 3600,
+        'database.': 7 * 24 * 3600}
+
+# Parameters which don't change response
+_IGNORED_PARAMS = ('access_token', 'v')
+
+
+class ResponseCache:
+    """Cache of responses with per-method TTL.
+
+    `path` - sqlite file (None - memory only)
+    `max_items` - number of responses in memory
+    `ttls` - dict like `TTLS`
+    `stale_factor` - stale response is returned until its age is less than
+                     TTL * `stale_factor`
+
+    Statistic: `ResponseCache.hits`, `ResponseCache.stale_hits`,
+    `ResponseCache.misses`."""
+
+    def __init__(self, path=None, max_items=10000, ttls=None, stale_factor=2):
+        self.path = path
+        self.max_items = max_items
+        self.ttls = dict(ttls) if ttls else dict(TTLS)
+        self.stale_factor = stale_factor
+        self.items = OrderedDict()  # key: (stamp, response)
+        self.revalidating = set()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        self.db = None
+        if path:
+            dir_name = os.path.dirname(path)
+            if dir_name and not os.path.isdir(dir_name):
+                os.makedirs(dir_name)
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute('CREATE TABLE IF NOT EXISTS responses '
+                            '(key TEXT PRIMARY KEY, stamp REAL, '
+                            'response TEXT)')
+            self.db.commit()
+
+    def get_ttl(self, method):
+        """TTL of method (None if method isn't cached)"""
+
+        if method in self.ttls:
+            return self.ttls[method]
+        return self.ttls.get(method.split('.')[0] + '.')
+
+    def is_cacheable(self, method):
+        return self.get_ttl(method) is not None
+
+    @staticmethod
+    def key(method, params):
+        return method + ' ' + json.dumps(
+            {k: v for k, v in params.items() if k not in _IGNORED_PARAMS},
+            sort_keys=True, ensure_ascii=False, default=str)
+
+    def get(self, method, params):
+        """Returns pair: response, is it fresh. Or None if response
+        is absent or too old."""
+
+        key = self.key(method, params)
+        ttl = self.get_ttl(method)
+        with self.lock:
+            entry = self.items.get(key)
+            if entry is not None:
+                self.items.move_to_end(key)
+            elif self.db is not None:
+                row = self.db.execute('SELECT stamp, response FROM responses '
+                                      'WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    entry = (row[0], json.loads(row[1]))
+                    self._remember(key, entry)
+
+            age = time.time() - entry[0] if entry is not None else None
+            if entry is None or age >= ttl * self.stale_factor:
+                self.misses += 1
+                return None
+            if age < ttl:
+                self.hits += 1
+                return entry[1], True
+            self.stale_hits += 1
+            return entry[1], False
+
+    def put(self, method, params, response):
+        """Save response of request"""
+
+        key = self.key(method, params)
+        entry = (time.time(), response)
+        with self.lock:
+            self._remember(key, entry)
+            if self.db is not None:
+                self.db.execute('INSERT OR REPLACE INTO responses '
+                                'VALUES (?, ?, ?)',
+                                (key, entry[0], json.dumps(response)))
+                self.db.commit()
+
+    def _remember(self, key, entry):
+        self.items[key] = entry
+        self.items.move_to_end(key)
+        while len(self.items) > self.max_items:
+            self.items.popitem(last=False)
+
+    def start_revalidation(self, method, params):
+        """Mark stale response as being updated. Returns False if it's
+        already being updated."""
+
+        key = self.key(method, params)
+        with self.lock:
+            if key in self.revalidating:
+                return False
+            self.revalidating.add(key)
+            return True
+
+    def end_revalidation(self, method, params):
+        with self.lock:
+            self.revalidating.discard(self.key(method, params))
+
+    def stats(self):
+        """Counters of hits and misses"""
+        return {'hits': self.hits, 'stale_hits': self.stale_hits,
+                'misses': self.misses}
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
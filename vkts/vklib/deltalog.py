@@ -0,0 +1,249 @@
+#! /usr/bin/env python3
+
+"""Append-only log of membership of a community: base snapshot of members
+and compressed deltas (joined and left members) of every next check. It
+answers "members at time T", "joins/leaves between T1 and T2" and churn
+rates by reading only needed records.
+
+Record of file: header (kind, time, size of payload) + payload compressed
+by zlib. Kind b'B' - base snapshot (sorted ids), b'D' - delta (sorted ids
+of joined and left members). Ids are stored as differences of neighbours,
+so they are compressed well."""
+
+import os
+import struct
+import time
+import zlib
+from array import array
+from itertools import accumulate, chain
+from operator import sub
+from .memberids import MemberIds
+
+_HEADER = struct.Struct('<1sdI')
+_COUNTS = struct.Struct('<II')
+
+
+def _encode(ids):
+    """Bytes of sorted ids (differences of neighbours)"""
+    return array('I', map(sub, ids, chain((0,), ids))).tobytes()
+
+
+def _decode(data):
+    """Sorted ids from bytes of `_encode`"""
+
+    diffs = array('I')
+    diffs.frombytes(data)
+    return MemberIds._of_sorted(array('I', accumulate(diffs)))
+
+
+class MembershipLog:
+    """Log of membership in file `path`.
+
+    `checkpoint_ratio` - new base snapshot is appended when deltas after the
+                         last base are bigger than this part of the base
+                         (so state is restored by few records)
+    `retention` - if given, history older than this number of seconds is
+                  dropped when a base snapshot is appended (see
+                  `MembershipLog.compact()`), so the file doesn't grow
+                  without bound
+
+    Example:
+    >>> log = MembershipLog('data/adm_groups/miptru/members.log')
+    >>> joined, left = log.record(group.members)
+    >>> log.members_at(time.time() - 7 * 24 * 3600)
+    >>> log.changes(t1, t2)"""
+
+    def __init__(self, path, checkpoint_ratio=0.5, retention=None):
+        self.path = path
+        self.checkpoint_ratio = checkpoint_ratio
+        self.retention = retention
+        self.records = []  # (kind, stamp, offset of payload, size)
+        self._current = None  # cached last state
+        if not os.path.isfile(path):
+            return
+
+        # read headers only
+        file_size = os.path.getsize(path)
+        offset = 0
+        with open(path, 'rb') as fp:
+            while offset + _HEADER.size <= file_size:
+                kind, stamp, size = _HEADER.unpack(fp.read(_HEADER.size))
+                if offset + _HEADER.size + size > file_size:
+                    break
+                self.records.append((kind, stamp, offset + _HEADER.size,
+                                     size))
+                offset += _HEADER.size + size
+                fp.seek(offset)
+
+        # tail can be broken by interrupted writing
+        if offset < file_size:
+            with open(path, 'r+b') as fp:
+                fp.truncate(offset)
+
+    def __len__(self):
+        return len(self.records)
+
+    def _payload(self, fp, record):
+        fp.seek(record[2])
+        return zlib.decompress(fp.read(record[3]))
+
+    def _delta(self, fp, record):
+        """Pair of MemberIds (joined, left) of delta record"""
+
+        data = self._payload(fp, record)
+        n_joined, n_left = _COUNTS.unpack_from(data)
+        start = _COUNTS.size
+        middle = start + 4 * n_joined
+        return (_decode(data[start:middle]),
+                _decode(data[middle:middle + 4 * n_left]))
+
+    def _append(self, kind, stamp, payload):
+        payload = zlib.compress(payload)
+        with open(self.path, 'ab') as fp:
+            offset = fp.tell() + _HEADER.size
+            fp.write(_HEADER.pack(kind, stamp, len(payload)) + payload)
+        self.records.append((kind, stamp, offset, len(payload)))
+
+    def _state(self, fp, end):
+        """Members after first `end` records"""
+
+        bases = [i for i in range(end) if self.records[i][0] == b'B']
+        if not bases:
+            return MemberIds()
+        state = _decode(self._payload(fp, self.records[bases[-1]]))
+        for record in self.records[bases[-1] + 1:end]:
+            joined, left = self._delta(fp, record)
+            state = state.difference(left).union(joined)
+        return state
+
+    def _count_before(self, stamp):
+        """Number of records with time <= `stamp`"""
+
+        # records are ordered by time: binary search
+        lo, hi = 0, len(self.records)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.records[mid][1] <= stamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def current(self):
+        """The last recorded members"""
+
+        if self._current is None:
+            if not self.records:
+                return MemberIds()
+            with open(self.path, 'rb') as fp:
+                self._current = self._state(fp, len(self.records))
+        return self._current
+
+    def record(self, members, stamp=None):
+        """Save new state of members. Returns pair of MemberIds
+        (joined, left) since the last state (nothing is written if there
+        are no changes)."""
+
+        stamp = time.time() if stamp is None else stamp
+        members = MemberIds(members)
+        if not self.records:
+            self._append(b'B', stamp, _encode(members))
+            self._current = members
+            return MemberIds(), MemberIds()
+
+        old = self.current()
+        joined, left = members.difference(old), old.difference(members)
+        if joined or left:
+            self._append(b'D', stamp,
+                         _COUNTS.pack(len(joined), len(left))
+                         + _encode(joined) + _encode(left))
+            self._current = members
+            self._checkpoint(stamp)
+        return joined, left
+
+    def _checkpoint(self, stamp):
+        """Append base snapshot if deltas after the last one are too big"""
+
+        i = max(i for i, x in enumerate(self.records) if x[0] == b'B')
+        deltas = sum(x[3] for x in self.records[i + 1:])
+        if deltas > self.checkpoint_ratio * self.records[i][3]:
+            self._append(b'B', stamp, _encode(self._current))
+            if self.retention is not None:
+                self.compact(stamp - self.retention)
+
+    def members_at(self, stamp):
+        """Members at time `stamp` (empty before the first record)"""
+
+        if not self.records:
+            return MemberIds()
+        with open(self.path, 'rb') as fp:
+            return self._state(fp, self._count_before(stamp))
+
+    def changes(self, start, end=None):
+        """Pair of MemberIds (joined, left): result of changes between times
+        `start` and `end` (now if None). Only deltas are read."""
+
+        end = time.time() if end is None else end
+        joined, left = set(), set()
+        first, last = self._count_before(start), self._count_before(end)
+        if first < last:
+            with open(self.path, 'rb') as fp:
+                for record in self.records[first:last]:
+                    if record[0] != b'D':
+                        continue
+                    new_joined, new_left = self._delta(fp, record)
+                    for x in new_joined:
+                        if x in left:
+                            left.discard(x)
+                        else:
+                            joined.add(x)
+                    for x in new_left:
+                        if x in joined:
+                            joined.discard(x)
+                        else:
+                            left.add(x)
+        return MemberIds(joined), MemberIds(left)
+
+    def churn(self, start, end=None):
+        """Rates of changes between times `start` and `end` (now if None):
+        {'joined': .., 'left': .., 'joined_per_day': .., 'left_per_day': ..}
+        (every event is counted, not only net result)"""
+
+        end = time.time() if end is None else end
+        res = {'joined': 0, 'left': 0}
+        first, last = self._count_before(start), self._count_before(end)
+        if first < last:
+            with open(self.path, 'rb') as fp:
+                for record in self.records[first:last]:
+                    if record[0] == b'D':
+                        n_joined, n_left = _COUNTS.unpack_from(
+                            self._payload(fp, record))
+                        res['joined'] += n_joined
+                        res['left'] += n_left
+        days = max(end - start, 1.) / (24 * 3600)
+        res['joined_per_day'] = res['joined'] / days
+        res['left_per_day'] = res['left'] / days
+        return res
+
+    def compact(self, before):
+        """Drop history before time `before`: state at this time becomes
+        the first base snapshot. File is rewritten atomically."""
+
+        first = self._count_before(before)
+        if first < 2:
+            # only the first base is older
+            return
+        tail = []
+        with open(self.path, 'rb') as fp:
+            base = self._state(fp, first)
+            for kind, stamp, offset, size in self.records[first:]:
+                fp.seek(offset)
+                tail.append((kind, stamp, fp.read(size)))
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as fp:
+            payload = zlib.compress(_encode(base))
+            fp.write(_HEADER.pack(b'B', before, len(payload)) + payload)
+            for kind, stamp, payload in tail:
+                fp.write(_HEADER.pack(kind, stamp, len(payload)) + payload)
+        os.replace(tmp_path, self.path)
+        self.__init__(self.path, self.checkpoint_ratio, self.retention)
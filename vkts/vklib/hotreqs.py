@@ -3,6 +3,8 @@
 """Most frequently used requests to vk.com"""
 
 from .vkreq import apply_vk_method, Executor
+from .idindex import get_index
+from .profiles import hydrate_profiles
 from collections.abc import Iterable
 
 
@@ -16,34 +18,82 @@ def get_group_name(group_id):
     return response['response'][0]['name']
 
 
+# types of objects of `utils.resolveScreenName` by kind of resolved ids
+_SCREEN_NAME_TYPES = {'group': ('group', 'page', 'event'),
+                      'user': ('user',)}
+
+
+def _is_digit_id(some_id):
+    return isinstance(some_id, int) or some_id.isdigit()
+
+
+def resolve_ids(some_ids, kind='group', workers=1):
+    """Resolve list of digit ids or domains of groups (`kind` is 'group')
+    or users (`kind` is 'user'). Returns list of pairs (digit_id, domain_id)
+    or None for ids which can't be resolved (including screen names of
+    objects of the other kind). Known ids are taken from the persistent
+    index (see `idindex`), the rest are loaded by `execute` packs and added
+    to the index."""
+
+    some_ids = list(some_ids)
+    index = get_index()
+    res = [index.lookup(kind, x) for x in some_ids]
+
+    # load info for resolving the rest
+    e = Executor(workers, keep_responses=False)
+    handles = []
+    for some_id, pair in zip(some_ids, res):
+        if pair is not None:
+            handles.append(None)
+        elif not _is_digit_id(some_id):
+            handles.append(e.add_request('utils.resolveScreenName',
+                                         screen_name=some_id))
+        elif kind == 'group':
+            handles.append(e.add_request('groups.getById',
+                                         group_ids=some_id))
+        else:
+            handles.append(e.add_request('users.get', user_ids=some_id,
+                                         fields='screen_name'))
+    e.emit_requests()
+
+    # collect result list & save it to the index
+    new_pairs = []
+    for i, (some_id, handle) in enumerate(zip(some_ids, handles)):
+        if handle is None:
+            continue
+        if _is_digit_id(some_id):
+            pair = (int(some_id), handle[0]['screen_name'].result())
+        elif handle['type'].result() in _SCREEN_NAME_TYPES[kind]:
+            pair = (handle['object_id'].result(), some_id)
+        else:
+            continue
+        if None not in pair:
+            res[i] = pair
+            new_pairs.append(pair)
+    index.add_many(kind, new_pairs)
+    return res
+
+
+def _resolve_list(some_ids, kind):
+    """Resolve list by `resolve_ids`, error if some ids aren't resolved"""
+
+    some_ids = list(some_ids)
+    res = resolve_ids(some_ids, kind)
+    unresolved = [str(x) for x, r in zip(some_ids, res) if r is None]
+    if unresolved:
+        raise ValueError('Unable to resolve {} ids: {}'.format(
+            kind, ', '.join(unresolved)))
+    return res
+
+
 def resolve_group_ids(group_ids):
     """resolve_group_ids(digit id or domain of group) -> digit_id, domain_id.
-    You can pass iterable argument for resolve every id in it."""
+    You can pass iterable argument for resolve every id in it
+    (see `resolve_ids`). Single id is always resolved by request, because
+    screen names can be changed."""
 
     if isinstance(group_ids, Iterable) and not isinstance(group_ids, str):
-
-        # load info for resolving
-        e = Executor()
-        for group_id in group_ids:
-            # is `group_id` digit or domain?
-            if isinstance(group_id, int) or group_id.isdigit():
-                e.add_request('groups.getById', group_ids=group_id)
-            else:
-                e.add_request('utils.resolveScreenName', screen_name=group_id)
-        e.emit_requests()
-
-        # collect result list & return
-        res = []
-        for group_id, r in zip(group_ids, e.responses):
-            # is `group_id` digit or domain?
-            if isinstance(group_id, int) or group_id.isdigit():
-                digit_id = int(group_id)
-                domain_id = r[0]['screen_name']
-            else:
-                digit_id = r['object_id']
-                domain_id = group_id
-            res.append((digit_id, domain_id))
-        return res
+        return _resolve_list(group_ids, 'group')
 
     # `group_ids` is digit or domain?
     if isinstance(group_ids, int) or group_ids.isdigit():
@@ -56,20 +106,26 @@ def resolve_group_ids(group_ids):
         digit_id = response['response']['object_id']
         domain_id = group_ids
 
+    get_index().add('group', digit_id, domain_id)
     return digit_id, domain_id
 
 
 def get_user_name(user_id):
-    response = apply_vk_method('users.get', user_ids=user_id)
-    if response:
-        return response['response'][0]['first_name'] + ' ' \
-               + response['response'][0]['last_name']
+    profiles = list(hydrate_profiles([user_id],
+                                     ('first_name', 'last_name')))
+    if profiles and profiles[0]['first_name'] is not None:
+        return profiles[0]['first_name'] + ' ' + profiles[0]['last_name']
     else:
         return 'No name'
 
 
 def resolve_user_ids(user_id):
-    """resolve_user_ids(digit id or domain of user) -> digit_id, domain_id"""
+    """resolve_user_ids(digit id or domain of user) -> digit_id, domain_id.
+    You can pass iterable argument for resolve every id in it
+    (see `resolve_ids`)."""
+
+    if isinstance(user_id, Iterable) and not isinstance(user_id, str):
+        return _resolve_list(user_id, 'user')
 
     # `user_id` is digit or domain?
     if isinstance(user_id, int) or user_id.isdigit():
@@ -83,6 +139,7 @@ def resolve_user_ids(user_id):
         digit_id = response['response']['object_id']
         domain_id = user_id
 
+    get_index().add('user', digit_id, domain_id)
     return digit_id, domain_id
 
 
@@ -0,0 +1,78 @@
+#! /usr/bin/env python3
+
+"""Persistent two-way index screen_name <-> numeric id of vk users and
+groups (sqlite file in directory .vkts/). It's filled by resolving
+functions of `hotreqs`, so every name is requested from vk.com once."""
+
+import os
+import sqlite3
+import threading
+from ..usrdata import UsrData
+
+_index = None
+
+
+def get_index():
+    """Common index of the process"""
+
+    global _index
+    if _index is None:
+        _index = IdIndex()
+    return _index
+
+
+class IdIndex:
+    """Index of pairs (numeric id, screen_name). `kind` of object is
+    'user' or 'group'."""
+
+    def __init__(self, path=os.path.join(UsrData.data_path, 'ids.sqlite')):
+        dir_name = os.path.dirname(path)
+        if dir_name and not os.path.isdir(dir_name):
+            os.makedirs(dir_name)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS ids (kind TEXT, '
+                        'id INTEGER, screen_name TEXT, '
+                        'PRIMARY KEY (kind, id))')
+        self.db.execute('CREATE INDEX IF NOT EXISTS ids_by_name '
+                        'ON ids (kind, screen_name)')
+        self.db.commit()
+        self.lock = threading.Lock()
+
+    def get_screen_name(self, kind, digit_id):
+        """Screen name by numeric id (None if it's unknown)"""
+
+        with self.lock:
+            row = self.db.execute('SELECT screen_name FROM ids '
+                                  'WHERE kind = ? AND id = ?',
+                                  (kind, int(digit_id))).fetchone()
+        return row[0] if row else None
+
+    def get_id(self, kind, screen_name):
+        """Numeric id by screen name (None if it's unknown)"""
+
+        with self.lock:
+            row = self.db.execute('SELECT id FROM ids '
+                                  'WHERE kind = ? AND screen_name = ?',
+                                  (kind, screen_name)).fetchone()
+        return row[0] if row else None
+
+    def lookup(self, kind, some_id):
+        """Pair (numeric id, screen name) by any of them
+        (None if it's unknown)"""
+
+        if isinstance(some_id, int) or some_id.isdigit():
+            screen_name = self.get_screen_name(kind, some_id)
+            return (int(some_id), screen_name) if screen_name else None
+        digit_id = self.get_id(kind, some_id)
+        return (digit_id, some_id) if digit_id is not None else None
+
+    def add_many(self, kind, pairs):
+        """Save pairs (numeric id, screen name)"""
+
+        with self.lock:
+            self.db.executemany('INSERT OR REPLACE INTO ids VALUES (?, ?, ?)',
+                                ((kind, int(x[0]), x[1]) for x in pairs))
+            self.db.commit()
+
+    def add(self, kind, digit_id, screen_name):
+        self.add_many(kind, [(digit_id, screen_name)])
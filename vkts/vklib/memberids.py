@@ -0,0 +1,215 @@
+#! /usr/bin/env python3
+
+"""Compact storage of ids of community members: sorted array of uint32
+(4 bytes per id instead of ~36 of list of ints). Union, difference and
+intersection of big sets are made by vectorized operations of numpy (if
+it's installed, otherwise by set operations of Python). Array can be
+a read-only view of memory-mapped file (see `MemberIds.from_buffer`), it's
+copied to memory only when ids are added."""
+
+import itertools
+import sys
+from array import array
+from bisect import bisect_left
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def _unique_sorted(ids):
+    """Sorted array of unique `ids` (array('I'))"""
+
+    if numpy is not None:
+        return _from_numpy(numpy.unique(_to_numpy(ids)))
+    return array('I', sorted(set(ids)))
+
+
+def _copy(ids):
+    """Copy of array or memoryview of ids (array('I'))"""
+
+    res = array('I')
+    res.frombytes(memoryview(ids).cast('B'))
+    return res
+
+
+def _union_sorted(a, b):
+    """Union of sorted arrays of unique ids: ids of the longer array which
+    aren't in the shorter one are joined with it (sort of two sorted runs
+    is a linear merge)"""
+
+    if len(a) < len(b):
+        a, b = b, a
+    return array('I', sorted(itertools.chain(
+        _difference_sorted(a, b), b)))
+
+
+def _difference_sorted(a, b):
+    """Ids of sorted array `a` which aren't in `b` (order of `a` is kept)"""
+    return array('I', itertools.filterfalse(set(b).__contains__, a))
+
+
+def _intersection_sorted(a, b):
+    """Ids of both sorted arrays (the shorter one is filtered by set of
+    the other, so order is kept)"""
+
+    if len(a) > len(b):
+        a, b = b, a
+    return array('I', filter(set(b).__contains__, a))
+
+
+def _to_numpy(ids):
+    return numpy.frombuffer(ids, dtype=numpy.uint32)
+
+
+def _from_numpy(values):
+    res = array('I')
+    res.frombytes(values.astype(numpy.uint32).tobytes())
+    return res
+
+
+class MemberIds:
+    """Sorted set of ids with list-like interface for reading: `len`,
+    iteration, indexing, slicing, `in` (binary search).
+    Ids are added by `MemberIds.extend()` (or `+=`) cheaply: the array is
+    sorted and cleaned of repeats only when it's read.
+
+    Example:
+    >>> a = MemberIds([5, 1, 3])
+    >>> a += [3, 2]
+    >>> list(a), 2 in a, a[-1]
+    ([1, 2, 3, 5], True, 5)
+    >>> list(a.difference([1, 5]))
+    [2, 3]"""
+
+    __slots__ = ('_ids', '_is_sorted')
+
+    def __init__(self, ids=()):
+        if isinstance(ids, MemberIds):
+            self._ids = _copy(ids._sorted())
+            self._is_sorted = True
+        else:
+            self._ids = array('I', ids)
+            self._is_sorted = len(self._ids) < 2
+
+    @classmethod
+    def _of_sorted(cls, ids):
+        """Wrap array of sorted unique ids (without copying)"""
+
+        res = cls()
+        res._ids = ids
+        res._is_sorted = True
+        return res
+
+    @classmethod
+    def from_buffer(cls, buf, byteorder=sys.byteorder):
+        """Ids of buffer `buf` (for example, slice of memoryview of mmap) with
+        sorted unique uint32 of `byteorder`. Data isn't copied if byte order
+        is native."""
+
+        ids = buf.cast('I')
+        if byteorder != sys.byteorder:
+            ids = _copy(ids)
+            ids.byteswap()
+        return cls._of_sorted(ids)
+
+    def _sorted(self):
+        if not self._is_sorted:
+            self._ids = _unique_sorted(self._ids)
+            self._is_sorted = True
+        return self._ids
+
+    def _as_array(self, other):
+        """Sorted array of unique ids of any iterable"""
+
+        if isinstance(other, MemberIds):
+            return other._sorted()
+        return _unique_sorted(array('I', other))
+
+    def extend(self, ids):
+        if not isinstance(self._ids, array):
+            # read-only view of file
+            self._ids = _copy(self._ids)
+        self._ids.extend(ids if isinstance(ids, array) else array('I', ids))
+        self._is_sorted = len(self._ids) < 2
+
+    def append(self, some_id):
+        self.extend((some_id,))
+
+    def __iadd__(self, ids):
+        self.extend(ids._sorted() if isinstance(ids, MemberIds) else ids)
+        return self
+
+    def union(self, other):
+        a, b = self._sorted(), self._as_array(other)
+        if numpy is not None:
+            return self._of_sorted(_from_numpy(
+                numpy.union1d(_to_numpy(a), _to_numpy(b))))
+        return self._of_sorted(_union_sorted(a, b))
+
+    def difference(self, other):
+        a, b = self._sorted(), self._as_array(other)
+        if numpy is not None:
+            return self._of_sorted(_from_numpy(numpy.setdiff1d(
+                _to_numpy(a), _to_numpy(b), assume_unique=True)))
+        return self._of_sorted(_difference_sorted(a, b))
+
+    def intersection(self, other):
+        a, b = self._sorted(), self._as_array(other)
+        if numpy is not None:
+            return self._of_sorted(_from_numpy(numpy.intersect1d(
+                _to_numpy(a), _to_numpy(b), assume_unique=True)))
+        return self._of_sorted(_intersection_sorted(a, b))
+
+    def __add__(self, other):
+        return self.union(other)
+
+    def __radd__(self, other):
+        return self.union(other)
+
+    def __sub__(self, other):
+        return self.difference(other)
+
+    def __and__(self, other):
+        return self.intersection(other)
+
+    def __contains__(self, some_id):
+        ids = self._sorted()
+        try:
+            i = bisect_left(ids, int(some_id))
+        except (TypeError, ValueError):
+            return False
+        return i < len(ids) and ids[i] == int(some_id)
+
+    def __len__(self):
+        return len(self._sorted())
+
+    def __iter__(self):
+        return iter(self._sorted())
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            if key.step is not None and key.step < 0:
+                return self.tolist()[key]
+            return self._of_sorted(self._sorted()[key])
+        return self._sorted()[key]
+
+    def __eq__(self, other):
+        if isinstance(other, MemberIds):
+            return self.tobytes() == other.tobytes()
+        if isinstance(other, (list, tuple, array)):
+            return self.tolist() == list(other)
+        return NotImplemented
+
+    def tolist(self):
+        return self._sorted().tolist()
+
+    def tobytes(self):
+        return self._sorted().tobytes()
+
+    def __repr__(self):
+        return 'MemberIds({})'.format(self.tolist())
+
+    def __str__(self):
+        return str(self.tolist())
@@ -5,19 +5,30 @@
 import sys
 import os
 from .vkobjs import User, Group
-from .hotreqs import domain_2_digital_id, get_group_name, get_group_domain
+from .vkreq import Executor
+from .hotreqs import domain_2_digital_id
 
 
 # Add group in data/groups_packs/pack_name by group_id or screen_name
 def add_group_to_pack(pack_name, some_group_id):
 
-    # Read args
+    # Read args (id, screen name and name of group by single request)
+    e = Executor()
+    obj = None
     if some_group_id.isdigit():
-        group_id = some_group_id
-        scrname = get_group_domain(group_id)
+        group = e.add_request('groups.getById', group_id=some_group_id)
     else:
-        scrname = some_group_id
-        group_id = str(domain_2_digital_id(scrname))
+        obj = e.add_request('utils.resolveScreenName',
+                            screen_name=some_group_id)
+        group = e.add_request('groups.getById', group_id=obj['object_id'])
+    e.emit_requests()
+    if (group[0]['id'].result() is None or obj is not None
+            and obj['type'].result() not in ('group', 'page', 'event')):
+        print('Group ' + some_group_id + ' is not found')
+        sys.exit()
+    group_id = str(group[0]['id'].result())
+    scrname = group[0]['screen_name'].result()
+    name = group[0]['name'].result()
 
     # Build dir if absent
     if not os.path.isdir('data/groups_packs'):
@@ -35,8 +46,7 @@ def add_group_to_pack(pack_name, some_group_id):
                 sys.exit()
 
     # Add group in file
-    new_line = (group_id + ' # ' + scrname + ' # '
-                + get_group_name(group_id) + '\n')
+    new_line = group_id + ' # ' + scrname + ' # ' + name + '\n'
     with open('data/groups_packs/' + pack_name, 'a') as f:
         f.write(new_line)
 
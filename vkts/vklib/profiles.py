@@ -0,0 +1,219 @@
+#! /usr/bin/env python3
+
+"""Shared store of user profiles (sqlite file in directory .vkts/). Every
+part of vkts which needs `users.get` data asks `hydrate_profiles` for
+fields it needs: known fields are taken from the store, only missing or
+stale (user, field) pairs are loaded, and partial profiles are merged.
+So a user touched by several reports costs one API call."""
+
+import hashlib
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+from .vkreq import Executor
+from . import vkscript
+from ..usrdata import UsrData
+
+# Keys of profile which are given by other `fields` of `users.get`
+# (None - key is always returned)
+_API_FIELDS = {'first_name': None,
+               'last_name': None,
+               'university': 'education',
+               'university_name': 'education',
+               'faculty': 'education',
+               'faculty_name': 'education',
+               'graduation': 'education'}
+
+# number of ids processed at once by `ProfileStore.hydrate()` (per worker):
+# about one `execute` pack of `users.get`
+_HYDRATE_CHUNK = 25000
+
+_store = None
+
+
+def get_store():
+    """Common store of the process"""
+
+    global _store
+    if _store is None:
+        _store = ProfileStore()
+    return _store
+
+
+def api_fields(fields):
+    """Value of parameter `fields` of `users.get` (and of other methods
+    returning profiles) for keys of profile `fields`"""
+
+    res = set(_API_FIELDS.get(f, f) for f in fields)
+    res.discard(None)
+    return ','.join(sorted(res))
+
+
+def hydrate_profiles(user_ids, fields, where=None, workers=1):
+    """Generate profiles of users from the common store (see
+    `ProfileStore.hydrate()`)"""
+    return get_store().hydrate(user_ids, fields, where, workers)
+
+
+def _where_key(where):
+    """Key of stamps of users dropped by condition `where`"""
+
+    names = ('v{}'.format(i) for i in itertools.count())
+    code = where.code('item', 'ok', names)
+    return 'where ' + hashlib.sha1(code.encode()).hexdigest()[:16]
+
+
+class ProfileStore:
+    """Profiles {'id': .., field: value, ...} of users. Every field has
+    time of loading, after `ttl` seconds it's loaded again."""
+
+    def __init__(self,
+                 path=os.path.join(UsrData.data_path, 'profiles.sqlite'),
+                 ttl=24 * 3600):
+        dir_name = os.path.dirname(path)
+        if dir_name and not os.path.isdir(dir_name):
+            os.makedirs(dir_name)
+        self.ttl = ttl
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS profiles '
+                        '(id INTEGER PRIMARY KEY, profile TEXT, stamps TEXT)')
+        self.db.commit()
+        self.lock = threading.Lock()
+
+    def _read(self, user_ids):
+        """Stored pairs (profile, stamps) of users: {id: pair}"""
+
+        res = {}
+        user_ids = list(set(int(x) for x in user_ids))
+        step = 500  # number of sqlite variables is limited
+        with self.lock:
+            for i in range(0, len(user_ids), step):
+                part = user_ids[i:i+step]
+                rows = self.db.execute(
+                    'SELECT id, profile, stamps FROM profiles WHERE id IN '
+                    '({})'.format(','.join('?' * len(part))), part)
+                for user_id, profile, stamps in rows:
+                    res[user_id] = (json.loads(profile), json.loads(stamps))
+        return res
+
+    def _write(self, entries):
+        """Save profiles: {id: (profile, stamps)}"""
+
+        with self.lock:
+            self.db.executemany(
+                'INSERT OR REPLACE INTO profiles VALUES (?, ?, ?)',
+                ((k, json.dumps(v[0], ensure_ascii=False), json.dumps(v[1]))
+                 for k, v in entries.items()))
+            self.db.commit()
+
+    def hydrate(self, user_ids, fields, where=None, workers=1):
+        """Generate profiles of users `user_ids` with keys `fields` (and
+        'id'). Missing or stale fields are loaded by `users.get` in `execute`
+        packs and merged into stored profiles. Ids are processed by chunks,
+        so memory doesn't depend on number of users.
+        `where` - object of class `vkscript.Condition`: loaded users which
+                  don't satisfy it are dropped on the server side (caller
+                  has to filter the result anyway). Dropped users are
+                  remembered for `ttl` seconds and aren't requested again
+                  with the same condition.
+        Profiles are generated in order of `user_ids` (users without
+        profile are skipped)."""
+
+        fields = tuple(fields)
+        where_key = _where_key(where) if where is not None else None
+        user_ids = iter(user_ids)
+        while True:
+            chunk = [int(x) for x in
+                     itertools.islice(user_ids, _HYDRATE_CHUNK * workers)]
+            if not chunk:
+                return
+            stored = self._read(chunk)
+            self._load(chunk, fields, where, where_key, workers, stored)
+            now = time.time()
+            for x in chunk:
+                if x not in stored:
+                    continue
+                profile, stamps = stored[x]
+                if (where_key is not None
+                        and now - stamps.get(where_key, 0) < self.ttl
+                        and any(f not in profile for f in fields)):
+                    continue  # dropped by `where`
+                yield {f: profile.get(f) for f in ('id',) + fields}
+
+    def _load(self, user_ids, fields, where, where_key, workers, stored):
+        """Load missing or stale `fields` of users for `hydrate()`"""
+
+        # group users by sets of fields to be loaded
+        now = time.time()
+        to_load = {}
+        for user_id in dict.fromkeys(user_ids):
+            stamps = stored[user_id][1] if user_id in stored else {}
+            if (where_key is not None
+                    and now - stamps.get(where_key, 0) < self.ttl):
+                continue
+            missing = frozenset(f for f in fields
+                                if now - stamps.get(f, 0) >= self.ttl)
+            if missing:
+                to_load.setdefault(missing, []).append(user_id)
+
+        # load them
+        e = Executor(workers, autoflush=True, keep_responses=False)
+        loaded = {}  # {missing: [set of loaded ids, all chunks are loaded]}
+        for missing, ids in to_load.items():
+            fields_s = api_fields(missing)
+            params = {'fields': fields_s} if fields_s else {}
+            select = vkscript.Select(('id',) + tuple(sorted(missing)), where)
+            loaded[missing] = [set(), True]
+
+            def merge(response, missing=missing):
+                if not isinstance(response, list):
+                    loaded[missing][1] = False
+                    return
+                self._merge(response, missing, stored)
+                loaded[missing][0].update(x['id'] for x in response
+                                          if 'id' in x)
+
+            e.add_chunked('users.get', ids, merge, select=select, **params)
+        e.emit_requests()
+
+        # remember users dropped by `where`
+        if where_key is None:
+            return
+        entries = {}
+        for missing, ids in to_load.items():
+            ok, complete = loaded[missing]
+            if not complete:
+                continue
+            for user_id in ids:
+                if user_id not in ok:
+                    profile, stamps = stored.get(user_id,
+                                                 ({'id': user_id}, {}))
+                    stamps[where_key] = now
+                    entries[user_id] = stored[user_id] = (profile, stamps)
+        self._write(entries)
+
+    def save(self, profiles, fields):
+        """Save profiles (dicts with 'id') loaded by other methods
+        with keys `fields` (see `api_fields`)"""
+        self._merge(profiles, tuple(fields),
+                    self._read(x['id'] for x in profiles if 'id' in x))
+
+    def _merge(self, profiles, fields, stored):
+        """Merge loaded `fields` of `profiles` into `stored` ({id: (profile,
+        stamps)}) and save them"""
+
+        now = time.time()
+        entries = {}
+        for item in profiles:
+            if 'id' not in item:
+                continue
+            profile, stamps = stored.get(item['id'], ({}, {}))
+            profile['id'] = item['id']
+            for f in fields:
+                profile[f] = item.get(f)
+                stamps[f] = now
+            entries[item['id']] = stored[item['id']] = (profile, stamps)
+        self._write(entries)
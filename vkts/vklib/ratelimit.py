@@ -0,0 +1,146 @@
+#! /usr/bin/env python3
+
+"""Client-side limitation of requests frequency to vk API. Instead of
+firing requests and waiting after error 6 ("Too many requests per second")
+we pace them by token buckets: one bucket per access token and one per
+pair (access token, method family). Error 6 teaches the buckets the real
+limit: the rate is decreased multiplicatively and is slowly restored after
+every successful request."""
+
+import threading
+import time
+
+
+class TokenBucket:
+    """Token bucket with `rate` requests per second
+    and bursts up to `capacity` requests"""
+
+    def __init__(self, rate, capacity=None, min_rate=0.5):
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.rate = rate
+        self.capacity = capacity if capacity else rate
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+
+    def _refill(self, now):
+        if now <= self.stamp:
+            return
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def reserve(self, now=None, count=1):
+        """Take `count` tokens. Returns time (seconds) to wait before the
+        request. Tokens can be taken in debt, so concurrent callers
+        queue up."""
+
+        self._refill(time.monotonic() if now is None else now)
+        self.tokens -= count
+        if self.tokens >= 0:
+            return 0.
+        return -self.tokens / self.rate
+
+    def available(self, now=None):
+        """Number of tokens which can be taken without waiting"""
+
+        self._refill(time.monotonic() if now is None else now)
+        return max(0., self.tokens)
+
+    def delay(self, now=None):
+        """Time to wait for the next token (without taking it)"""
+
+        self._refill(time.monotonic() if now is None else now)
+        if self.tokens >= 1:
+            return 0.
+        return (1 - self.tokens) / self.rate
+
+    def slow_down(self, factor=0.7):
+        """React to error 6: decrease rate and drop accumulated burst"""
+        self.rate = max(self.min_rate, self.rate * factor)
+        self.tokens = min(self.tokens, 0)
+
+    def speed_up(self, step=0.02):
+        """React to successful request: restore rate step by step"""
+        self.rate = min(self.max_rate, self.rate + step)
+
+
+class RateLimiter:
+    """Set of token buckets shared by all requests of the process.
+
+    `rate` - documented limit of requests per second for one access token
+    `family_rates` - dict {method family: rate} for families with own limits
+                     (method family is the prefix of method name, for
+                     example 'users' for 'users.get')
+
+    Statistic of waiting: `RateLimiter.waited` (total seconds) and
+    `RateLimiter.waits` (number of delayed requests)."""
+
+    def __init__(self, rate=3., family_rates=None):
+        self.rate = rate
+        self.family_rates = dict(family_rates) if family_rates else {}
+        self.buckets = {}
+        self.waited = 0.
+        self.waits = 0
+        self.lock = threading.Lock()
+
+    def _get_buckets(self, token, method):
+        """Buckets of access token and of its method family"""
+
+        family = method.split('.')[0]
+        keys = ((token, None, self.rate),
+                (token, family, self.family_rates.get(family, self.rate)))
+        buckets = []
+        for token, family, rate in keys:
+            if (token, family) not in self.buckets:
+                self.buckets[(token, family)] = TokenBucket(rate)
+            buckets.append(self.buckets[(token, family)])
+        return buckets
+
+    def reserve(self, token, method):
+        """Book a place for the request. Returns time (seconds) which caller
+        must wait before the request (without sleeping)"""
+
+        with self.lock:
+            now = time.monotonic()
+            delay = max(b.reserve(now)
+                        for b in self._get_buckets(token, method))
+            if delay:
+                self.waited += delay
+                self.waits += 1
+        return delay
+
+    def delay(self, token, method):
+        """Time which the request would wait now (nothing is booked)"""
+
+        with self.lock:
+            now = time.monotonic()
+            return max(b.delay(now) for b in self._get_buckets(token, method))
+
+    def acquire(self, token, method):
+        """Wait until the request may be sent. Returns waiting time"""
+
+        delay = self.reserve(token, method)
+        if delay:
+            time.sleep(delay)
+        return delay
+
+    def penalize(self, token, method):
+        """Error 6 is received: slow down"""
+
+        with self.lock:
+            for b in self._get_buckets(token, method):
+                b.slow_down()
+
+    def reward(self, token, method):
+        """Request was successful: speed up a bit (up to documented rate)"""
+
+        with self.lock:
+            for b in self._get_buckets(token, method):
+                b.speed_up()
+
+    def get_rate(self, token, method=''):
+        """Current (learned) rate for access token and method family"""
+
+        with self.lock:
+            return min(b.rate for b in self._get_buckets(token, method))
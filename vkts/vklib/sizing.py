@@ -0,0 +1,83 @@
+#! /usr/bin/env python3
+
+"""Adaptive sizes of requests to vk API: how many ids are given to one
+call of method (chunk, for example `user_ids` of `users.get`) and how many
+API calls are joined into one `execute` request (pack). Sizes grow after
+successful requests up to API maxima, and are halved when `execute` fails
+on the server (runtime error, too big response). The failed size is
+remembered as the upper bound for the method."""
+
+import threading
+
+# Maximum number of ids in one call (POST requests, so no error 414)
+MAX_CHUNKS = {'users.get': 1000,
+              'groups.getById': 500}
+
+# Maximum number of API calls in one `execute`
+MAX_PACK = 25
+
+
+class SizeMemory:
+    """Learned sizes of chunks and packs for every method.
+
+    `chunk` - initial number of ids in one call
+    `growth` - factor of growth after successful request"""
+
+    def __init__(self, chunk=100, growth=1.25):
+        self.initial_chunk = chunk
+        self.growth = growth
+        self.chunks = {}       # method: current chunk size
+        self.chunk_caps = {}   # method: the biggest chunk without failures
+        self.packs = {}        # method: current pack size
+        self.pack_caps = {}    # method: the biggest pack without failures
+        self.lock = threading.Lock()
+
+    def chunk(self, method):
+        """Number of ids for the next call of `method`"""
+
+        with self.lock:
+            return self.chunks.get(method, min(self.initial_chunk,
+                                               self._max_chunk(method)))
+
+    def pack(self, method):
+        """Number of API calls for the next `execute` (`method` is the
+        method of the first request of pack)"""
+
+        with self.lock:
+            return self.packs.get(method, MAX_PACK)
+
+    def _max_chunk(self, method):
+        return self.chunk_caps.get(method, MAX_CHUNKS.get(method, 1000))
+
+    def chunk_succeeded(self, method, size):
+        """Call of `method` with `size` ids was successful: grow"""
+
+        with self.lock:
+            current = self.chunks.get(method, min(self.initial_chunk,
+                                                  self._max_chunk(method)))
+            if size >= current:
+                self.chunks[method] = min(self._max_chunk(method),
+                                          int(current * self.growth) + 1)
+
+    def chunk_failed(self, method, size):
+        """Call of `method` with `size` ids failed: remember and halve"""
+
+        with self.lock:
+            self.chunk_caps[method] = max(1, size - 1)
+            self.chunks[method] = max(1, size // 2)
+
+    def pack_succeeded(self, method, cost):
+        """`execute` with `cost` API calls was successful: grow"""
+
+        with self.lock:
+            current = self.packs.get(method, MAX_PACK)
+            if cost >= current:
+                self.packs[method] = min(self.pack_caps.get(method, MAX_PACK),
+                                         current + 1)
+
+    def pack_failed(self, method, cost):
+        """`execute` with `cost` API calls failed: remember and halve"""
+
+        with self.lock:
+            self.pack_caps[method] = max(1, cost - 1)
+            self.packs[method] = max(1, cost // 2)
@@ -0,0 +1,182 @@
+#! /usr/bin/env python3
+
+"""Pool of access tokens of several vk accounts. Requests are spread over
+the tokens, so throughput isn't capped by rate limit of a single account.
+The activated vk account is always in the pool, other accounts are added
+by command `vkts ac_pool <ac_name>`."""
+
+import getpass
+import logging
+import threading
+import time
+from . import vkauth
+from ..usrdata import UsrData
+
+logger = logging.getLogger()
+
+
+class PoolToken:
+    """Access token of one vk account"""
+
+    def __init__(self, ac_name, token=None):
+        self.ac_name = ac_name
+        self.token = token
+        self.in_rotation = True     # False after captcha or quota error
+        self.reason = None          # why the token is out of rotation
+        self.is_refreshing = False  # re-authentication is in progress
+        self.lock = threading.Lock()
+
+
+class TokenPool:
+    """Access tokens of vk accounts marked for pooling.
+
+    `limiter` - object of class `RateLimiter` (used to choose the token
+                with the nearest free place)
+    `session_factory` - function returning `requests.Session` for login
+    `timeout` - function returning timeouts of http requests for login"""
+
+    def __init__(self, limiter, session_factory=None, timeout=None):
+        self.limiter = limiter
+        self.session_factory = session_factory
+        self.timeout = timeout
+        self.tokens = []
+        self.is_loaded = False
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Read pooled accounts and their tokens from user data.
+        Log in accounts without stored token."""
+
+        with self.lock:
+            if self.is_loaded:
+                return
+
+            # activated account goes first
+            accs = UsrData().get('acc', 'vk') or {}
+            names = sorted((x for x in accs
+                            if accs[x]['is_activated'] or accs[x].get('pool')),
+                           key=lambda x: not accs[x]['is_activated'])
+            if not names:
+                raise RuntimeError('No vk accounts for requests (maybe need'
+                                   ' to execute command ac_add)')
+
+            for ac_name in names:
+                entry = PoolToken(ac_name, accs[ac_name]['token'])
+                if entry.token:
+                    logger.debug("Token of %s is read", ac_name)
+                else:
+                    self._login(entry)
+                self.tokens.append(entry)
+            self.is_loaded = True
+
+    def get(self, method=''):
+        """Choose token in rotation with the nearest free place
+        in rate limits. Returns object of class `PoolToken`"""
+
+        if not self.is_loaded:
+            self.load()
+
+        while True:
+            with self.lock:
+                in_rotation = [x for x in self.tokens if x.in_rotation]
+                ready = [x for x in in_rotation if not x.is_refreshing]
+                if ready:
+                    return min(ready, key=lambda x:
+                               self.limiter.delay(x.token, method))
+            if not in_rotation:
+                raise RuntimeError('All vk tokens are out of rotation ('
+                                   + ', '.join('{}: {}'.format(x.ac_name,
+                                                               x.reason)
+                                               for x in self.tokens) + ')')
+
+            # all tokens are being refreshed: wait for any of them
+            with in_rotation[0].lock:
+                pass
+
+    def _find(self, token):
+        for entry in self.tokens:
+            if entry.token == token:
+                return entry
+        return None
+
+    def has_usable(self):
+        """Is there at least one token in rotation?"""
+        return any(x.in_rotation for x in self.tokens)
+
+    def refresh(self, token):
+        """Get new token for the account of `token` (error 5). Requests with
+        other tokens of the pool are not blocked. If login fails, the token
+        is taken out of rotation."""
+
+        entry = self._find(token)
+        if entry is None:
+            # token has been refreshed by another thread already
+            return
+        with entry.lock:
+            if entry.token != token:
+                return
+            entry.is_refreshing = True
+            try:
+                self._login(entry)
+            except Exception as e:
+                self.disable(token, 'failed to get new token ({})'.format(e))
+            finally:
+                entry.is_refreshing = False
+
+    def disable(self, token, reason):
+        """Take token out of rotation (captcha, quota error)"""
+
+        entry = self._find(token)
+        if entry is None:
+            return
+        entry.in_rotation = False
+        entry.reason = reason
+        logger.debug("Token of %s is out of rotation: %s",
+                     entry.ac_name, reason)
+
+    def _login(self, entry):
+        """Get new token of account from vk.com"""
+
+        u = UsrData()
+        token = None
+        attempts = 5
+        attempt_pause = 10
+        while not token and attempts > 0:
+
+            # Wait for sparse requests
+            if attempts < 5:
+                logger.debug("Attempt pause %s", attempt_pause)
+                time.sleep(attempt_pause)
+                attempt_pause *= 2
+            attempts -= 1
+
+            # Request
+            logger.debug("Try to get token of %s", entry.ac_name)
+            ac_obj = u.get('acc', 'vk', entry.ac_name)
+            pswd = ac_obj['password']
+            while not pswd:
+                pswd = getpass.getpass('Input password of vk account'
+                                       + ' «{}»: '.format(entry.ac_name))
+            user_auth = vkauth.VKAuth(
+                permissions=['friends', 'groups', 'wall'],
+                app_id='6471192',
+                api_v='5.74',
+                email=ac_obj['uname'],
+                pswd=pswd,
+                session=(self.session_factory() if self.session_factory
+                         else None),
+                timeout=(self.timeout() if self.timeout else None))
+            user_auth.auth()
+            token = user_auth._access_token
+
+        # Here token must be
+        if token is None:
+            logger.debug("Failed to get token of %s", entry.ac_name)
+            raise RuntimeError('Failed to get token of vk account «{}»'
+                               .format(entry.ac_name))
+        entry.token = token
+
+        # Dump token (if account isn't private)
+        if ac_obj['password']:
+            u.set(token, 'acc', 'vk', entry.ac_name, 'token')
+        logger.debug("Token of %s is updated", entry.ac_name)
@@ -59,15 +59,20 @@ class FormParser(HTMLParser):
 class VKAuth(object):
 
     def __init__(self, permissions, app_id, api_v, email=None, pswd=None,
-                 two_factor_auth=False, security_code=None, auto_access=True):
+                 two_factor_auth=False, security_code=None, auto_access=True,
+                 session=None, timeout=None):
         """
         @args:
             permissions: list of Strings with permissions to get from API
             app_id: (String) vk app id that one can get from vk.com
             api_v: (String) vk API version
+            session: (requests.Session) session to use instead of a new one
+            timeout: timeout (or pair connect, read) of every http request
         """
 
-        self.session         = requests.Session()
+        self.session         = session if session else requests.Session()
+        self.own_session     = session is None
+        self.timeout         = timeout
         self.form_parser     = FormParser()
         self._user_id        = None
         self._access_token   = None
@@ -105,7 +110,7 @@ class VKAuth(object):
                                             ','.join(permissions),
                                             redirect_uri, display, api_version)
 
-        self.response = self.session.get(auth_url)
+        self.response = self.session.get(auth_url, timeout=self.timeout)
 
         # look for <form> element in response html and parse it
         if not self._parse_form():
@@ -169,7 +174,8 @@ class VKAuth(object):
             payload = parser.params
             payload.update(*params)
             try:
-                self.response = self.session.post(parser.url, data=payload)
+                self.response = self.session.post(parser.url, data=payload,
+                                                  timeout=self.timeout)
             except requests.exceptions.RequestException as err:
                 print("Error: ", err)
             except requests.exceptions.HTTPError as err:
@@ -270,7 +276,11 @@ class VKAuth(object):
             print(self.response.url + '\n')
 
     def _close(self):
-        self.session.close()
+        # foreign session may share connection pool with somebody else
+        if self.own_session:
+            self.session.close()
+        else:
+            self.session.cookies.clear()
         self.response = None
         self.form_parser = None
         self.security_code = None
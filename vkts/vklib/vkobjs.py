@@ -6,9 +6,116 @@ import sys
 import json
 import os
 import time
-from .vkreq import apply_vk_method, Executor
+import functools
+import gzip
+import hashlib
+import logging
+import mmap
+from bisect import bisect_right, insort
+from .vkreq import apply_vk_method, Executor, sizes
+from .asyncreq import AsyncExecutor
+from .profiles import hydrate_profiles, api_fields, get_store
+from .memberids import MemberIds
+from . import vkscript
 from ..utils import exception_handler
 
+logger = logging.getLogger()
+
+
+def _json_default(obj):
+    """Serialization of compact fields of objects for `json.dump`"""
+
+    if isinstance(obj, MemberIds):
+        return obj.tolist()
+    raise TypeError('{} is not JSON serializable'.format(type(obj).__name__))
+
+
+def _map_ids_file(path):
+    """Read-only memoryview of memory-mapped file"""
+
+    with open(path, 'rb') as fp:
+        if not os.fstat(fp.fileno()).st_size:
+            return memoryview(b'')
+        return memoryview(mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def _ids_file(path, header):
+    """Path of binary file with arrays of ids of object saved in `path`
+    (None if there are no arrays). `header` - dict read from `path`."""
+
+    if 'ids_layout' not in header:
+        return None
+    # files without name of binary file are made by old versions
+    name = header.get('ids_file', os.path.basename(path) + '.ids')
+    return os.path.join(os.path.dirname(path), name)
+
+
+def _write_obj(path, obj, ids_fields=()):
+    """Save dict of fields `obj`. Fields of ids (`ids_fields`) are saved
+    as sorted uint32 arrays in binary file <path>.ids.<checksum>, other
+    fields, name of binary file and layout of arrays - as JSON in file
+    `path`. The binary file is written first and the JSON file replaces
+    the old one after it, so readers see either the old pair of files or
+    the new one (old version can be mapped while it's rewritten)."""
+
+    old_ids_path = None
+    if os.path.isfile(path):
+        with open(path) as fp:
+            old_ids_path = _ids_file(path, json.load(fp))
+
+    header = {k: v for k, v in obj.items() if k not in ids_fields}
+    ids_path = None
+    if any(k in obj for k in ids_fields):
+        layout = {}
+        offset = 0
+        checksum = hashlib.sha1()
+        with open(path + '.ids.tmp', 'wb') as fp:
+            for k in ids_fields:
+                if k not in obj:
+                    continue
+                ids = obj[k]
+                if not isinstance(ids, MemberIds):
+                    ids = MemberIds(ids)
+                data = ids.tobytes()
+                fp.write(data)
+                checksum.update(data)
+                layout[k] = [offset, len(data)]
+                offset += len(data)
+        ids_path = path + '.ids.' + checksum.hexdigest()[:16]
+        os.replace(path + '.ids.tmp', ids_path)
+        header['ids_file'] = os.path.basename(ids_path)
+        header['ids_layout'] = layout
+        header['ids_byteorder'] = sys.byteorder
+
+    with open(path + '.tmp', 'w') as fp:
+        json.dump(header, fp, default=_json_default)
+    os.replace(path + '.tmp', path)
+
+    # binary file of the old version isn't needed anymore
+    if old_ids_path is not None and old_ids_path != ids_path:
+        try:
+            os.remove(old_ids_path)
+        except OSError:
+            pass
+
+
+def _read_obj(path):
+    """Read dict of fields saved by `_write_obj`. Arrays of ids are
+    `MemberIds` mapped from file (they aren't read until they are used)."""
+
+    with open(path) as fp:
+        obj = json.load(fp)
+    ids_path = _ids_file(path, obj)
+    obj.pop('ids_file', None)
+    layout = obj.pop('ids_layout', None)
+    byteorder = obj.pop('ids_byteorder', sys.byteorder)
+    if layout:
+        buf = _map_ids_file(ids_path)
+        for k, (offset, size) in layout.items():
+            obj[k] = MemberIds.from_buffer(buf[offset:offset + size],
+                                           byteorder)
+    return obj
+
 
 def _mkdir_rec(*dir_chain):
     """Recursive mkdir. For example, use `_mkdir_rec('a', 'b', 'c')` to create
@@ -24,6 +131,9 @@ def _mkdir_rec(*dir_chain):
 class VKObj():
     """Superclass for vk objects"""
 
+    # fields of ids which are kept as `MemberIds`
+    ids_fields = ()
+
     def __repr__(self):
         """Universal verbose view of class instance"""
 
@@ -45,7 +155,7 @@ class VKObj():
                 continue
 
             # field value
-            if isinstance(val, list) or isinstance(val, tuple):
+            if isinstance(val, (list, tuple, MemberIds)):
 
                 # items view
                 if len(str(val[0]) + str(val[0])) < 30:
@@ -84,7 +194,8 @@ class VKObj():
         return repr_
 
     def dump(self, rewrite=False):
-        """Save data about object to data/obj/../"""
+        """Save data about object to data/obj/../
+        (fields `ids_fields` are saved in binary file, see `_write_obj`)"""
 
         # add date to object
         date = time.strftime("%F-%H%M%S")
@@ -94,29 +205,39 @@ class VKObj():
         dir_path = _mkdir_rec('data', 'obj', self.__class__.__name__)
         file_path = os.path.join(dir_path, self._get_key())
         if rewrite or not os.path.isfile(file_path):
-            with open(file_path, 'w') as fp:
-                json.dump(self.__dict__, fp)
+            _write_obj(file_path, self.__dict__, self.ids_fields)
         else:
-            old_version = json.load(open(file_path))
+            old_version = _read_obj(file_path)
             old_version.update(self.__dict__)
-            with open(file_path, 'w') as fp:
-                json.dump(old_version, fp)
+            _write_obj(file_path, old_version, self.ids_fields)
 
     def dump_to_frozen(self):
-        """Save data about object to data/frozen_obj/../"""
+        """Save snapshot of object to data/frozen_obj/../
+        Snapshot is compressed and stored by hash of its content, so
+        identical states are kept once (see `_FrozenIndex`)."""
 
         # add date to object
         date = time.strftime("%F-%H%M%S")
         self.dump_date = date
 
-        # dump data
-        dir_path = _mkdir_rec('data', 'frozen_obj', self.__class__.__name__)
-        date = '_' + date
-        with open(os.path.join(dir_path, self._get_key() + date), 'w') as fp:
-            json.dump(self.__dict__, fp)
+        # dump data (date isn't a part of the state)
+        fields = {k: v for k, v in self.__dict__.items() if k != 'dump_date'}
+        data = json.dumps(fields, sort_keys=True,
+                          default=_json_default).encode()
+        index = _FrozenIndex(self.__class__.__name__, self._get_key())
+        index.add(date, index.save_blob(data))
+
+    def _set_fields(self, obj):
+        """Set fields of object from dict read from file"""
+
+        for field, val in obj.items():
+            if field in self.ids_fields and not isinstance(val, MemberIds):
+                val = MemberIds(val)
+            setattr(self, field, val)
 
     def open(self):
-        """Restore data of object from data/obj/../"""
+        """Restore data of object from data/obj/../
+        (fields `ids_fields` are mapped from binary file without reading)"""
 
         # get path to object
         path = os.path.join('data', 'obj', self.__class__.__name__,
@@ -125,43 +246,111 @@ class VKObj():
             return
 
         # read object
-        with open(path) as fp:
-            obj = json.load(fp)
-        for field in obj:
-            setattr(self, field, obj[field])
+        self._set_fields(_read_obj(path))
 
     def open_last_frozen(self):
         """Restore recent data of object from data/frozen_obj/../"""
+        self.open_frozen()
+
+    def open_frozen(self, date=None):
+        """Restore data of object from the last snapshot in
+        data/frozen_obj/../ made not later than `date` (string like
+        '2019-05-01-120000', None - the last snapshot)"""
+
+        index = _FrozenIndex(self.__class__.__name__, self._get_key())
+        snapshot = index.find(date)
+        if snapshot is not None:
+            obj = index.read_blob(snapshot[1])
+            obj['dump_date'] = snapshot[0]
+            self._set_fields(obj)
+            return
 
-        # get path to recent object
-        dir_path = os.path.join('data', 'frozen_obj', self.__class__.__name__)
+        # snapshots of old versions (uncompressed files <key>_<date>)
+        dir_path = index.dir_path
         if not os.path.isdir(dir_path):
             return
-        files = next(os.walk(dir_path))[2]
-        files = [x for x in files if x.startswith(self._get_key() + '_')]
+        prefix = self._get_key() + '_'
+        files = [x for x in os.listdir(dir_path) if x.startswith(prefix)
+                 and (date is None or x[len(prefix):] <= date)]
         if not files:
             return
-        obj_path = os.path.join(dir_path, sorted(files)[-1])
+        with open(os.path.join(dir_path, max(files))) as fp:
+            self._set_fields(json.load(fp))
+
+
+class _FrozenIndex():
+    """Snapshots of object `key` of class in data/frozen_obj/<class>/:
+    compressed JSON files blobs/<sha1 of content>.json.gz (common for all
+    objects of class) and append-only index index/<key> with lines
+    "<date> <sha1>". A line is added only if the state is changed since the
+    previous snapshot."""
+
+    def __init__(self, class_name, key):
+        self.class_name = class_name
+        self.dir_path = os.path.join('data', 'frozen_obj', class_name)
+        self.path = os.path.join(self.dir_path, 'index', key)
+        self.snapshots = []  # ordered pairs [date, sha1]
+        if os.path.isfile(self.path):
+            # the last line can be broken by interrupted writing
+            with open(self.path) as fp:
+                self.snapshots = sorted(x.split() for x in fp
+                                        if x.endswith('\n'))
+
+    def _blob_path(self, digest):
+        return os.path.join(self.dir_path, 'blobs', digest + '.json.gz')
+
+    def save_blob(self, data):
+        """Save bytes of snapshot (if there is no such one).
+        Returns its hash."""
+
+        digest = hashlib.sha1(data).hexdigest()
+        path = self._blob_path(digest)
+        if not os.path.isfile(path):
+            _mkdir_rec('data', 'frozen_obj', self.class_name, 'blobs')
+            with open(path + '.tmp', 'wb') as fp:
+                fp.write(gzip.compress(data))
+            os.replace(path + '.tmp', path)
+        return digest
 
-        # read object
-        with open(obj_path) as fp:
-            obj = json.load(fp)
-        for field in obj:
-            setattr(self, field, obj[field])
+    def read_blob(self, digest):
+        with gzip.open(self._blob_path(digest)) as fp:
+            return json.loads(fp.read().decode())
+
+    def add(self, date, digest):
+        """Add snapshot to index"""
+
+        i = bisect_right(self.snapshots, [date, chr(0x10ffff)])
+        if i and self.snapshots[i - 1][1] == digest:
+            return
+        insort(self.snapshots, [date, digest])
+        _mkdir_rec('data', 'frozen_obj', self.class_name, 'index')
+        with open(self.path, 'a') as fp:
+            fp.write(date + ' ' + digest + '\n')
+
+    def find(self, date=None):
+        """Pair [date, hash] of the last snapshot not later than `date`
+        (binary search). None if there is no such one."""
+
+        if not self.snapshots:
+            return None
+        if date is None:
+            return self.snapshots[-1]
+        i = bisect_right(self.snapshots, [date, chr(0x10ffff)])
+        return self.snapshots[i - 1] if i else None
 
 
 # Check user for existance university of univer_ids in list of his universities
 def _is_student(user_item, univer_ids):
     """Does the user profile indicate that he studied at a university?"""
 
-    # field universities
-    if 'universities' in user_item:
+    # field universities (it's null in profiles projected by server)
+    if user_item.get('universities'):
         for i in user_item['universities']:
             if i['id'] in univer_ids:
                 return True
 
     # field occupation
-    if 'occupation' in user_item:
+    if user_item.get('occupation'):
         occ = user_item['occupation']
         if occ['type'] == 'university':
             if occ['id'] in univer_ids:
@@ -170,13 +359,40 @@ def _is_student(user_item, univer_ids):
     return False
 
 
+def _student_condition(univer_ids):
+    """Condition of `_is_student` for server-side filtering
+    (see `vkscript.Select`)"""
+
+    ids = [int(x) for x in univer_ids]
+    return (vkscript.any_field_in('universities', 'id', ids)
+            | (vkscript.field_eq('occupation.type', 'university')
+               & vkscript.field_in('occupation.id', ids)))
+
+
+def _member_ids(items, fields=(), profiles_processor=None):
+    """Ids of members from items of `groups.getMembers`. In fused mode (see
+    `Group.load()`) items are profiles: they are saved in store of profiles
+    and processed."""
+
+    if items and isinstance(items[0], dict):
+        get_store().save(items, fields)
+        if profiles_processor:
+            profiles_processor(items)
+        items = [x['id'] for x in items]
+    return items
+
+
 class Group(VKObj):
     """A class containing information about the community and a list of
     its members.
 
     The easiest and fastest way to upload information - use `Group.load()`.
     For fast loading of many small communities use outclass function
-    `load_groups`."""
+    `load_groups`.
+
+    Members are kept in compact sorted arrays (see `MemberIds`)."""
+
+    ids_fields = ('members', 'cumul_members')
 
     def __init__(self, group_id):
 
@@ -187,53 +403,207 @@ class Group(VKObj):
         # Init
         self.group_id = str(group_id)
         self.count = 0
-        self.members = []
-        self.cumul_members = []  # cumulative list of former & current members
+        self.members = MemberIds()
+        self.cumul_members = MemberIds()  # former & current members
         self.univers_data = {}
 
     def _get_key(self):
         """Key for dump"""
         return self.group_id
 
-    def load(self, extra_getById=()):
+    def load(self, extra_getById=(), workers=1, fields=(),
+             profiles_processor=None):
         """Load from vk.com initial community information
-        and full list of community member's ids"""
-
-        # load phase 0
-        e = Executor()
-        self.load_ph0_fill_requests(e, extra_getById)
-        for i in range(1000, 24000, 1000):
-            e.add_request('groups.getMembers',
-                          self.load_ph1_parse,
-                          group_id=self.group_id, offset=i, count=1000)
+        and full list of community member's ids.
+        `workers` - number of `execute` requests in flight (see `Executor`)
+
+        Fused mode: if keys of profiles `fields` are given (for example
+        ('universities', 'occupation')), then members are loaded with these
+        fields of their profiles by the same requests. Profiles are saved
+        in store of profiles (so `Group.load_students()` and
+        `hydrate_profiles` don't load them again) and are passed to
+        `profiles_processor` page by page."""
+
+        parse = functools.partial(self.load_ph1_parse, fields=fields,
+                                  profiles_processor=profiles_processor)
+        params = {'fields': api_fields(fields)} if fields else {}
+
+        # load phase 0 (with up to 23000 next members, which are loaded
+        # by server-side loop only if the community is big enough)
+        e = Executor(workers, keep_responses=False)
+        members = self.load_ph0_fill_requests(e, extra_getById, fields,
+                                              profiles_processor)
+        e.add_paginated('groups.getMembers', parse,
+                        offset=1000, end=members['count'], max_pages=23,
+                        group_id=self.group_id, **params)
         e.emit_requests()
 
         # load phase 1
         if self.count > 24000:
-            for i in range(24000, self.count, 1000):
-                e.add_request('groups.getMembers',
-                              self.load_ph1_parse,
-                              group_id=self.group_id, offset=i, count=1000)
+            e.add_paginated('groups.getMembers', parse,
+                            offset=24000, end=self.count,
+                            group_id=self.group_id, **params)
             e.emit_requests()
 
         # update cumulative data
         self.update_cumulative()
 
+    def sync(self, workers=1, fields=(), profiles_processor=None):
+        """Incremental version of `Group.load()` for community whose members
+        are already known (for example, read by `Group.open()`). Members are
+        requested in order of joining, newest first (`sort=time_desc`),
+        until a known member is met, so only newly joined members are
+        loaded. If new count of the community doesn't match known members
+        plus joined ones (somebody has left) or sorting isn't permitted,
+        full `Group.load()` is made.
+        `workers`, `fields`, `profiles_processor` - see `Group.load()`
+        Returns list of ids of joined members (None after full load)."""
+
+        if not self.members:
+            self.load(workers=workers, fields=fields,
+                      profiles_processor=profiles_processor)
+            return None
+
+        known = MemberIds(self.members)
+        params = {'fields': api_fields(fields)} if fields else {}
+        page_size = vkscript.PAGE_SIZES['groups.getMembers']
+        joined = []
+        count = None
+        offset, pages = 0, 1
+        e = Executor(workers, keep_responses=False)
+        while True:
+            # loops are growing: few members join between two syncs
+            loaded = []
+            e.add_paginated('groups.getMembers', loaded.append,
+                            offset=offset, max_pages=pages,
+                            group_id=self.group_id, sort='time_desc',
+                            **params)
+            e.emit_requests()
+            # pages can be short (hidden accounts are counted too)
+            if not loaded[0] or not loaded[0]['items']:
+                break
+            count = loaded[0]['count']
+            items = _member_ids(loaded[0]['items'], fields,
+                                profiles_processor)
+            is_met = False
+            for i, x in enumerate(items):
+                if x in known:
+                    items, is_met = items[:i], True
+                    break
+            joined += items
+            offset += pages * page_size
+            if is_met or offset >= count:
+                break
+            pages = min(2 * pages, 25)
+
+        # reconcile departures by full load
+        if count is None or count != len(known) + len(joined):
+            logger.debug("Full reload of group %s (count %s, known %s, "
+                         "joined %s)", self.group_id, count, len(known),
+                         len(joined))
+            self.load(workers=workers, fields=fields,
+                      profiles_processor=profiles_processor)
+            return None
+
+        self.members = known.union(joined)
+        self.count = count
+        self.update_cumulative()
+        return joined
+
+    def load_resumable(self, workers=4, fields=(), profiles_processor=None,
+                       margin=100):
+        """Version of `Group.load()` for very big communities. Members are
+        loaded by ranges of 24000 (one `execute` request per range, up to
+        `workers` ranges in parallel) and every loaded range is written to
+        checkpoint file data/spill/Group/<id>. If loading is broken, the next
+        call loads only missing ranges.
+
+        Members who join or leave during loading shift next pages (list is
+        sorted by id). Every range starts `margin` members (plus change of
+        count since the start) before its offset, duplicates are removed.
+        If a range still begins after the end of previous one, members
+        between them could be skipped: the range is extended back until
+        they overlap.
+        `workers`, `fields`, `profiles_processor` - see `Group.load()`
+        Returns True if all members are loaded (False - try again later)."""
+
+        r = apply_vk_method('groups.getMembers', group_id=self.group_id,
+                            count=1)
+        if 'response' not in r:
+            return False
+        count = r['response']['count']
+
+        spill = _MembersSpill(self.group_id)
+        if spill.count is None:
+            spill.start(count)
+        end = max(count, spill.count)
+        shift = min(margin + abs(count - spill.count), 1000)
+        step = 24000  # 24 pages + up to 1000 members of shift
+        params = {'fields': api_fields(fields)} if fields else {}
+
+        def save(offset, start, response):
+            if response:
+                spill.save(offset, start, _member_ids(
+                    response['items'], fields, profiles_processor))
+
+        def gaps():
+            # extend ranges which don't overlap with previous ones
+            res = []
+            offsets = sorted(spill.ranges)
+            for prev, cur in zip(offsets, offsets[1:]):
+                start, ids = spill.ranges[cur]
+                prev_ids = spill.ranges[prev][1]
+                if start > 0 and ids and prev_ids and ids[0] > prev_ids[-1]:
+                    back = min(max(margin, 2 * (cur - start)), step)
+                    res.append((cur, max(0, start - back), start))
+            return res
+
+        # ranges: (offset, first offset to load, end)
+        todo = [(x, max(0, x - shift), min(x + step, end))
+                for x in range(0, end, step) if x not in spill.ranges]
+        todo = todo or gaps()
+        while todo:
+            e = Executor(workers, keep_responses=False)
+            for offset, start, stop in todo:
+                e.add_paginated('groups.getMembers',
+                                functools.partial(save, offset, start),
+                                offset=start, end=stop,
+                                group_id=self.group_id, **params)
+            e.emit_requests()
+            if any(x not in spill.ranges for x in range(0, end, step)):
+                return False
+            # some range isn't extended (failed request): try again later
+            if any(spill.ranges[x][0] > start for x, start, _ in todo):
+                return False
+            todo = gaps()
+
+        # save data
+        self.members = MemberIds()
+        for _, ids in spill.ranges.values():
+            self.members += ids
+        self.count = count
+        spill.remove()
+        self.update_cumulative()
+        return True
+
     def update_cumulative(self):
         """If we read the data locally (`Group.open()`), and then received
         the current data from the server (`Group.load()` or `load_groups`),
         we combine the new data with the old ones and save in special fields
         of \"cumulative\" data."""
-        self.cumul_members = list(set(self.cumul_members + self.members))
+        self.cumul_members = MemberIds(self.cumul_members).union(self.members)
 
-    def load_ph0_fill_requests(self, executor, extra_getById=()):
+    def load_ph0_fill_requests(self, executor, extra_getById=(), fields=(),
+                               profiles_processor=None):
         """Add to executor 1 request groups.getById and 1 request
         groups.getMembers for getting initial vk community information and
         ids of first 1000 members.
 
         `executor` - object of class `Executor`
         `extra_getById` - additional fields you can specify
-                          for vk API method getById"""
+                          for vk API method getById
+        `fields`, `profiles_processor` - fused mode (see `Group.load()`)
+        Returns handle of request groups.getMembers."""
 
         # temporarily save, Group.load_ph0_parse will remove it
         self.extra_getById = extra_getById
@@ -242,11 +612,18 @@ class Group(VKObj):
         executor.add_request('groups.getById',
                              self.load_ph0_parse,
                              group_id=self.group_id, fields=fields_s)
-        executor.add_request('groups.getMembers',
-                             self.load_ph0_parse,
-                             group_id=self.group_id, offset=0, count=1000)
-
-    def load_ph0_parse(self, response):
+        params = {'fields': api_fields(fields)} if fields else {}
+        return executor.add_request(
+            'groups.getMembers',
+            functools.partial(self.load_ph0_parse, fields=fields,
+                              profiles_processor=profiles_processor),
+            group_id=self.group_id, offset=0, count=1000, **params)
+
+    def _add_members(self, items, fields=(), profiles_processor=None):
+        """Save ids of members (see `_member_ids`)"""
+        self.members += _member_ids(items, fields, profiles_processor)
+
+    def load_ph0_parse(self, response, fields=(), profiles_processor=None):
         """Processor for response of `Group.load_ph0_fill_requests()`"""
 
         # check and prepare response to read
@@ -268,20 +645,24 @@ class Group(VKObj):
             if field in response:
                 setattr(self, field, response[field])
         if 'items' in response:
-            self.members = response['items']
+            self.members = MemberIds()
+            self._add_members(response['items'], fields, profiles_processor)
 
-    def load_ph1_fill_requests(self, executor):
+    def load_ph1_fill_requests(self, executor, fields=(),
+                               profiles_processor=None):
         """Add to executor requests groups.getMembers for getting
         full list of community member's ids"""
 
         if not hasattr(self, 'count'):
             return
-        for i in range(1000, self.count, 1000):
-            executor.add_request('groups.getMembers',
-                                 self.load_ph1_parse,
-                                 group_id=self.group_id, offset=i, count=1000)
-
-    def load_ph1_parse(self, response):
+        params = {'fields': api_fields(fields)} if fields else {}
+        executor.add_paginated(
+            'groups.getMembers',
+            functools.partial(self.load_ph1_parse, fields=fields,
+                              profiles_processor=profiles_processor),
+            offset=1000, end=self.count, group_id=self.group_id, **params)
+
+    def load_ph1_parse(self, response, fields=(), profiles_processor=None):
         """Processor for response of `Group.load_ph1_fill_requests()`"""
 
         if not response:
@@ -289,7 +670,7 @@ class Group(VKObj):
 
         # save data
         if 'items' in response:
-            self.members += response['items']
+            self._add_members(response['items'], fields, profiles_processor)
 
     def load_students(self, university):
         """If you have already executed `Group.load()` you can to get
@@ -303,10 +684,10 @@ class Group(VKObj):
                 if f != 'students':
                     setattr(univer, f, self.univers_data[university.name][f])
 
-        # load
-        e = Executor()
-        univer.load_students_fill_requests(e, self)
-        e.emit_requests()
+        # load profiles (only students are loaded from the server)
+        univer.load_students_parse(hydrate_profiles(
+            self.members[:self.count], ('universities', 'occupation'),
+            where=_student_condition(univer.univer_ids)))
 
         # update cumulative data
         univer.cumul_students = list(set(univer.cumul_students
@@ -348,6 +729,57 @@ class Group(VKObj):
         return self.count == 0
 
 
+class _MembersSpill():
+    """Checkpoint file of `Group.load_resumable()`. The first line is header
+    {"count": count of members, "stamp": time of start}, every next line is
+    loaded part of a range {"offset": offset of range, "start": first loaded
+    offset, "items": ids}. Checkpoint older than `max_age` is dropped."""
+
+    def __init__(self, group_id, max_age=24 * 3600):
+        self.path = os.path.join(_mkdir_rec('data', 'spill', 'Group'),
+                                 group_id)
+        self.count = None
+        self.ranges = {}  # offset: [first loaded offset, MemberIds]
+        if not os.path.isfile(self.path):
+            return
+
+        # the last line can be broken by interrupted writing
+        with open(self.path) as fp:
+            lines = [json.loads(x) for x in fp if x.endswith('\n')]
+        if not lines or time.time() - lines[0]['stamp'] > max_age:
+            return
+        self.count = lines[0]['count']
+        for x in lines[1:]:
+            self._merge(x['offset'], x['start'], x['items'])
+
+    def _merge(self, offset, start, items):
+        if offset in self.ranges:
+            self.ranges[offset][0] = min(self.ranges[offset][0], start)
+            self.ranges[offset][1] += items
+        else:
+            self.ranges[offset] = [start, MemberIds(items)]
+
+    def start(self, count):
+        """Start new checkpoint"""
+
+        self.count = count
+        self.ranges = {}
+        with open(self.path, 'w') as fp:
+            fp.write(json.dumps({'count': count, 'stamp': time.time()}) + '\n')
+
+    def save(self, offset, start, items):
+        """Append loaded part of range"""
+
+        self._merge(offset, start, items)
+        with open(self.path, 'a') as fp:
+            fp.write(json.dumps({'offset': offset, 'start': start,
+                                 'items': items}) + '\n')
+
+    def remove(self):
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+
 class _UniversityInGroup():
     """Auxiliary class for `Group.load_students()` and `Group.__repr__()`"""
 
@@ -357,48 +789,110 @@ class _UniversityInGroup():
         self.cumul_students = []
         self.univer_fraction = 0.
 
-    def load_students_fill_requests(self, executor, group):
-        """Add to executor request for `Group.load_students()`"""
+    def load_students_parse(self, profiles):
+        """Process profiles (any iterable) for `Group.load_students()`"""
 
-        # Limiting the server to the length of the request does not allow
-        # making a step of 1000 (the maximum allowed by api) requests.
-        # But it does not matter: the critical limitation of method users.get
-        # is it's runtime on the server.
-        step = 100
+        # save data
+        self.students += [x['id'] for x in profiles
+                          if _is_student(x, self.univer_ids)]
 
-        for i in range(0, group.count, step):
-            user_ids_s = ','.join(map(str, group.members[i:i+step]))
-            executor.add_request('users.get',
-                                 self.load_students_parse,
-                                 user_ids=user_ids_s,
-                                 fields='universities,occupation')
 
-    def load_students_parse(self, response):
-        """Process to executor request for `Group.load_students()`"""
+def _bin_pack(items, capacity):
+    """Split pairs (cost, value) into lists with sum of costs up to
+    `capacity` (first fit decreasing). Returns list of lists of values."""
 
+    bins = []  # pairs [free place, values]
+    for cost, value in sorted(items, key=lambda x: -x[0]):
+        for b in bins:
+            if b[0] >= cost:
+                b[0] -= cost
+                b[1].append(value)
+                break
+        else:
+            bins.append([capacity - cost, [value]])
+    return [b[1] for b in bins]
+
+
+def _plan_load_groups(executor, groups, extra_getById=(), fields=(),
+                      profiles_processor=None):
+    """Add to executor requests of `load_groups`. Info of groups (with
+    members_count) is loaded by chunked `groups.getById`. As soon as counts
+    of a chunk are known, pages of `groups.getMembers` up to these counts
+    are added: loops of up to 25 pages of different groups are packed into
+    full `execute` requests. Requests of the last loop of a group are
+    continued if the group has grown."""
+
+    params = {'fields': api_fields(fields)} if fields else {}
+    page_size = vkscript.PAGE_SIZES['groups.getMembers']
+    step = page_size * 25
+    by_id = {}
+    for g in groups:
+        by_id.setdefault(g.group_id, []).append(g)
+
+    def add_pages(g, offset, end):
+        # the last loop of the group checks its actual count
+        parse = functools.partial(load_page, g, end)
+        executor.add_paginated('groups.getMembers', parse, offset=offset,
+                               end=end, group_id=g.group_id, **params)
+
+    def load_page(g, end, response):
+        g.load_ph1_parse(response, fields, profiles_processor)
+        if response and end == g.count:
+            g.count = response['count']
+            for i in range(end, g.count, step):
+                add_pages(g, i, min(i + step, g.count))
+
+    def plan_pages(response):
         if not response:
             return
-
-        # save data
-        usr_objs = [x for x in response if _is_student(x, self.univer_ids)]
-        self.students += [x['id'] for x in usr_objs]
-
-
-def load_groups(groups, extra_getById=()):
+        loops = []
+        for info in response:
+            for g in by_id.get(str(info['id']), ()):
+                g.members = MemberIds()
+                g.extra_getById = extra_getById
+                g.load_ph0_parse(info)
+                # without members_count the community is closed or
+                # banned: its members can't be loaded
+                g.count = info.get('members_count', 0)
+                for i in range(0, g.count, step):
+                    end = min(i + step, g.count)
+                    loops.append((-(-(end - i) // page_size), (g, i, end)))
+        for pack in _bin_pack(loops, sizes.pack('groups.getMembers')):
+            for g, offset, end in pack:
+                add_pages(g, offset, end)
+
+    fields_s = ','.join(('members_count', 'description') + extra_getById)
+    executor.add_chunked('groups.getById', list(by_id), plan_pages,
+                         ids_param='group_ids', fields=fields_s)
+
+
+def load_groups(groups, extra_getById=(), workers=1, fields=(),
+                profiles_processor=None):
     """Fast load groups data thanks to vk api method `execute`.
-    `groups` - list of objects of `Group` class"""
+    `groups` - list of objects of `Group` class
+    `workers` - number of `execute` requests in flight (see `Executor`)
+    `fields`, `profiles_processor` - fused mode (see `Group.load()`)
 
-    e = Executor()
+    Requests are planned by known sizes of communities (see
+    `_plan_load_groups`), so small communities cost one API call."""
 
-    # load phase 1
-    for g in groups:
-        g.load_ph0_fill_requests(e, extra_getById)
+    e = Executor(workers, keep_responses=False)
+    _plan_load_groups(e, groups, extra_getById, fields, profiles_processor)
     e.emit_requests()
 
-    # load phase 2
+    # update cumulative data
     for g in groups:
-        g.load_ph1_fill_requests(e)
-    e.emit_requests()
+        g.update_cumulative()
+
+
+async def load_groups_async(groups, extra_getById=(), workers=4, fields=(),
+                            profiles_processor=None):
+    """Awaitable version of `load_groups` (see `AsyncExecutor`).
+    `groups` - list of objects of `Group` class"""
+
+    e = AsyncExecutor(workers)
+    _plan_load_groups(e, groups, extra_getById, fields, profiles_processor)
+    await e.emit_requests()
 
     # update cumulative data
     for g in groups:
@@ -434,6 +928,10 @@ class University(VKObj):
 class User(VKObj):
     """TODO: rewrite like Group"""
 
+    # fields of profile for `User.load_info()` (see `hydrate_profiles`)
+    info_fields = ('first_name', 'last_name', 'universities', 'occupation',
+                   'photo_max', 'screen_name', 'nickname', 'bdate', 'sex')
+
     def __init__(self, user_id, univer_ids=[]):
 
         # Assert
@@ -464,28 +962,26 @@ class User(VKObj):
 
     def load_info(self):
 
-        # Getting main info about user
-        response = apply_vk_method('users.get',
-                                   user_id=str(self.user_id),
-                                   fields='universities,occupation,photo_max,'
-                                          + 'screen_name,nickname,bdate,sex')
-        if response:
-            self.is_student = _is_student(response['response'],
-                                          self.univer_ids)
-            if response['response']['photo_max']:
-                self.photo_max = response['response']['photo_max']
+        # Getting main info about user (from store of profiles if it's
+        # already loaded)
+        profiles = list(hydrate_profiles([self.user_id], self.info_fields))
+        if profiles:
+            profile = profiles[0]
+            self.is_student = _is_student(profile, self.univer_ids)
+            if profile['photo_max']:
+                self.photo_max = profile['photo_max']
             else:
                 self.photo_max = 'https://vk.com/images/camera_200.png?ava=1'
-            self.first_name = response['response']['first_name']
-            self.last_name = response['response']['last_name']
-            if response['response']['nickname']:
-                self.nickname = response['response']['nickname']
-            self.scrname = response['response']['scrname']
-            if response['response']['bdate']:
-                bdate = response['response']['bdate']
+            self.first_name = profile['first_name'] or ''
+            self.last_name = profile['last_name'] or ''
+            if profile['nickname']:
+                self.nickname = profile['nickname']
+            self.scrname = profile['screen_name'] or ''
+            if profile['bdate']:
+                bdate = profile['bdate']
                 if len(bdate.split('.')) == 3:
                     self.byear = int(bdate.split('.')[2])
-            self.sex = int(response['response']['sex'])
+            self.sex = int(profile['sex'] or 0)
         else:
             return
 
@@ -499,14 +995,16 @@ class User(VKObj):
         else:
             return
 
-        # Getting the remaining friends
-        for i in range(1, int((self.count-1)/5000) + 1):
-            response = apply_vk_method('friends.get',
-                                       user_id=str(self.user_id),
-                                       offset=i*5000, count=5000,
-                                       fields='universities,occupation')
-            if bool(response):
-                users += response['response']['items']
+        # Getting the remaining friends (by server-side loop)
+        def add_friends(response):
+            if response:
+                users.extend(response['items'])
+        e = Executor(keep_responses=False)
+        e.add_paginated('friends.get', add_friends,
+                        offset=5000, end=self.count,
+                        user_id=str(self.user_id),
+                        fields='universities,occupation')
+        e.emit_requests()
 
         self.friends = [x['id'] for x in users]
         self.univer_friends = \
@@ -5,12 +5,20 @@
 many requests to packs by 25 requests."""
 
 import requests
+from requests.adapters import HTTPAdapter
 import json
+import copy
 import time
 import os
-import getpass
-from . import vkauth
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from .ratelimit import RateLimiter
+from .sizing import SizeMemory
+from .cache import ResponseCache
 from ..usrdata import UsrData
+from .tokenpool import TokenPool
+from . import vkscript
 import logging
 from logging.handlers import RotatingFileHandler
 
@@ -23,74 +31,110 @@ logger = logging.getLogger()
 logger.setLevel(logging.DEBUG)
 logger.addHandler(handler)
 
-_token = None
 mock_responses = '.mock_request_responses.json'
 
+# Settings of pooled HTTP session (see `configure_session`)
+session_options = {'pool_size': 10,        # keep-alive connections per host
+                   'connect_timeout': 10,  # seconds
+                   'read_timeout': 60}     # seconds
+_adapter = None
+_session = None
+_session_lock = threading.Lock()
+_mock_lock = threading.Lock()
 
-def update_token():
-    """Read token from local user data or get new one from vk.com"""
-
-    global _token
-    u = UsrData()
-
-    # For first call
-    if not _token:
-        # Try read token from the previous run
-        ac_name, ac_obj = u.get_active_obj('acc', 'vk')
-        _token = ac_obj['token']
-        if _token:
-            logger.debug("Token is read")
-            return
-
-    # Get token by request
-    _token = None
-    attempts = 5
-    attempt_pause = 10
-    while not _token and attempts > 0:
-
-        # Wait for sparse requests
-        if attempts < 5:
-            logger.debug("Attempt pause %s", attempt_pause)
-            time.sleep(attempt_pause)
-            attempt_pause *= 2
-        attempts -= 1
-
-        # Request
-        logger.debug("Try to get token")
-        ac_name, ac_obj = u.get_active_obj('acc', 'vk')
-        email = ac_obj['uname']
-        pswd = ac_obj['password']
-        while not pswd:
-            pswd = getpass.getpass('Input password of vk account'
-                                   + ' «{}»: '.format(ac_name))
-        user_auth = vkauth.VKAuth(permissions=['friends',
-                                               'groups',
-                                               'wall'],
-                                  app_id='6471192',
-                                  api_v='5.74',
-                                  email=email,
-                                  pswd=pswd)
-        user_auth.auth()
-        _token = user_auth._access_token
-
-    # Here token must be
-    if _token is None:
-        logger.debug("Failed to get token")
-        raise
+# Cache of responses of read-only methods (see `enable_cache`)
+cache = None
 
-    # Dump token (if account isn't private)
-    if ac_obj['password']:
-        u.set(_token, 'acc', 'vk', ac_name, 'token')
-    logger.debug("Token is updated")
+# Requests in flight (see `apply_vk_method`): {key of request: future}
+_calls = {}
+_calls_lock = threading.Lock()
 
+# Pacing of requests (3 requests per second for every access token).
+# Statistic of delays: `limiter.waited`, `limiter.waits`
+limiter = RateLimiter(rate=3.)
 
-def _set_token_to_params(params):
+# Learned sizes of chunks of ids and of `execute` packs
+sizes = SizeMemory()
+
+# Errors of calls inside `execute` which are worth retrying: unknown
+# error, too many requests, flood control, internal server error
+RETRY_ERRORS = (1, 6, 9, 10)
+
+# Read-only methods (or families of methods like 'database.'): identical
+# requests of them which are queued or in flight simultaneously are made
+# once (see `apply_vk_method`, `Executor`). Other methods can change data,
+# so every their request is made.
+COALESCED_METHODS = {'groups.getById', 'groups.getMembers', 'friends.get',
+                     'users.get', 'users.getFollowers', 'users.search',
+                     'utils.resolveScreenName', 'wall.get', 'database.'}
+
+
+def configure_session(pool_size=None, connect_timeout=None,
+                      read_timeout=None):
+    """Change settings of the pooled HTTP session. The session will be
+    recreated at the next request."""
+
+    global _adapter, _session
+
+    with _session_lock:
+        if pool_size is not None:
+            session_options['pool_size'] = pool_size
+        if connect_timeout is not None:
+            session_options['connect_timeout'] = connect_timeout
+        if read_timeout is not None:
+            session_options['read_timeout'] = read_timeout
+
+        # drop old connections
+        if _session is not None:
+            _session.close()
+        _adapter = None
+        _session = None
+
+
+def get_timeout():
+    """Timeouts (connect, read) for requests to vk.com"""
+    return (session_options['connect_timeout'],
+            session_options['read_timeout'])
 
-    # Add token & version (if user doesn't give specific this)
-    if 'access_token' not in params:
-        params['access_token'] = _token
-    if 'v' not in params:
-        params['v'] = '5.9'
+
+def _get_adapter():
+    """Shared pool of keep-alive connections"""
+
+    global _adapter
+    if _adapter is None:
+        _adapter = HTTPAdapter(pool_connections=session_options['pool_size'],
+                               pool_maxsize=session_options['pool_size'])
+    return _adapter
+
+
+def new_session():
+    """Make `requests.Session` with own cookies, which uses shared pool of
+    keep-alive connections (so TCP+TLS handshakes are not repeated)"""
+
+    with _session_lock:
+        session = requests.Session()
+        session.mount('https://', _get_adapter())
+        session.mount('http://', _get_adapter())
+        session.headers.update({'Accept-Encoding': 'gzip, deflate',
+                                'Connection': 'keep-alive'})
+    return session
+
+
+def get_session():
+    """Common session for requests to https://api.vk.com/method/"""
+
+    global _session
+    if _session is None:
+        session = new_session()
+        with _session_lock:
+            if _session is None:
+                _session = session
+    return _session
+
+
+# Access tokens of vk accounts (see `TokenPool`)
+token_pool = TokenPool(limiter, session_factory=new_session,
+                       timeout=get_timeout)
 
 
 def _make_params_string(params):
@@ -115,6 +159,52 @@ def _vk_api_error_print(obj, url_of_req, params):
                                                _make_params_string(params)))
 
 
+def _api_error_action(error, handle_api_errors=True, is_pooled=True):
+    """What to do with vk API error `error` (the same for `apply_vk_method`
+    and `apply_vk_method_async`). Returns pair: action, is error to be
+    printed. Action is one of:
+    'refresh'  - get new token and retry
+    'throttle' - slow down and retry
+    'rotate'   - take token out of rotation and retry with another one
+    'return'   - return response with error
+    'empty'    - return empty response
+    'pause'    - wait and retry"""
+
+    code = error['error_code']
+    if code == 5:
+        # Authorization failed: refresh token of this account only
+        return 'refresh', False
+    elif code == 6:
+        # Too many requests per second: limiter learns real limit
+        return 'throttle', False
+    elif not handle_api_errors:
+        return 'return', False
+    elif code == 18:
+        # Page is deleted or banned
+        return 'empty', False
+    elif code == 203 or code == 7:
+        # No have access
+        return 'empty', False
+    elif code == 12:
+        # execute compilation error
+        return 'empty', True
+    elif code == 13:
+        # execute runtime error: `Executor` splits the pack
+        return 'return', False
+    elif code in (14, 29) and is_pooled:
+        # Captcha needed or quota is exhausted: retry with other token
+        return 'rotate', False
+    elif code == 14:
+        # Captcha needed
+        return 'return', True  # to study the response format in the future
+    elif code in (3, 8, 100, 113):
+        # Wrong rquest
+        return 'empty', True
+    else:
+        # In case of server problems.
+        return 'pause', True
+
+
 def _vk_api_request(url_of_req, method, params):
     """Request (can be mocked by existence of file
     '.mock_request_responses.json' for testing)."""
@@ -123,38 +213,171 @@ def _vk_api_request(url_of_req, method, params):
 
         # "Home-made" mock
         logger.debug("Try Mocked Request (method: %s)", method)
-        with open(mock_responses) as fp:
-            mocks_list = json.load(fp)
-            json_obj = mocks_list.pop(0)
-        with open(mock_responses, 'w') as fp:
-            json.dump(mocks_list, fp)
+        with _mock_lock:
+            with open(mock_responses) as fp:
+                mocks_list = json.load(fp)
+                json_obj = mocks_list.pop(0)
+            with open(mock_responses, 'w') as fp:
+                json.dump(mocks_list, fp)
         return json_obj
 
     else:
 
         # Real request
         logger.debug("Try Request (method: %s)", method)
-        response = requests.post(url_of_req, data=params)
+        response = get_session().post(url_of_req, data=params,
+                                      timeout=get_timeout())
         return response.json()
 
 
+def enable_cache(path=os.path.join(UsrData.data_path, 'cache.sqlite'),
+                 max_items=10000, ttls=None):
+    """Switch on cache of responses of read-only methods (`groups.getById`,
+    `utils.resolveScreenName`, `users.get`, `database.*`) for
+    `apply_vk_method` and `Executor`.
+    `path` - sqlite file for responses (None - keep them in memory only)
+    `ttls` - dict {method: TTL in seconds} (see `cache.TTLS`)
+    Returns object of class `ResponseCache` (it has counters of hits)."""
+
+    global cache
+    disable_cache()
+    cache = ResponseCache(path, max_items, ttls)
+    return cache
+
+
+def disable_cache():
+    """Switch off cache of responses"""
+
+    global cache
+    if cache is not None:
+        cache.close()
+    cache = None
+
+
+def _from_cache(method, params):
+    """Cached response of request (None if it's absent). Stale response is
+    returned too, but the request is repeated in background."""
+
+    c = cache
+    if c is None or params.get('access_token') or not c.is_cacheable(method):
+        return None
+    found = c.get(method, params)
+    if found is None:
+        return None
+    response, is_fresh = found
+    if not is_fresh and c.start_revalidation(method, params):
+        threading.Thread(target=_revalidate, args=(c, method, dict(params)),
+                         daemon=True).start()
+    return copy.deepcopy(response)
+
+
+def _to_cache(method, params, response):
+    """Save successful response of request in cache (if it's switched on)"""
+
+    c = cache
+    if (c is not None and not params.get('access_token')
+            and c.is_cacheable(method) and response is not None
+            and response is not False
+            and not isinstance(response, ExecuteFailure)):
+        c.put(method, params, response)
+
+
+def _revalidate(c, method, params):
+    """Update stale response in cache `c`"""
+
+    logger.debug("Revalidate cached response (method: %s)", method)
+    try:
+        json_obj = _shared_apply(method, True, **params)
+        if 'response' in json_obj:
+            c.put(method, params, json_obj['response'])
+    finally:
+        c.end_revalidation(method, params)
+
+
 def apply_vk_method(method, handle_api_errors=True, **params):
-    """Make request to https://api.vk.com/method/. Return JSON-object"""
+    """Make request to https://api.vk.com/method/. Return JSON-object.
+    If the same request of read-only method (see `COALESCED_METHODS`) is in
+    flight in another thread, its result is shared. Responses of read-only
+    methods can be cached (see `enable_cache`)."""
+
+    response = _from_cache(method, params)
+    if response is not None:
+        logger.debug("Cached response (method: %s)", method)
+        return {'response': response}
+
+    json_obj = _shared_apply(method, handle_api_errors, **params)
+    if 'response' in json_obj:
+        _to_cache(method, params, json_obj['response'])
+    return json_obj
+
 
-    global _token
+def _is_coalesced(method):
+    """Can identical requests of `method` be made once?"""
+    return (method in COALESCED_METHODS
+            or method.split('.')[0] + '.' in COALESCED_METHODS)
 
-    # Get token if absent
-    if not _token and not os.path.isfile('.mock_request_responses.json'):
-        update_token()
 
-    # Set token to URL string
+def _shared_apply(method, handle_api_errors=True, **params):
+    """Request which shares result with identical request in flight
+    (see `apply_vk_method`)"""
+
+    if not _is_coalesced(method):
+        return _apply_vk_method(method, handle_api_errors, **params)
+
+    key = (method, handle_api_errors,
+           json.dumps({k: v for k, v in params.items() if k != 'access_token'},
+                      sort_keys=True, default=str),
+           params.get('access_token'))
+    with _calls_lock:
+        future = _calls.get(key)
+        is_owner = future is None
+        if is_owner:
+            future = _calls[key] = Future()
+    if not is_owner:
+        logger.debug("Share result of request in flight (method: %s)", method)
+        return copy.deepcopy(future.result())
+
+    try:
+        json_obj = _apply_vk_method(method, handle_api_errors, **params)
+        future.set_result(json_obj)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _calls_lock:
+            del _calls[key]
+    return json_obj
+
+
+def _apply_vk_method(method, handle_api_errors=True, **params):
+    """Request with error processing (see `apply_vk_method`)"""
+
+    # Token given by user or tokens of pool (none for mocked requests)
+    user_token = params.get('access_token')
+    is_mocked = os.path.isfile(mock_responses)
+
+    # Set version (if user doesn't give specific this)
     url_of_req = 'https://api.vk.com/method/' + method + '?'
-    _set_token_to_params(params)
+    if 'v' not in params:
+        params['v'] = '5.9'
 
     # Do request with error processing
     error_pause = 5
     while True:
 
+        # Choose token
+        if user_token or is_mocked:
+            token = user_token
+        else:
+            token = token_pool.get(method).token
+        params['access_token'] = token
+
+        # Wait for free place in rate limits
+        delay = limiter.acquire(token, method)
+        if delay:
+            logger.debug("Rate limiter delay %.3f s (total %.1f s)",
+                         delay, limiter.waited)
+
         try:
             # Request
             json_obj = _vk_api_request(url_of_req, method, params)
@@ -175,42 +398,33 @@ def apply_vk_method(method, handle_api_errors=True, **params):
         if 'error' in json_obj:
             logger.debug("API Error (%s: %s)", json_obj['error']['error_code'],
                          json_obj['error']['error_msg'])
-            if json_obj['error']['error_code'] == 5:
-                if 'access_token' in params:
-                    del params['access_token']
-                update_token()
-                _set_token_to_params(params)
+            action, is_verbose = _api_error_action(
+                json_obj['error'], handle_api_errors,
+                is_pooled=not user_token and not is_mocked)
+            if action == 'rotate':
+                token_pool.disable(token, json_obj['error']['error_msg'])
+                if token_pool.has_usable():
+                    continue
+                action, is_verbose = 'return', True
+            if is_verbose:
+                _vk_api_error_print(json_obj['error'], url_of_req, params)
+
+            if action == 'refresh':
+                # bad user token is replaced by tokens of pool
+                if user_token:
+                    user_token = None
+                elif not is_mocked:
+                    token_pool.refresh(token)
                 continue
-            elif json_obj['error']['error_code'] == 6:
-                # It took a long time to create a "clever" mechanism to bypass
-                # these errors. However, such a stupid solution was the most
-                # effective.
-                time.sleep(0.5)
+            elif action == 'throttle':
+                limiter.penalize(token, method)
                 continue
-            elif not handle_api_errors:
+            elif action == 'return':
                 return json_obj
-            elif json_obj['error']['error_code'] == 18:
-                # Page is deleted or banned
-                return {}
-            elif (json_obj['error']['error_code'] == 203
-                  or json_obj['error']['error_code'] == 7):
-                # No have access
-                return {}
-            elif json_obj['error']['error_code'] == 12:
-                # execute compilation error
-                _vk_api_error_print(json_obj['error'], url_of_req, params)
-                return {}
-            elif json_obj['error']['error_code'] == 14:
-                # Captcha needed
-                _vk_api_error_print(json_obj['error'], url_of_req, params)
-                return json_obj  # to study the response format in the future
-            elif json_obj['error']['error_code'] in (3, 8, 100, 113):
-                # Wrong rquest
-                _vk_api_error_print(json_obj['error'], url_of_req, params)
+            elif action == 'empty':
                 return {}
             else:
                 # In case of server problems.
-                _vk_api_error_print(json_obj['error'], url_of_req, params)
                 if error_pause > 35:
                     raise
                 print('Wait ' + str(error_pause) + ' seconds')
@@ -220,11 +434,225 @@ def apply_vk_method(method, handle_api_errors=True, **params):
 
         # No errors -> out loop
         logger.debug("Successful Request")
+        limiter.reward(token, method)
         break
 
     return json_obj
 
 
+def _run_steps(steps):
+    """Run generator `steps` which yields code of `execute` requests and
+    gets their responses (so the same logic of retries is used by
+    blocking and asynchronous executors). Returns result of generator."""
+
+    try:
+        code = next(steps)
+        while True:
+            code = steps.send(apply_vk_method('execute', code=code))
+    except StopIteration as e:
+        return e.value
+
+
+class RequestHandle:
+    """Handle of request added to `Executor` (returned by
+    `Executor.add_request()`). After emitting, the response is available by
+    `RequestHandle.result()`.
+
+    Handle (or its part like `handle['object_id']`, `handle[0]['id']`) can be
+    passed as a parameter of later requests. Then the dependent requests are
+    compiled into the same `execute` code, where the parameter is taken from
+    the response of previous request on the server side. If the response is
+    already received (it was in the previous pack), its value is substituted.
+
+    >>> e = Executor()
+    >>> r = e.add_request('utils.resolveScreenName', screen_name='phys_kek')
+    >>> g = e.add_request('groups.getById', group_id=r['object_id'])
+    >>> m = e.add_request('groups.getMembers', group_id=g[0]['id'], count=3)
+    >>> e.emit_requests()  # single http request
+    >>> m.result()
+    {'count': 19373, 'items': [510, 3016, 6477]}"""
+
+    def __init__(self, root=None, path=()):
+        self._root = root if root is not None else self
+        self._path = path
+        if root is None:
+            self._var = None          # name of variable in `execute` code
+            self._is_done = False
+            self._response = None
+
+    def __getitem__(self, key):
+        return RequestHandle(self._root, self._path + (key,))
+
+    def collect(self, field):
+        """Handle of list of `field` values of items of the response list
+        (VKScript operator `@.`)"""
+        return RequestHandle(self._root, self._path + (('@', field),))
+
+    def _expr(self):
+        """Expression of VKScript for this part of response"""
+
+        expr = self._root._var
+        for key in self._path:
+            if isinstance(key, tuple):
+                expr += '@.' + key[1]
+            elif isinstance(key, int):
+                expr += '[{}]'.format(key)
+            else:
+                expr += '.' + key
+        return expr
+
+    def _set(self, response):
+        self._root._response = response
+        self._root._is_done = True
+
+    def done(self):
+        """Is response received?"""
+        return self._root._is_done
+
+    def result(self):
+        """Response (or its part). None if it's absent."""
+
+        if not self._root._is_done:
+            raise RuntimeError('Request is not emitted yet')
+        value = self._root._response
+        try:
+            for key in self._path:
+                if isinstance(key, tuple):
+                    value = [x[key[1]] for x in value]
+                else:
+                    value = value[key]
+        except (KeyError, IndexError, TypeError):
+            return None
+        return value
+
+
+class ExecuteFailure:
+    """Response of request which failed inside `execute` (even after
+    retries). It's false in boolean context like `false` returned by
+    `execute`, so checks `if not response:` work as before.
+    `errors` - vk API errors of the request (from `execute_errors`)"""
+
+    def __init__(self, method, params, errors=()):
+        self.method = method
+        self.params = params
+        self.errors = list(errors)
+
+    def __bool__(self):
+        return False
+
+    def __repr__(self):
+        return 'ExecuteFailure({}, {})'.format(
+            self.method, ', '.join('{}: {}'.format(x.get('error_code'),
+                                                   x.get('error_msg'))
+                                   for x in self.errors))
+
+
+class _Request:
+    """Request queued in `Executor`. `script` - template of VKScript code
+    (see `vkscript`) which is used instead of single call of `method`.
+    `chunk_param` - parameter with comma separated ids (request can be
+    split by them, see `_Request.split()`).
+    Request with `primary` isn't emitted: it's a copy of identical request
+    `primary`, and gets the same response. Request with `cached` response
+    isn't emitted too (see `enable_cache`)."""
+
+    def __init__(self, method, params, processor, handle, script=None,
+                 chunk_param=None):
+        self.method = method
+        self.params = params
+        self.processor = processor
+        self.handle = handle
+        self.script = script
+        self.chunk_param = chunk_param
+        self.attempts = 0  # number of retries after errors in `execute`
+        self.primary = None
+        self.cached = None
+        self.cost = script.cost if script else 1  # number of API calls
+        values = list(params.values()) + (script.values() if script else [])
+        self.deps = set(v._root for v in values
+                        if isinstance(v, RequestHandle))
+
+    def code(self, pack_roots=()):
+        """Code of request for `execute`. Parameters given by handles are
+        expressions (if their requests are in the same pack) or values."""
+
+        def render(v):
+            if not isinstance(v, RequestHandle):
+                return json.dumps(v, ensure_ascii=False)
+            elif v._root in pack_roots:
+                return v._expr()
+            value = v.result()
+            if isinstance(value, ExecuteFailure):
+                value = False
+            return json.dumps(value, ensure_ascii=False)
+
+        if not self.deps:
+            params_s = str(self.params).replace("'", '"')
+        else:
+            params_s = '{' + ', '.join('"{}": {}'.format(k, render(v))
+                                       for k, v in self.params.items()) + '}'
+        if self.script:
+            return self.script.code(self.handle._var, self.method, params_s,
+                                    render)
+        return 'var {} = API.{}({});'.format(self.handle._var, self.method,
+                                            params_s)
+
+    def is_local(self):
+        """Is response got without emitting the request?"""
+        return self.primary is not None or self.cached is not None
+
+    def key(self):
+        """Key of identical requests (None if request can't be coalesced)"""
+
+        if self.deps or not _is_coalesced(self.method):
+            return None
+        return (self.method, id(self.script) if self.script else None,
+                json.dumps(self.params, sort_keys=True, default=str))
+
+    def chunk_size(self):
+        """Number of ids in chunk parameter"""
+
+        if not self.chunk_param:
+            return 0
+        return len(str(self.params[self.chunk_param]).split(','))
+
+    def is_paginated(self):
+        return isinstance(self.script, vkscript.Paginate)
+
+    def can_split(self):
+        """Can request be split into two smaller ones?"""
+        return self.chunk_size() > 1 or (self.is_paginated() and self.cost > 1)
+
+    def split(self):
+        """Two requests for halves of chunk parameter (or for halves of
+        pages of paginated request)"""
+
+        if self.is_paginated():
+            halves = [(self.params, x) for x in self.script.split()]
+        else:
+            ids = str(self.params[self.chunk_param]).split(',')
+            half = len(ids) // 2
+            halves = []
+            for part in (ids[:half], ids[half:]):
+                params = dict(self.params)
+                params[self.chunk_param] = ','.join(part)
+                halves.append((params, self.script))
+        parts = []
+        for suffix, (params, script) in zip('ab', halves):
+            handle = RequestHandle()
+            handle._var = self.handle._var + suffix
+            parts.append(_Request(self.method, params, None, handle,
+                                  script, self.chunk_param))
+        return parts
+
+    def join(self, first, second):
+        """Response of request from responses of its halves"""
+
+        if self.is_paginated():
+            return self.script.join(first, second)
+        return first + second
+
+
 class Executor:
     """Class for exploit vk API method `execute` to join
     several requests (up to 25) into single one.
@@ -248,26 +676,442 @@ class Executor:
     >>> e.emit_requests()
     111557607
     False
-    17708"""
+    17708
+
+    `Executor.add_request()` returns handle of request, it can be used as
+    parameter of later requests (see `RequestHandle`)."""
+
+    def __init__(self, workers=1, autoflush=False, keep_responses=True,
+                 max_pack_bytes=None, max_delay=None, max_retries=2):
+        """`workers` - number of `execute` requests which can be in flight
+        simultaneously (responses are processed in order of submission
+        anyway, so processing of one pack overlaps with network time
+        of the next ones)
+        `max_retries` - how many times request failed inside `execute`
+        (with one of `RETRY_ERRORS`) is emitted again. If it still fails,
+        processor gets object of class `ExecuteFailure`.
+
+        Identical requests of read-only methods (the same method and
+        parameters, see `COALESCED_METHODS`) which are queued or in flight
+        simultaneously are emitted once; every processor gets
+        its own copy of the response.
+
+        Streaming mode (memory doesn't depend on number of requests):
+        `autoflush` - emit pack as soon as it's ready (25 requests are added,
+                      size of pack code reaches `max_pack_bytes` or the
+                      oldest queued request waits more than `max_delay`
+                      seconds); the rest is emitted by `emit_requests`
+        `keep_responses` - save responses in `Executor.responses`
+                           (switch it off if processors consume responses)
+        """
 
-    def __init__(self):
         logger.debug("Executor created")
+        self.workers = workers
+        self.autoflush = autoflush
+        self.keep_responses = keep_responses
+        self.max_pack_bytes = max_pack_bytes
+        self.max_delay = max_delay
+        self.max_retries = max_retries
         self.responses = []
         self.errors = []
-        self.requests = []
-        self.processors = []
+        self.requests = deque()
+        self._queued_bytes = 0
+        self._queued_cost = 0
+        self._queued_since = None
+        self._in_flight = deque()
+        self._pool = None
+        self._counter = 0
+        self._primaries = {}  # {key: queued or in flight request}
 
-    def add_request(self, method, processor=None, **params):
+    def add_request(self, method, processor=None, select=None, **params):
         """Add one request to `Executor.requests`.
-        `processor` - function for processing response of this request"""
+        `processor` - function for processing response of this request
+        `select` - object of class `vkscript.Select` for filtering and
+                   projection of response on the server side
+        Returns handle of request (see `RequestHandle`)."""
 
         logger.debug("Add %sth request %s", len(self.requests) + 1,
                      "with processor" if processor else "without processor")
 
-        # add string request to requests list
-        params_s = str(params).replace("'", '"')
-        self.requests.append('API.{}({});'.format(method, params_s))
-        self.processors.append(processor)
+        return self._add(_Request(method, params, processor,
+                                  self._new_handle(), select))
+
+    def add_paginated(self, method, processor=None, offset=0, end=None,
+                      max_pages=25, collect=None, **params):
+        """Add requests which load pages of `method` (`groups.getMembers`,
+        `friends.get`, `wall.get`) from `offset` to `end` by loops on the
+        server side (see `vkscript.Paginate`). Every request loads up to
+        `max_pages` pages and gives to `processor` compact response
+        {"count": count, "items": items of its pages}.
+        `end` - if None, then single request up to the end of list
+                (or up to `max_pages` pages) is added. It can be
+                `RequestHandle` too, for example `handle['count']`.
+        `collect` - return only this field of every item
+        Returns list of handles of added requests."""
+
+        page_size = vkscript.PAGE_SIZES[method]
+        max_pages = min(max_pages, 25)
+        if not isinstance(end, int):
+            script = vkscript.Paginate(method, offset, end, page_size,
+                                       max_pages, collect)
+            return [self._add(_Request(method, params, processor,
+                                       self._new_handle(), script))]
+
+        handles = []
+        step = page_size * max_pages
+        for i in range(offset, end, step):
+            script = vkscript.Paginate(method, i, min(i + step, end),
+                                       page_size, max_pages, collect)
+            handles.append(self._add(_Request(method, params, processor,
+                                              self._new_handle(), script)))
+        return handles
+
+    def add_chunked(self, method, ids, processor=None, ids_param='user_ids',
+                    select=None, **params):
+        """Add requests of `method` for all `ids` (for example 'users.get'
+        with `user_ids`). Ids are split into chunks of size learned by
+        previous requests (see `sizing`); `processor` is called for
+        response of every chunk. A chunk which fails on the server is split
+        and emitted again. Returns list of handles of added requests."""
+
+        ids = list(ids)
+        handles = []
+        i = 0
+        while i < len(ids):
+            # size is asked for every chunk: in streaming mode it grows
+            # as packs are emitted
+            step = sizes.chunk(method)
+            chunk_params = dict(params)
+            chunk_params[ids_param] = ','.join(map(str, ids[i:i+step]))
+            handles.append(self._add(_Request(
+                method, chunk_params, processor, self._new_handle(), select,
+                ids_param)))
+            i += step
+        return handles
+
+    def _new_handle(self):
+        handle = RequestHandle()
+        handle._var = 'r{}'.format(self._counter)
+        self._counter += 1
+        return handle
+
+    def _add(self, item):
+        """Add request to requests list. Returns its handle."""
+
+        # response is in cache
+        if not item.deps and not item.script:
+            item.cached = _from_cache(item.method, item.params)
+            if item.cached is not None:
+                logger.debug("Request is served by cache")
+                item.cost = 0
+                item.handle._set(item.cached)
+                self._push(item)
+                return item.handle
+
+        # identical request is queued or in flight: share its response
+        key = item.key()
+        primary = self._primaries.get(key) if key else None
+        if primary is not None:
+            logger.debug("Request is coalesced with identical one")
+            item.primary = primary
+            item.cost = 0
+            item.deps = {primary.handle}
+        elif key:
+            self._primaries[key] = item
+
+        self._push(item)
+
+        # streaming mode: emit ready pack
+        if self.autoflush and self._is_pack_ready():
+            for req, response in self._flush_pack():
+                self._dispatch(req, response)
+
+        return item.handle
+
+    def _push(self, item):
+        """Put request into queue"""
+
+        if not self.requests:
+            self._queued_since = time.monotonic()
+        item.size = 0 if item.is_local() else len(item.code(item.deps))
+        self.requests.append(item)
+        self._queued_bytes += item.size
+        self._queued_cost += item.cost
+
+    def _pack_limit(self):
+        """Number of API calls for the next pack (see `sizing`)"""
+        return sizes.pack(self.requests[0].method) if self.requests else 25
+
+    def _is_pack_ready(self):
+        """Is it time to emit pack in streaming mode?"""
+
+        if self._queued_cost >= self._pack_limit():
+            return True
+        if self.max_pack_bytes and self._queued_bytes >= self.max_pack_bytes:
+            return True
+        if (self.max_delay and self.requests
+                and time.monotonic() - self._queued_since >= self.max_delay):
+            return True
+        return False
+
+    def _pop_pack(self):
+        """Take requests with up to 25 API calls (or less, see `sizing`)
+        from queue and make code for `execute`. Returns pair: code,
+        requests of pack"""
+
+        limit = self._pack_limit()
+        items = []
+        pack_roots = set()
+        size = 0
+        cost = 0
+        while self.requests:
+
+            # respect limits (but single request is always taken)
+            item = self.requests[0]
+            if items and cost + item.cost > limit:
+                break
+            if (items and self.max_pack_bytes
+                    and size + item.size > self.max_pack_bytes):
+                break
+
+            # dependence on response of pack in flight: finish pack
+            if items and any(not x._is_done and x not in pack_roots
+                             for x in item.deps):
+                break
+
+            self.requests.popleft()
+            items.append(item)
+            pack_roots.add(item.handle)
+            size += item.size
+            cost += item.cost
+
+        self._queued_bytes -= size
+        self._queued_cost -= cost
+        self._queued_since = time.monotonic()
+        return self._pack_code(items), items
+
+    def _pack_code(self, items):
+        """Code of `execute` which returns array of responses of `items`"""
+
+        code = 'var arr = [];\n'
+        pack_roots = set()
+        for item in items:
+            if item.cached is not None:
+                continue
+            if item.primary and item.primary.handle in pack_roots:
+                # copy is available for later requests of pack
+                code += 'var {} = {};\n'.format(item.handle._var,
+                                                item.primary.handle._var)
+                pack_roots.add(item.handle)
+                continue
+            if item.primary:
+                item.handle._set(item.primary.handle.result())
+                continue
+            pack_roots.add(item.handle)
+            code += '{}\n'.format(item.code(pack_roots)) + \
+                    'arr = arr + [{}];\n'.format(item.handle._var)
+        return code + 'return arr;'
+
+    def _is_head_blocked(self):
+        """Does the first queued request wait for response of pack
+        in flight?"""
+
+        return bool(self.requests) and any(not x._is_done
+                                           for x in self.requests[0].deps)
+
+    def _submit(self, code, items):
+        """Send `execute` request (in the pool of threads if `workers` > 1)"""
+
+        future = Future()
+        if all(x.is_local() for x in items):
+            # only copies of requests of previous packs
+            future.set_result({'response': []})
+        elif self.workers > 1:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers)
+            future = self._pool.submit(apply_vk_method, 'execute', code=code)
+        else:
+            future.set_result(apply_vk_method('execute', **{'code': code}))
+        self._in_flight.append((future, items))
+
+    def _unpack(self, r, items):
+        """Save errors of `execute` response `r` and retry failed requests.
+        Returns list of pairs (request, response)"""
+        return _run_steps(self._unpack_steps(r, items))
+
+    def _unpack_steps(self, r, items):
+        """Steps of `_unpack`: generator which yields code of `execute`
+        for every retry, gets its response and returns list of pairs
+        (request, response) (see `_run_steps`)"""
+
+        # new identical requests will be emitted again
+        for item in items:
+            key = item.key()
+            if key and self._primaries.get(key) is item:
+                del self._primaries[key]
+
+        if 'response' not in r:
+            return list(zip(items, (yield from self._retry_split(r, items))))
+        self._learn_sizes(items)
+        errors = r.get('execute_errors', [])
+        self.errors += errors
+
+        # `execute_errors` go in order of calls, so they are matched
+        # with failed requests in the same order
+        errors = iter(errors)
+        emitted = [x for x in items if not x.is_local()]
+        responses = list(r['response'])
+        retry = []
+        for i, item in enumerate(emitted):
+            if responses[i] is False:
+                error = next(errors, None)
+                responses[i] = ExecuteFailure(item.method, item.params,
+                                              [error] if error else [])
+                if (error and error.get('error_code') in RETRY_ERRORS
+                        and item.attempts < self.max_retries):
+                    item.attempts += 1
+                    retry.append(i)
+            # later requests can use this response
+            item.handle._set(responses[i])
+
+        if retry:
+            logger.debug("Retry %s failed requests of execute", len(retry))
+            retried = yield from self._retry([emitted[i] for i in retry])
+            for i, response in zip(retry, retried):
+                responses[i] = response
+
+        for item, response in zip(emitted, responses):
+            if not item.script:
+                _to_cache(item.method, item.params, response)
+
+        responses = iter(responses)
+        return [(x, x.cached if x.cached is not None
+                 else copy.deepcopy(x.primary.handle.result()) if x.primary
+                 else next(responses)) for x in items]
+
+    def _retry(self, items):
+        """Emit failed requests again by new packs. Returns list of their
+        responses (generator of steps, see `_run_steps`)"""
+
+        responses = []
+        pack = []
+        cost = 0
+        for item in items:
+            if pack and cost + item.cost > sizes.pack(pack[0].method):
+                responses += yield from self._execute_now(pack)
+                pack = []
+                cost = 0
+            pack.append(item)
+            cost += item.cost
+        return responses + (yield from self._execute_now(pack))
+
+    def _learn_sizes(self, items):
+        """Pack `items` was successful: sizes can grow"""
+
+        sizes.pack_succeeded(items[0].method, sum(x.cost for x in items))
+        for item in items:
+            if item.chunk_param:
+                sizes.chunk_succeeded(item.method, item.chunk_size())
+
+    def _retry_split(self, r, items):
+        """`execute` of `items` failed (response `r`). If it's runtime
+        error on the server, then halves of pack (or of chunk or pages of
+        single request) are emitted again. Returns list of responses of `items`
+        (False for failed requests). Generator of steps (see `_run_steps`)"""
+
+        error = r.get('error', {})
+        failed = [error] if error else []
+        if error.get('error_code') != 13:
+            self.errors += failed
+            return [ExecuteFailure(x.method, x.params, failed) for x in items]
+
+        logger.debug("execute runtime error, split %s requests", len(items))
+        if len(items) > 1:
+            sizes.pack_failed(items[0].method, sum(x.cost for x in items))
+            half = len(items) // 2
+            first = yield from self._execute_now(items[:half])
+            return first + (yield from self._execute_now(items[half:]))
+
+        item = items[0]
+        if item.can_split():
+            if item.chunk_param:
+                sizes.chunk_failed(item.method, item.chunk_size())
+            else:
+                sizes.pack_failed(item.method, item.cost)
+            a, b = item.split()
+            parts = ((yield from self._execute_now([a]))
+                     + (yield from self._execute_now([b])))
+            if not any(isinstance(x, ExecuteFailure) for x in parts):
+                return [item.join(*parts)]
+            return [ExecuteFailure(item.method, item.params,
+                                   sum((x.errors for x in parts
+                                        if isinstance(x, ExecuteFailure)),
+                                       []))]
+
+        self.errors.append(error)
+        return [ExecuteFailure(item.method, item.params, failed)]
+
+    def _execute_now(self, items):
+        """Emit pack of `items` right now. Returns list of responses of
+        `items` (generator of steps, see `_run_steps`)"""
+
+        if all(x.is_local() for x in items):
+            r = {'response': []}
+        else:
+            r = yield self._pack_code(items)
+        responses = yield from self._unpack_steps(r, items)
+        for item, response in responses:
+            # later requests can use responses of the first half
+            item.handle._set(response)
+        return [response for item, response in responses]
+
+    def _ready_responses(self, wait_all=False):
+        """Generate pairs (request, response) of sent packs in order of
+        submission. Unless `wait_all`, stop at unfinished pack if there are
+        no more than `workers` packs in flight."""
+
+        while self._in_flight:
+            future, items = self._in_flight[0]
+            if (not wait_all and not future.done()
+                    and len(self._in_flight) <= self.workers):
+                return
+            self._in_flight.popleft()
+            yield from self._unpack(future.result(), items)
+
+    def _flush_pack(self):
+        """Send one pack. Generate pairs (request, response)
+        of finished packs."""
+
+        if self._is_head_blocked():
+            yield from self._ready_responses(wait_all=True)
+        self._submit(*self._pop_pack())
+        yield from self._ready_responses()
+
+    def _dispatch(self, item, response):
+        """Save response (if need) and process it"""
+
+        item.handle._set(response)
+        if self.keep_responses:
+            self.responses.append(response)
+        if item.processor:
+            item.processor(response)
+
+    def _emit_iter(self):
+        """Emit all queued requests. Generate pairs (request, response)
+        in order of adding requests."""
+
+        try:
+            while self.requests or self._in_flight:
+                if self.requests:
+                    yield from self._flush_pack()
+                    continue
+                # processors of responses can add new requests
+                future, items = self._in_flight.popleft()
+                yield from self._unpack(future.result(), items)
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
 
     def emit_requests(self):
         """Pack requests from `Executor.requests`
@@ -275,63 +1119,28 @@ class Executor:
         to server. Responses will be saved in `Executor.responses`."""
 
         logger.debug("Emit requests (%s pieces)", len(self.requests))
-        self.responses = []
-        self.errors = []
 
-        requests = self.requests
-        cnt = 0
-        while requests:
-
-            # start code for execute
-            if cnt == 0:
-                code = 'var arr = [];\n' + \
-                       'var r;\n'
-
-            # collect requests
-            req = requests.pop(0)
-            code += 'r = {}\n'.format(req) + \
-                    'arr = arr + [r];\n'
-
-            # step - recorded regular request
-            cnt += 1
-
-            # check for maximum requests to execute
-            if cnt == 25:
-
-                # complete code
-                code += 'return arr;'
-                r = apply_vk_method('execute', **{'code': code})
-
-                # save responses
-                self.responses += r['response']
-                if 'execute_errors' in r:
-                    self.errors += r['execute_errors']
-
-                # process responses
-                while cnt:
-                    func = self.processors.pop(0)
-                    if func:
-                        func(r['response'][-cnt])
-                    cnt -= 1
-
-        # make last execute if need
-        if cnt:
-
-            # complete code
-            code += 'return arr;'
-            r = apply_vk_method('execute', **{'code': code})
-
-            # save responses
-            self.responses += r['response']
-            if 'execute_errors' in r:
-                self.errors.append(r['execute_errors'])
-
-            # process responses
-            while cnt:
-                func = self.processors.pop(0)
-                if func:
-                    func(r['response'][-cnt])
-                cnt -= 1
-
-        self.requests = []
-        self.processors = []
+        # in streaming mode responses of emitted packs are already saved
+        if not self.autoflush:
+            self.responses = []
+            self.errors = []
+
+        for item, response in self._emit_iter():
+            self._dispatch(item, response)
+
+    def iter_responses(self):
+        """Emit queued requests and generate their responses in order of
+        adding (processors are called too). Responses aren't saved in
+        `Executor.responses`, so memory doesn't grow with their number.
+
+        >>> e = Executor()
+        >>> for user_id in range(1, 100001):
+        >>>     e.add_request('users.get', user_ids=user_id)
+        >>> for r in e.iter_responses():
+        >>>     print(r[0]['first_name'])"""
+
+        for item, response in self._emit_iter():
+            item.handle._set(response)
+            if item.processor:
+                item.processor(response)
+            yield response
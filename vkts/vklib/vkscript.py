@@ -0,0 +1,262 @@
+#! /usr/bin/env python3
+
+"""Templates of VKScript code for method `execute`. They are used by
+`Executor` (see `Executor.add_paginated()` and parameter `select` of
+`Executor.add_request()`), so that loops run on the server side and only
+useful data leave vk.com."""
+
+import itertools
+import json
+
+# Maximum `count` of methods with pagination
+PAGE_SIZES = {'groups.getMembers': 1000,
+              'friends.get': 5000,
+              'wall.get': 100}
+
+
+def _join_params(params_s, extra_s):
+    """Add code of extra parameters to code of parameters object"""
+
+    if params_s == '{}':
+        return '{' + extra_s + '}'
+    return params_s[:-1] + ', ' + extra_s + '}'
+
+
+class Paginate:
+    """Server-side loop over pages of method with pagination. It loads pages
+    from `offset` to `end` (or to the end of list), but no more than
+    `max_pages` pages (every page costs one of 25 API calls of `execute`).
+    Result: {"count": count, "items": items of all loaded pages}
+    (or `false` if some page failed).
+
+    `end` - int or `RequestHandle` (for example, count from response
+            of previous request in the same pack)
+    `collect` - if given, only this field of every item is returned
+                (for example 'id' for `wall.get`)"""
+
+    def __init__(self, method, offset=0, end=None, page_size=None,
+                 max_pages=25, collect=None):
+        self.method = method
+        self.offset = offset
+        self.end = end
+        self.page_size = page_size if page_size else PAGE_SIZES[method]
+        self.max_pages = max_pages
+        self.collect = collect
+
+        # number of API calls
+        self.cost = max_pages
+        if isinstance(end, int):
+            pages = -(-(end - offset) // self.page_size)
+            self.cost = max(1, min(max_pages, pages))
+
+    def values(self):
+        """Parameters of template which may be handles"""
+        return [self.end]
+
+    def split(self):
+        """Two loops over halves of pages of this one"""
+
+        half = self.cost // 2
+        middle = self.offset + half * self.page_size
+        return (Paginate(self.method, self.offset, middle, self.page_size,
+                         half, self.collect),
+                Paginate(self.method, middle, self.end, self.page_size,
+                         self.cost - half, self.collect))
+
+    @staticmethod
+    def join(first, second):
+        """Result of loop from results of its halves"""
+        return {'count': max(first['count'], second['count']),
+                'items': first['items'] + second['items']}
+
+    def code(self, var, method, params_s, render):
+        """VKScript code which saves result in variable `var`.
+        `params_s` - code of other parameters of method
+        `render` - function which makes code of parameter value"""
+
+        end = self.offset + self.cost * self.page_size
+        items = var + '_page.items'
+        if self.collect:
+            items += '@.' + self.collect
+        page_params = _join_params(
+            params_s, '"offset": {}_offset, "count": {}'.format(
+                var, self.page_size))
+
+        # `$` of template is replaced by name of variable before values
+        # of parameters are inserted (they can contain `$` too)
+        def t(template):
+            return template.replace('$', var)
+
+        lines = [t('var $_items = [];'),
+                 t('var $_count = 0;'),
+                 t('var $_offset = {};').format(self.offset),
+                 t('var $_end = {};').format(end)]
+        if self.end is not None:
+            lines += ['if (' + render(self.end) + t(' < $_end) {'),
+                      t('    $_end = ') + render(self.end) + ';',
+                      '}']
+        lines += [t('var $_ok = true;'),
+                  t('var $_page;'),
+                  t('while ($_offset < $_end) {'),
+                  t('    $_page = API.') + method + '(' + page_params + ');',
+                  t('    if (!$_page) {'),
+                  t('        $_ok = false;'),
+                  t('        $_end = $_offset;'),
+                  '    } else {',
+                  t('        $_count = $_page.count;'),
+                  t('        $_items = $_items + ') + items + ';',
+                  t('        $_offset = $_offset + {};').format(
+                      self.page_size),
+                  t('        if ($_offset >= $_count) {'),
+                  t('            $_end = $_offset;'),
+                  '        }',
+                  '    }',
+                  '}',
+                  t('var $ = false;'),
+                  t('if ($_ok) {'),
+                  t('    $ = {"count": $_count, "items": $_items};'),
+                  '}']
+        return '\n'.join(lines)
+
+
+def _path_code(item, path):
+    """Code of access to field `path` ('occupation.id') of `item`"""
+    return item + ''.join('.' + x for x in path.split('.'))
+
+
+class Condition:
+    """Condition for items of list in `Select`. Conditions are made by
+    `field_eq`, `field_in`, `any_field_in` and can be combined by operators
+    `&` and `|`."""
+
+    def __init__(self, make_code):
+        self.make_code = make_code
+
+    def code(self, item, out, names):
+        """Statements of VKScript which assign to variable `out` value of
+        condition for `item`. `names` - iterator of free variable names."""
+        return self.make_code(item, out, names)
+
+    def __and__(self, other):
+        return self._combine(other, '&&')
+
+    def __or__(self, other):
+        return self._combine(other, '||')
+
+    def _combine(self, other, op):
+
+        def make_code(item, out, names):
+            a, b = next(names), next(names)
+            return ('var {} = false;\nvar {} = false;\n'.format(a, b)
+                    + self.code(item, a, names) + '\n'
+                    + other.code(item, b, names) + '\n'
+                    + '{} = {} {} {};'.format(out, a, op, b))
+
+        return Condition(make_code)
+
+
+def _one_of(expr, values):
+    return '(' + ' || '.join('{} == {}'.format(expr, json.dumps(v))
+                             for v in values) + ')'
+
+
+def field_eq(path, value):
+    """Field `path` (for example 'occupation.type') is equal to `value`"""
+    return field_in(path, (value,))
+
+
+def field_in(path, values):
+    """Field `path` (for example 'occupation.id') is one of `values`"""
+
+    def make_code(item, out, names):
+        return '{} = {};'.format(out, _one_of(_path_code(item, path), values))
+
+    return Condition(make_code)
+
+
+def any_field_in(list_path, field, values):
+    """Field `field` of some item of list `list_path` (for example
+    'universities' and 'id') is one of `values`"""
+
+    def make_code(item, out, names):
+        i, lst = next(names), next(names)
+        return '\n'.join((
+            '{} = false;'.format(out),
+            'var {} = {};'.format(lst, _path_code(item, list_path)),
+            'var {} = 0;'.format(i),
+            'while ({} < {}.length) {{'.format(i, lst),
+            '    if {} {{'.format(_one_of('{}[{}].{}'.format(lst, i, field),
+                                          values)),
+            '        {} = true;'.format(out),
+            '    }',
+            '    {0} = {0} + 1;'.format(i),
+            '}'))
+
+    return Condition(make_code)
+
+
+class Select:
+    """Server-side filtering and projection of list returned by method
+    (it's passed as parameter `select` of `Executor.add_request()`).
+
+    `fields` - fields of items to be kept (tuple) or name of single field
+               (then list of its values is returned, like VKScript `@.`)
+    `where` - object of class `Condition`, only items satisfying it are kept
+    `items` - method returns {"count": .., "items": [...]} (like
+              `friends.get`), so list `items` is processed
+
+    >>> is_mipt = field_in('occupation.id', (297, 55111))
+    >>> e.add_request('users.get', select=Select('id', is_mipt),
+    >>>               user_ids='1,2,3', fields='occupation')"""
+
+    cost = 1
+
+    def __init__(self, fields=None, where=None, items=False):
+        self.fields = fields
+        self.where = where
+        self.items = items
+
+    def values(self):
+        """Parameters of template which may be handles"""
+        return []
+
+    def _projection(self, item):
+        """Code of projection of `item`"""
+
+        if self.fields is None:
+            return item
+        if isinstance(self.fields, str):
+            return _path_code(item, self.fields)
+        return '{' + ', '.join('"{}": {}'.format(f, _path_code(item, f))
+                               for f in self.fields) + '}'
+
+    def code(self, var, method, params_s, render):
+        """VKScript code which saves result in variable `var`"""
+
+        names = ('{}_{}'.format(var, i) for i in itertools.count())
+        src, lst, res, i, item, ok = (next(names) for _ in range(6))
+        lines = ['var {} = API.{}({});'.format(src, method, params_s),
+                 'var {} = false;'.format(var),
+                 'if ({}) {{'.format(src),
+                 'var {} = {}{};'.format(lst, src,
+                                         '.items' if self.items else ''),
+                 'var {} = [];'.format(res),
+                 'var {} = 0;'.format(i),
+                 'var {};'.format(item),
+                 'var {} = true;'.format(ok),
+                 'while ({} < {}.length) {{'.format(i, lst),
+                 '{} = {}[{}];'.format(item, lst, i)]
+        if self.where is not None:
+            lines.append(self.where.code(item, ok, names))
+        lines += ['if ({}) {{'.format(ok),
+                  '    {0} = {0} + [{1}];'.format(res, self._projection(item)),
+                  '}',
+                  '{0} = {0} + 1;'.format(i),
+                  '}']
+        if self.items:
+            lines.append('{} = {{"count": {}.count, "items": {}}};'
+                         .format(var, src, res))
+        else:
+            lines.append('{} = {};'.format(var, res))
+        lines.append('}')
+        return '\n'.join(lines)